@@ -0,0 +1,447 @@
+# archive.py
+# Cold tier. Logs older than ARCHIVE_AFTER_DAYS are moved out of audit_logs into
+# immutable segment files, one per tenant and UTC day: Parquet, zstd, sorted by
+# (created_at, id), one row group per ARCHIVE_ROW_GROUP_SIZE rows. The footer of each
+# segment carries a small index (time range, action_type / severity counts, and the
+# time range and action types of every row group), so readers skip what they do not
+# need without decoding it. archive_segments catalogs the segments for the read path.
+#
+# ARCHIVE_URI is a local directory or an object store URI pyarrow understands
+# (s3://bucket/prefix, gs://...). Archiving is off when it is unset. Needs pyarrow.
+#
+# The rows of a day are written, deleted and cataloged in one transaction, the file
+# is removed again if it does not commit. Their rollups are kept: stats still count
+# archived logs, until retention deletes the segment.
+import json
+import os
+import threading
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta, timezone
+from typing import AsyncIterator, Iterator, List, Optional
+from uuid import UUID, uuid4
+
+from psycopg import Connection, Cursor
+from starlette.concurrency import run_in_threadpool
+
+from cache import response_cache
+from db import pool
+from export import EXPORT_COLUMNS_SQL, arrow_schema
+
+ARCHIVE_URI = os.getenv("ARCHIVE_URI")
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "90"))
+ARCHIVE_CHECK_SECONDS = float(os.getenv("ARCHIVE_CHECK_SECONDS", "3600"))
+ARCHIVE_DAYS_PER_RUN = int(os.getenv("ARCHIVE_DAYS_PER_RUN", "100"))   # tenant days archived per run
+ARCHIVE_ROW_GROUP_SIZE = int(os.getenv("ARCHIVE_ROW_GROUP_SIZE", "10000"))
+
+INDEX_KEY = b"audit_logs.index"
+UUID_COLUMNS = ("id", "tenant_id", "user_id")
+JSON_COLUMNS = ("before_state", "after_state", "metadata")
+
+# Tenant days past the cutoff still in audit_logs, oldest first
+PENDING_SQL = """
+SELECT tenant_id, (date_trunc('day', created_at, 'UTC') AT TIME ZONE 'UTC')::date AS day
+FROM audit_logs
+WHERE created_at < %s
+GROUP BY 1, 2
+ORDER BY 2, 1
+LIMIT %s;
+"""
+
+# Locked: a concurrent delete waits, so the rows deleted are the rows written
+ROWS_SQL = f"""
+SELECT {EXPORT_COLUMNS_SQL} FROM audit_logs
+WHERE tenant_id = %s AND created_at >= %s AND created_at < %s
+ORDER BY created_at, id
+FOR UPDATE;
+"""
+
+DELETE_SQL = "DELETE FROM audit_logs WHERE tenant_id = %s AND created_at >= %s AND created_at < %s;"
+
+INSERT_SEGMENT_SQL = """
+INSERT INTO archive_segments (tenant_id, day, path, rows, bytes, min_created_at, max_created_at, action_types, counts)
+VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+RETURNING id, tenant_id, day, path, rows, bytes, min_created_at, max_created_at;
+"""
+
+# Segments wholly before the cutoff, their rows taken out of the rollups
+DROP_SEGMENTS_SQL = """
+WITH dropped AS (
+    DELETE FROM archive_segments
+    WHERE (%(tenant_id)s::uuid IS NULL OR tenant_id = %(tenant_id)s) AND max_created_at < %(before)s
+    RETURNING tenant_id, path, rows, counts
+), deltas AS (
+    INSERT INTO audit_log_rollup_deltas (tenant_id, bucket, action_type, severity, count)
+    SELECT d.tenant_id, (c->>0)::timestamptz, c->>1, c->>2, -(c->>3)::bigint
+    FROM dropped d, jsonb_array_elements(d.counts) AS c
+)
+SELECT path, rows FROM dropped;
+"""
+
+BACKLOG_SQL = "SELECT COUNT(*) AS segments, COALESCE(SUM(rows), 0)::bigint AS archived_rows, " \
+              "COALESCE(SUM(bytes), 0)::bigint AS archived_bytes FROM archive_segments;"
+
+def segments_query(tenant_id, from_: Optional[datetime] = None, to: Optional[datetime] = None,
+                   action_type: Optional[str] = None) -> tuple:
+    """
+    Catalog lookup of the tenant's segments overlapping [from_, to), optionally holding an action_type
+    :return: (sql, params)
+    """
+    conditions = ["tenant_id = %s"]
+    params: list = [tenant_id]
+    if from_:
+        conditions.append("max_created_at >= %s")
+        params.append(from_)
+    if to:
+        conditions.append("min_created_at < %s")
+        params.append(to)
+    if action_type:
+        conditions.append("action_types ? %s")
+        params.append(action_type)
+    sql = "SELECT path, rows, min_created_at, max_created_at FROM archive_segments WHERE "
+    return sql + " AND ".join(conditions) + " ORDER BY min_created_at;", params
+
+def segment_path(tenant_id, day: date) -> str:
+    return f"tenant={tenant_id}/{day:%Y/%m/%d}/{uuid4().hex}.parquet"
+
+class SegmentIndex:
+    """
+    Footer index of a segment and the rollup counts of its rows, built while it is written
+    """
+    def __init__(self, tenant_id, day: date):
+        self.tenant_id = str(tenant_id)
+        self.day = day
+        self.rows = 0
+        self.action_types: Counter = Counter()
+        self.severities: Counter = Counter()
+        self.counts: Counter = Counter()   # (hour, action_type, severity) -> rows
+        self.row_groups: List[dict] = []
+
+    def add(self, rows: List[dict]):
+        self.rows += len(rows)
+        for row in rows:
+            self.action_types[row["action_type"]] += 1
+            self.severities[row["severity"]] += 1
+            hour = row["created_at"].astimezone(timezone.utc).replace(minute=0, second=0, microsecond=0)
+            self.counts[(hour.isoformat(), row["action_type"], row["severity"])] += 1
+        self.row_groups.append({"min": rows[0]["created_at"].isoformat(), "max": rows[-1]["created_at"].isoformat(),
+                                "action_types": sorted({row["action_type"] for row in rows})})
+
+    @property
+    def min_created_at(self) -> str:
+        return self.row_groups[0]["min"]
+
+    @property
+    def max_created_at(self) -> str:
+        return self.row_groups[-1]["max"]
+
+    def footer(self) -> dict:
+        return {"tenant_id": self.tenant_id, "day": self.day.isoformat(), "rows": self.rows,
+                "min_created_at": self.min_created_at, "max_created_at": self.max_created_at,
+                "action_types": dict(self.action_types), "severities": dict(self.severities),
+                "row_groups": self.row_groups}
+
+def row_groups(index: dict, from_: Optional[datetime] = None, to: Optional[datetime] = None,
+               action_type: Optional[str] = None) -> List[int]:
+    """
+    Row groups of a segment that may hold rows in [from_, to), from its footer index
+    :return: row group numbers, in (created_at, id) order
+    """
+    selected = []
+    for number, group in enumerate(index["row_groups"]):
+        if from_ and datetime.fromisoformat(group["max"]) < from_:
+            continue
+        if to and datetime.fromisoformat(group["min"]) >= to:
+            continue
+        if action_type and action_type not in group["action_types"]:
+            continue
+        selected.append(number)
+    return selected
+
+def typed_row(row: dict) -> dict:
+    # Archived columns are text, as the export renders them: back to the types psycopg returns
+    for column in UUID_COLUMNS:
+        if row.get(column) is not None:
+            row[column] = UUID(row[column])
+    for column in JSON_COLUMNS:
+        if row.get(column) is not None:
+            row[column] = json.loads(row[column])
+    return row
+
+class SegmentStore:
+    def __init__(self, uri: str):
+        import pyarrow.fs
+        if "://" not in uri:
+            uri = os.path.abspath(uri)
+        self.fs, self.root = pyarrow.fs.FileSystem.from_uri(uri)
+
+    def location(self, path: str) -> str:
+        return f"{self.root.rstrip('/')}/{path}"
+
+    def write(self, path: str, batches: Iterator[List[dict]], index: SegmentIndex) -> int:
+        """
+        Write the row batches as one segment, one row group per batch. The file appears
+        under its name once complete.
+        :return: file size in bytes, 0 when there were no rows
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        location = self.location(path)
+        temporary = f"{location}.{uuid4().hex}.tmp"
+        self.fs.create_dir(location.rsplit("/", 1)[0], recursive=True)
+        schema = arrow_schema()
+        try:
+            with self.fs.open_output_stream(temporary) as stream:
+                writer = pq.ParquetWriter(stream, schema, compression="zstd")
+                for rows in batches:
+                    writer.write_batch(pa.RecordBatch.from_pylist(rows, schema=schema))
+                    index.add(rows)
+                if index.rows:
+                    writer.add_key_value_metadata({INDEX_KEY: json.dumps(index.footer())})
+                writer.close()
+            if not index.rows:
+                self.fs.delete_file(temporary)
+                return 0
+            self.fs.move(temporary, location)
+        except BaseException:
+            self.delete(temporary)
+            raise
+        return self.fs.get_file_info(location).size
+
+    def delete(self, path: str):
+        import pyarrow.fs
+        location = path if path.startswith(self.root) else self.location(path)
+        if self.fs.get_file_info(location).type != pyarrow.fs.FileType.NotFound:
+            self.fs.delete_file(location)
+
+    def open(self, path: str):
+        """
+        :return: (ParquetFile, footer index)
+        """
+        import pyarrow.parquet as pq
+        segment = pq.ParquetFile(self.fs.open_input_file(self.location(path)))
+        return segment, json.loads(segment.metadata.metadata[INDEX_KEY])
+
+def _filter(from_=None, to=None, after=None, equals: Optional[dict] = None):
+    import pyarrow.compute as pc
+    expression = None
+    conditions = []
+    if from_:
+        conditions.append(pc.field("created_at") >= from_)
+    if to:
+        conditions.append(pc.field("created_at") < to)
+    if after:
+        # Keyset position: canonical UUID text sorts like the uuid type
+        conditions.append((pc.field("created_at") > after[0])
+                          | ((pc.field("created_at") == after[0]) & (pc.field("id") > str(after[1]))))
+    for column, value in (equals or {}).items():
+        conditions.append(pc.field(column) == str(value))
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+    return expression
+
+class Archiver:
+    def __init__(self, uri: Optional[str] = ARCHIVE_URI, after_days: int = ARCHIVE_AFTER_DAYS,
+                 interval: float = ARCHIVE_CHECK_SECONDS, days_per_run: int = ARCHIVE_DAYS_PER_RUN,
+                 row_group_size: int = ARCHIVE_ROW_GROUP_SIZE):
+        self.uri = uri
+        self.after_days = after_days
+        self.interval = interval
+        self.days_per_run = days_per_run
+        self.row_group_size = row_group_size
+        self._store = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self.counters = {"segments": 0, "rows": 0, "bytes": 0, "runs": 0, "errors": 0,
+                         "segments_dropped": 0, "segments_read": 0, "row_groups_read": 0}
+        self.last_run_at = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.uri is not None
+
+    @property
+    def store(self) -> SegmentStore:
+        if self._store is None:
+            self._store = SegmentStore(self.uri)
+        return self._store
+
+    def start(self):
+        if self._thread or not self.enabled:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="archiver", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 30.0):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+        self._thread = None
+
+    def run_once(self, conn: Connection) -> int:
+        """
+        Archive the oldest tenant days past ARCHIVE_AFTER_DAYS, up to days_per_run of them
+        :return: number of segments written
+        """
+        cutoff = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0) \
+            - timedelta(days=self.after_days)
+        with conn.transaction():
+            with conn.cursor() as curr:
+                curr.execute(PENDING_SQL, (cutoff, self.days_per_run))
+                pending = curr.fetchall()
+
+        written = 0
+        for day in pending:
+            if self._stop.is_set():
+                break
+            if self.archive_day(conn, day["tenant_id"], day["day"]):
+                written += 1
+
+        with self._lock:
+            self.counters["runs"] += 1
+            self.last_run_at = time.time()
+        return written
+
+    def archive_day(self, conn: Connection, tenant_id, day: date) -> Optional[dict]:
+        """
+        Move a tenant's logs of one UTC day into a segment
+        :return: the cataloged segment, None when the day had no rows
+        """
+        start = datetime(day.year, day.month, day.day, tzinfo=timezone.utc)
+        bounds = (tenant_id, start, start + timedelta(days=1))
+        path = segment_path(tenant_id, day)
+        index = SegmentIndex(tenant_id, day)
+
+        with conn.transaction():
+            try:
+                with conn.cursor(name=f"archive_{uuid4().hex}") as server_curr:
+                    server_curr.execute(ROWS_SQL, bounds)
+                    size = self.store.write(path, iter(lambda: server_curr.fetchmany(self.row_group_size), []), index)
+                if not index.rows:
+                    return None
+
+                with conn.cursor() as curr:
+                    # Archived logs stay in the rollups
+                    curr.execute("SELECT set_config('audit_logs.archiving', 'on', true);")
+                    curr.execute(DELETE_SQL, bounds)
+                    deleted = curr.rowcount
+                    curr.execute("SELECT set_config('audit_logs.archiving', 'off', true);")
+                    if deleted != index.rows:
+                        raise RuntimeError(f"Archived {index.rows} rows but deleted {deleted}")
+                    counts = [[hour, action_type, severity, count]
+                              for (hour, action_type, severity), count in index.counts.items()]
+                    curr.execute(INSERT_SEGMENT_SQL, (
+                        tenant_id, day, path, index.rows, size, index.min_created_at, index.max_created_at,
+                        json.dumps(dict(index.action_types)), json.dumps(counts)))
+                    segment = curr.fetchone()
+            except BaseException:
+                self.store.delete(path)
+                raise
+
+        # Cached pages hold the rows as they were read, from audit_logs
+        response_cache.invalidate(str(tenant_id))
+        with self._lock:
+            self.counters["segments"] += 1
+            self.counters["rows"] += index.rows
+            self.counters["bytes"] += size
+        return segment
+
+    def drop_segments(self, conn: Connection, before: datetime, tenant_id=None) -> int:
+        """
+        Delete the segments (of a tenant, or all) whose logs are all older than before,
+        their rows are taken out of the rollups. Files go once the catalog rows are gone.
+        :return: number of logs the dropped segments held
+        """
+        with conn.transaction():
+            with conn.cursor() as curr:
+                curr.execute(DROP_SEGMENTS_SQL, {"tenant_id": tenant_id, "before": before})
+                dropped = curr.fetchall()
+        for segment in dropped:
+            self.store.delete(segment["path"])
+        with self._lock:
+            self.counters["segments_dropped"] += len(dropped)
+        return sum(segment["rows"] for segment in dropped)
+
+    def search(self, segments: List[dict], columns: List[str], limit: int, from_: Optional[datetime] = None,
+               to: Optional[datetime] = None, after: Optional[tuple] = None, equals: Optional[dict] = None) -> List[dict]:
+        """
+        First limit + 1 archived logs in (created_at, id) order, segments in min_created_at order.
+        Reading stops once no later row group can come before them.
+        :return: rows, typed as the audit_logs query returns them
+        """
+        bounds = [value for value in (from_, after[0] if after else None) if value]
+        lower = max(bounds) if bounds else None
+        expression = _filter(from_, to, after, equals)
+        found: List[dict] = []
+        for segment in segments:
+            if len(found) > limit and found[limit]["created_at"] < segment["min_created_at"]:
+                break
+            parquet, index = self.store.open(segment["path"])
+            with self._lock:
+                self.counters["segments_read"] += 1
+            for number in row_groups(index, lower, to, (equals or {}).get("action_type")):
+                group_start = datetime.fromisoformat(index["row_groups"][number]["min"])
+                if len(found) > limit and found[limit]["created_at"] < group_start:
+                    break
+                table = parquet.read_row_group(number).filter(expression) if expression is not None \
+                    else parquet.read_row_group(number)
+                with self._lock:
+                    self.counters["row_groups_read"] += 1
+                found.extend(typed_row(row) for row in table.select(columns).to_pylist())
+                found.sort(key=lambda row: (row["created_at"], row["id"]))
+        return found[:limit + 1]
+
+    async def iter_tables(self, segments: List[dict], from_: Optional[datetime] = None,
+                          to: Optional[datetime] = None) -> AsyncIterator:
+        """
+        Archived logs in [from_, to), newest first as the export orders them, one row group at a time
+        :return: pyarrow Tables with the export schema
+        """
+        expression = _filter(from_, to)
+        for segment in sorted(segments, key=lambda segment: segment["max_created_at"], reverse=True):
+            parquet, index = await run_in_threadpool(self.store.open, segment["path"])
+            for number in reversed(row_groups(index, from_, to)):
+                table = await run_in_threadpool(self._read_desc, parquet, number, expression)
+                if table.num_rows:
+                    yield table
+
+    def _read_desc(self, parquet, number: int, expression):
+        table = parquet.read_row_group(number)
+        if expression is not None:
+            table = table.filter(expression)
+        with self._lock:
+            self.counters["row_groups_read"] += 1
+        return table.sort_by([("created_at", "descending"), ("id", "descending")])
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                **self.counters,
+                "enabled": self.enabled,
+                "after_days": self.after_days,
+                "seconds_since_last_run": round(time.time() - self.last_run_at, 3) if self.last_run_at else None,
+                "running": self._thread is not None,
+            }
+
+    def backlog(self, curr: Cursor) -> dict:
+        curr.execute(BACKLOG_SQL)
+        return curr.fetchone()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                with pool.connection() as conn:
+                    written = self.run_once(conn)
+            except Exception as e:
+                print("Archiver error:", e)
+                with self._lock:
+                    self.counters["errors"] += 1
+                written = 0
+            # Keep going while there is a backlog
+            if written < self.days_per_run:
+                self._stop.wait(self.interval)
+
+archiver = Archiver()
@@ -1,23 +1,238 @@
 # To execute authentication
+#
+# verify_jwt checks the Bearer token and returns its typed Claims. Clients reuse one
+# token for thousands of calls, so verified claims are cached by token digest until
+# the token expires (and for JWT_CACHE_TTL seconds at most). The verification key is
+# picked by the token's kid. Keys are prepared once when added, so public keys (RS*,
+# ES*, PS*, EdDSA, which need the cryptography package) are not re-parsed per call.
+import base64
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
 from datetime import datetime, timedelta
+from types import MappingProxyType
+from typing import Any, Dict, Mapping, NamedTuple, Optional
+from uuid import UUID
+
 from fastapi import Depends, HTTPException, status
+from starlette.websockets import WebSocket
 from fastapi.security import OAuth2PasswordBearer, HTTPBearer, HTTPAuthorizationCredentials
 
 import jwt
+from jwt.algorithms import get_default_algorithms
+
+from cache import LRUCache
+from profiling import span
 
-SECRET_KEY = "sample-secret"
+SECRET_KEY = os.getenv("JWT_SECRET_KEY", "sample-secret")
 ALGORITHM = "HS256"
+JWT_KEYS = os.getenv("JWT_KEYS")   # JSON list of {"kid", "alg", "key" | "key_file"}, replaces SECRET_KEY
+JWT_CACHE_SIZE = int(os.getenv("JWT_CACHE_SIZE", "10000"))   # verified tokens kept, 0 disables the cache
+JWT_CACHE_TTL = float(os.getenv("JWT_CACHE_TTL", "300"))      # seconds, bounds how long a removed key stays trusted
+JWT_LEEWAY = float(os.getenv("JWT_LEEWAY", "0"))              # seconds of clock skew allowed on exp / nbf
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")                     # operator token for /metrics*, replaces the admin JWT check
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 security = HTTPBearer()
 
-def verify_jwt(credentials: HTTPAuthorizationCredentials = Depends(security)):
+class Claims(NamedTuple):
+    """
+    Verified token claims, tenant id parsed once per token
+    """
+    tenant_id: UUID
+    role: Optional[str]
+    sub: Optional[str]
+    expires_at: Optional[float]
+    payload: Mapping[str, Any]   # every claim, read-only
+
+    @classmethod
+    def from_payload(cls, payload: dict) -> "Claims":
+        try:
+            tenant_id = UUID(str(payload["tenant_id"]))
+        except (KeyError, ValueError):
+            raise jwt.InvalidTokenError("Missing or invalid tenant_id claim")
+        return cls(tenant_id=tenant_id, role=payload.get("role"), sub=payload.get("sub"),
+                   expires_at=payload.get("exp"), payload=MappingProxyType(payload))
+
+class VerificationKey(NamedTuple):
+    kid: Optional[str]
+    algorithm: str
+    key: Any   # prepared: bytes for HMAC, a key object for the asymmetric algorithms
+
+def token_kid(token: str) -> Optional[str]:
+    # Reads the header segment only, jwt.get_unverified_header would parse (and jwt.decode
+    # then re-parse) the whole token. The kid is verified with the signature anyway.
+    segment = token.split(".", 1)[0]
+    try:
+        header = json.loads(base64.urlsafe_b64decode(segment + "=" * (-len(segment) % 4)))
+    except (ValueError, TypeError):
+        raise jwt.DecodeError("Invalid token header")
+    if not isinstance(header, dict):
+        raise jwt.DecodeError("Invalid token header")
+    return header.get("kid")
+
+class TokenVerifier:
+    def __init__(self, cache_size: int = JWT_CACHE_SIZE, cache_ttl: float = JWT_CACHE_TTL, leeway: float = JWT_LEEWAY):
+        self.cache_ttl = cache_ttl
+        self.leeway = leeway
+        self._keys: Dict[Optional[str], VerificationKey] = {}
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "evictions": 0, "failures": 0}
+        self.cache = LRUCache(cache_size, cache_ttl, on_evict=lambda: self._count("evictions")) if cache_size else None
+
+    def _count(self, name: str):
+        with self._lock:
+            self.counters[name] += 1
+
+    def add_key(self, kid: Optional[str], algorithm: str, key: Any):
+        """
+        Trust a key for the tokens carrying kid (kid None: tokens without one)
+        :return: None
+        """
+        algorithms = get_default_algorithms()
+        if algorithm == "none" or algorithm not in algorithms:
+            raise ValueError(f"Unsupported JWT algorithm {algorithm} (asymmetric ones need the cryptography package)")
+        prepared = algorithms[algorithm].prepare_key(key)
+        with self._lock:
+            self._keys[kid] = VerificationKey(kid, algorithm, prepared)
+
+    def remove_key(self, kid: Optional[str]):
+        """
+        Stop trusting a key, the tokens it verified are dropped from the cache
+        :return: None
+        """
+        with self._lock:
+            self._keys.pop(kid, None)
+        if self.cache:
+            self.cache.clear()
+
+    def key_for(self, kid: Optional[str]) -> VerificationKey:
+        with self._lock:
+            key = self._keys.get(kid)
+            # A single key also verifies tokens without kid
+            if key is None and kid is None and len(self._keys) == 1:
+                key = next(iter(self._keys.values()))
+        if key is None:
+            raise jwt.InvalidKeyError(f"Unknown key id {kid}")
+        return key
+
+    def decode(self, token: str) -> Claims:
+        """
+        Full verification: signature with the kid's key, exp / nbf, then the claims
+        :return: claims
+        """
+        key = self.key_for(token_kid(token))
+        payload = jwt.decode(token, key.key, algorithms=[key.algorithm], leeway=self.leeway)
+        return Claims.from_payload(payload)
+
+    def verify(self, token: str) -> Claims:
+        """
+        Claims of a token, from the cache when it was verified already
+        :return: claims
+        """
+        if self.cache is None:
+            return self._decode_counted(token)
+        digest = hashlib.blake2b(token.encode(), digest_size=32).digest()
+        claims = self.cache.get(digest)
+        if claims is not None:
+            self._count("hits")
+            return claims
+        self._count("misses")
+        claims = self._decode_counted(token)
+
+        # Never cached past the token's expiry
+        ttl = self.cache_ttl
+        if claims.expires_at is not None:
+            ttl = min(ttl, claims.expires_at + self.leeway - time.time())
+        if ttl > 0:
+            self.cache.set(digest, claims, ttl=ttl)
+        return claims
+
+    def _decode_counted(self, token: str) -> Claims:
+        try:
+            return self.decode(token)
+        except jwt.PyJWTError:
+            self._count("failures")
+            raise
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self.counters)
+            kids = sorted(str(kid) for kid in self._keys)
+        lookups = counters["hits"] + counters["misses"]
+        return {**counters, "hit_rate": counters["hits"] / lookups if lookups else 0.0,
+                "entries": len(self.cache) if self.cache else 0, "keys": kids}
+
+def load_keys(verifier: TokenVerifier, keys_json: Optional[str] = JWT_KEYS):
+    """
+    Keys from JWT_KEYS, or SECRET_KEY (HS256) when it is not set
+    :return: None
+    """
+    if not keys_json:
+        verifier.add_key(None, ALGORITHM, SECRET_KEY)
+        return
+    for entry in json.loads(keys_json):
+        key = entry.get("key")
+        if key is None:
+            with open(entry["key_file"]) as f:
+                key = f.read()
+        verifier.add_key(entry.get("kid"), entry.get("alg", ALGORITHM), key)
+
+verifier = TokenVerifier()
+load_keys(verifier)
+
+async def verify_jwt(credentials: HTTPAuthorizationCredentials = Depends(security)) -> Claims:
+    # async: a cache hit costs a dict lookup, no threadpool hop
     try:
-        payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
-        return payload # include "tenant_id", "role", "sub" etc.
+        with span("auth"):
+            return verifier.verify(credentials.credentials)
     except jwt.PyJWTError:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid JWT token")
 
+def websocket_claims(websocket: WebSocket, token: Optional[str] = None) -> Optional[Claims]:
+    """
+    Claims of a WebSocket client, from its Authorization header or the token query
+    parameter (browsers cannot set headers on a WebSocket)
+    :return: claims, None when there is no valid token
+    """
+    if token is None:
+        scheme, _, token = websocket.headers.get("authorization", "").partition(" ")
+        if scheme.lower() != "bearer" or not token:
+            return None
+    try:
+        return verifier.verify(token)
+    except jwt.PyJWTError:
+        return None
+
+async def verify_metrics_access(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    """
+    Guard of the operator endpoints: the METRICS_TOKEN bearer token when it is set,
+    otherwise a valid JWT with the admin role
+    :return: None
+    """
+    if METRICS_TOKEN:
+        if not hmac.compare_digest(credentials.credentials.encode(), METRICS_TOKEN.encode()):
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid metrics token")
+        return
+    user = await verify_jwt(credentials)
+    if user.role != "admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin role required")
+
+def is_operator_token(token: str) -> bool:
+    """
+    Same rule as verify_metrics_access, for callers outside a dependency (X-Profile)
+    :return: True for the METRICS_TOKEN, or an admin JWT when it is not set
+    """
+    if METRICS_TOKEN:
+        return hmac.compare_digest(token.encode(), METRICS_TOKEN.encode())
+    try:
+        return verifier.verify(token).role == "admin"
+    except jwt.PyJWTError:
+        return False
+
 def generate_mock_jwt():
     payload = {
         "sub": "user123",
@@ -0,0 +1,97 @@
+# Cold tier: archiving throughput, size on disk vs in audit_logs, and the latency of a
+# search page over an old time range, served from audit_logs vs from the segments.
+# Rows are seeded for one tenant over past days, everything is rolled back and the
+# segments are written to a temporary directory.
+#
+#   python benchmarks/bench_archive.py [rows] [days] [--runs N]
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import psycopg
+from psycopg.rows import dict_row
+
+from archive import Archiver, segments_query
+from db import CONNINFO
+from routers.audit_logs import LOG_FIELDS, build_search_query
+from bench_bulk_insert import TENANT_ID
+
+# Spread over the days before the archive cutoff, in that many days
+SEED_SQL = """
+INSERT INTO audit_logs (tenant_id, user_id, session_id, ip_address, user_agent, action_type, resource_type,
+                        resource_id, severity, before_state, after_state, metadata, created_at)
+SELECT %(tenant)s, gen_random_uuid(), 'sess-' || (i %% 1000), '10.0.0.1', 'bench/1.0',
+       (ARRAY['CREATE', 'UPDATE', 'DELETE', 'VIEW'])[1 + i %% 4], 'order', 'order-' || i,
+       (ARRAY['INFO', 'INFO', 'WARNING', 'ERROR'])[1 + i %% 4],
+       jsonb_build_object('status', 'pending'), jsonb_build_object('status', 'paid'),
+       jsonb_build_object('request', i, 'note', 'routine update'),
+       now() - interval '100 days' - make_interval(secs => (i::float8 / %(rows)s) * %(days)s * 86400)
+FROM generate_series(1, %(rows)s) AS i;
+"""
+
+SIZE_SQL = """
+SELECT pg_column_size(a.*) AS bytes FROM audit_logs a WHERE tenant_id = %s AND created_at < now() - interval '90 days'
+"""
+
+def timed(call, runs: int) -> float:
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        call()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+def main(rows: int, days: int, runs: int):
+    with psycopg.connect(CONNINFO, row_factory=dict_row) as conn, tempfile.TemporaryDirectory() as directory:
+        with conn.cursor() as curr:
+            curr.execute("SELECT create_audit_log_partitions(now() - make_interval(days => %s), now());",
+                         (100 + days + 31,))
+            curr.execute(SEED_SQL, {"tenant": TENANT_ID, "rows": rows, "days": days})
+            curr.execute("ANALYZE audit_logs;")
+            curr.execute(f"SELECT COALESCE(SUM(bytes), 0) AS bytes FROM ({SIZE_SQL}) AS r;", (TENANT_ID,))
+            heap_bytes = curr.fetchone()["bytes"]
+            curr.execute("SELECT now() - interval '100 days' - make_interval(days => %s) AS start;", (days,))
+            start = curr.fetchone()["start"]
+
+            # A page in the middle of the archived range, before and after archiving
+            middle = start + timedelta(days=days / 2)
+            sql, params = build_search_query(TENANT_ID, list(LOG_FIELDS), 100, from_=middle)
+
+            def hot_page():
+                curr.execute(sql, params)
+                curr.fetchall()
+            hot = timed(hot_page, runs)
+
+            archiver = Archiver(uri=directory, after_days=90, days_per_run=days + 2)
+            began = time.perf_counter()
+            segments = archiver.run_once(conn)
+            elapsed = time.perf_counter() - began
+            stats = archiver.stats()
+
+            segment_sql, segment_params = segments_query(TENANT_ID, middle)
+
+            def archived_page():
+                curr.execute(segment_sql, segment_params)
+                archiver.search(curr.fetchall(), list(LOG_FIELDS), 100, from_=middle)
+            archived = timed(archived_page, runs)
+
+        conn.rollback()
+
+    print(f"archived {stats['rows']} rows into {segments} segments in {elapsed:.1f}s "
+          f"({stats['rows'] / elapsed:,.0f} rows/s)")
+    print(f"size: {heap_bytes / 2**20:.1f} MB of rows in audit_logs (indexes not counted), "
+          f"{stats['bytes'] / 2**20:.1f} MB of segments")
+    print(f"search page over an old range: audit_logs {hot:.2f} ms, segments {archived:.2f} ms")
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    runs = 5
+    if "--runs" in args:
+        runs = int(args[args.index("--runs") + 1])
+        del args[args.index("--runs"):args.index("--runs") + 2]
+    main(int(args[0]) if args else 500000, int(args[1]) if len(args) > 1 else 30, runs)
@@ -0,0 +1,54 @@
+# Rows/sec of the bulk insert paths in ingest.py against a local Postgres.
+# Every run is rolled back, so the benchmark leaves no rows behind.
+#
+#   python benchmarks/bench_bulk_insert.py [rows] [chunk_size]
+import asyncio
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import psycopg
+from psycopg.rows import dict_row
+
+import schemas
+from db import CONNINFO
+from ingest import bulk_insert_logs
+
+TENANT_ID = uuid.uuid4()
+
+def make_logs(count: int) -> list:
+    return [
+        schemas.Log(
+            tenant_id=TENANT_ID, user_id=uuid.uuid4(), session_id=f"sess-{i % 100}",
+            ip_address="10.0.0.1", user_agent="bench/1.0", action_type="UPDATE",
+            resource_type="document", resource_id=f"doc-{i}", severity="INFO",
+            before_state={"title": "draft", "version": i}, after_state={"title": "final", "version": i + 1},
+            metadata={"source": "bench", "tags": ["a", "b"]},
+        )
+        for i in range(count)
+    ]
+
+async def run(method: str, logs: list, chunk_size: int) -> float:
+    async with await psycopg.AsyncConnection.connect(CONNINFO, row_factory=dict_row) as conn:
+        async with conn.cursor() as curr:
+            start = time.perf_counter()
+            inserted = await bulk_insert_logs(curr, logs, chunk_size=chunk_size, method=method)
+            elapsed = time.perf_counter() - start
+        await conn.rollback()
+    assert inserted == len(logs)
+    return elapsed
+
+async def main(rows: int, chunk_size: int):
+    logs = make_logs(rows)
+    print(f"{rows} rows, chunk size {chunk_size}")
+    for method in ("executemany", "unnest", "copy"):
+        elapsed = await run(method, logs, chunk_size)
+        print(f"{method:<12} {elapsed:8.3f} s  {rows / elapsed:10.0f} rows/s")
+
+if __name__ == "__main__":
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    chunk_size = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+    asyncio.run(main(rows, chunk_size))
@@ -0,0 +1,67 @@
+# Bytes and seconds per million rows of the export formats against a local Postgres.
+# The seeded rows are rolled back at the end.
+#
+#   python benchmarks/bench_export.py [rows]
+import asyncio
+import csv
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import psycopg
+from psycopg.rows import dict_row
+
+from db import CONNINFO, stream_copy
+from export import iter_arrow, iter_ndjson
+from ingest import bulk_insert_logs
+from bench_bulk_insert import TENANT_ID, make_logs
+
+WHERE_SQL = "tenant_id = %s"
+SELECT_SQL = f"SELECT * FROM audit_logs WHERE {WHERE_SQL} ORDER BY created_at DESC"
+
+async def csv_writer_baseline(curr, params):
+    # The previous export: fetchall() then csv.writer row by row
+    await curr.execute(SELECT_SQL, params)
+    rows = await curr.fetchall()
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(rows[0].keys())
+    yield buffer.getvalue().encode()
+    for row in rows:
+        buffer.seek(0)
+        buffer.truncate(0)
+        writer.writerow(row.values())
+        yield buffer.getvalue().encode()
+
+async def measure(chunks) -> tuple:
+    start = time.perf_counter()
+    size = 0
+    async for chunk in chunks:
+        size += len(chunk)
+    return size, time.perf_counter() - start
+
+async def main(rows: int):
+    async with await psycopg.AsyncConnection.connect(CONNINFO, row_factory=dict_row) as conn:
+        async with conn.cursor() as curr:
+            await bulk_insert_logs(curr, make_logs(rows), method="copy")
+            params = [TENANT_ID]
+            exports = {
+                "csv (fetchall + csv.writer)": lambda: csv_writer_baseline(curr, params),
+                "csv (COPY TO STDOUT)": lambda: stream_copy(curr, f"COPY ({SELECT_SQL}) TO STDOUT WITH (FORMAT CSV, HEADER)", params),
+                "ndjson": lambda: iter_ndjson(curr, WHERE_SQL, params),
+                "parquet (zstd)": lambda: iter_arrow(curr, WHERE_SQL, params, "parquet"),
+                "arrow (zstd)": lambda: iter_arrow(curr, WHERE_SQL, params, "arrow"),
+            }
+
+            scale = 1_000_000 / rows
+            print(f"{rows} rows, figures scaled to 1M rows")
+            for name, export in exports.items():
+                size, elapsed = await measure(export())
+                print(f"{name:<28} {size * scale / 1e6:9.1f} MB  {elapsed * scale:7.2f} s")
+        await conn.rollback()
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000))
@@ -0,0 +1,137 @@
+# Time-bounded query latency on one heap table vs monthly partitions (migration 0006),
+# the same rows in both. Scratch tables spread rows evenly over the last months and
+# a few tenants, with the (tenant_id, created_at, id) index of audit_logs, and are
+# rolled back at the end.
+#
+#   python benchmarks/bench_partitions.py [rows] [months] [--runs N]
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import psycopg
+from psycopg import sql
+from psycopg.rows import dict_row
+
+from db import CONNINFO
+from bench_bulk_insert import TENANT_ID
+
+TENANTS = 10
+
+COLUMNS = """
+id UUID NOT NULL DEFAULT gen_random_uuid(), tenant_id UUID NOT NULL,
+action_type TEXT NOT NULL, resource_id TEXT, severity TEXT NOT NULL,
+metadata JSONB, created_at TIMESTAMPTZ NOT NULL
+"""
+
+SETUP_SQL = f"""
+CREATE TABLE bench_heap ({COLUMNS});
+CREATE TABLE bench_parts ({COLUMNS}) PARTITION BY RANGE (created_at);
+CREATE TABLE bench_parts_default PARTITION OF bench_parts DEFAULT;
+"""
+
+PARTITION_SQL = """
+CREATE TABLE {name} PARTITION OF bench_parts FOR VALUES FROM ({start}) TO ({end});
+"""
+
+# Tenant i % TENANTS, TENANT_ID is tenant 0; created_at evenly spread over the months
+SEED_SQL = """
+INSERT INTO {table} (tenant_id, action_type, resource_id, severity, metadata, created_at)
+SELECT CASE WHEN i %% {tenants} = 0 THEN %(tenant)s::uuid
+            ELSE md5((i %% {tenants})::text)::uuid END,
+       'UPDATE', 'order-' || i, 'INFO', jsonb_build_object('request', i),
+       %(start)s + (%(end)s - %(start)s) * (i::float8 / %(rows)s)
+FROM generate_series(1, %(rows)s) AS i;
+"""
+
+INDEX_SQL = """
+CREATE INDEX ON {table} (tenant_id, created_at, id);
+ANALYZE {table};
+"""
+
+# The search, cursor page and export statements of routers/audit_logs.py
+QUERIES = {
+    "search, one week": """
+SELECT * FROM {table} WHERE tenant_id = %(tenant)s AND created_at >= %(from)s AND created_at <= %(to)s
+ORDER BY created_at, id LIMIT 100;
+""",
+    "cursor page, mid-history": """
+SELECT * FROM {table} WHERE tenant_id = %(tenant)s AND created_at >= %(from)s
+AND (created_at, id) > (%(from)s, '00000000-0000-0000-0000-000000000000'::uuid)
+ORDER BY created_at, id LIMIT 100;
+""",
+    "export, one month": """
+SELECT * FROM {table} WHERE tenant_id = %(tenant)s AND created_at >= %(month)s AND created_at < %(month_end)s
+ORDER BY created_at, id;
+""",
+}
+
+INDEX_SIZES_SQL = """
+SELECT pg_indexes_size('bench_heap') AS heap,
+       (SELECT max(pg_indexes_size(inhrelid)) FROM pg_inherits
+        WHERE inhparent = 'bench_parts'::regclass) AS partition;
+"""
+
+def timed(curr, statement, params, runs: int) -> float:
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        curr.execute(statement, params)
+        curr.fetchall()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+def main(rows: int, months: int, runs: int):
+    with psycopg.connect(CONNINFO, row_factory=dict_row) as conn:
+        with conn.cursor() as curr:
+            curr.execute("SELECT date_trunc('month', now() AT TIME ZONE 'UTC') AT TIME ZONE 'UTC' AS month;")
+            this_month = curr.fetchone()["month"]
+            curr.execute("SELECT %s - make_interval(months => %s) AS start;", (this_month, months - 1))
+            start = curr.fetchone()["start"]
+
+            curr.execute(SETUP_SQL)
+            for i in range(months + 1):
+                curr.execute("SELECT %(start)s + make_interval(months => %(i)s) AS lo, "
+                             "%(start)s + make_interval(months => %(i)s + 1) AS hi;", {"start": start, "i": i})
+                bounds = curr.fetchone()
+                curr.execute(sql.SQL(PARTITION_SQL).format(
+                    name=sql.Identifier(f"bench_parts_p{bounds['lo']:%Y%m}"),
+                    start=sql.Literal(bounds["lo"]), end=sql.Literal(bounds["hi"])))
+
+            curr.execute("SELECT now() AS end;")
+            end = curr.fetchone()["end"]
+            seed = {"tenant": TENANT_ID, "start": start, "end": end, "rows": rows}
+            for table in ("bench_heap", "bench_parts"):
+                began = time.perf_counter()
+                curr.execute(sql.SQL(SEED_SQL).format(table=sql.Identifier(table), tenants=sql.Literal(TENANTS)), seed)
+                curr.execute(sql.SQL(INDEX_SQL).format(table=sql.Identifier(table)))
+                print(f"seeded {table}: {rows} rows in {time.perf_counter() - began:.1f}s")
+
+            middle = start + (end - start) / 2
+            curr.execute("SELECT date_trunc('month', %(m)s AT TIME ZONE 'UTC') AT TIME ZONE 'UTC' AS month, "
+                         "(date_trunc('month', %(m)s AT TIME ZONE 'UTC') + interval '1 month') AT TIME ZONE 'UTC' "
+                         "AS month_end;", {"m": middle})
+            params = {"tenant": TENANT_ID, "from": middle, "to": middle + (end - start) / (months * 4),
+                      **curr.fetchone()}
+
+            print(f"{'query':<26} {'heap ms':>10} {'partitions ms':>14}")
+            for name, query in QUERIES.items():
+                heap = timed(curr, sql.SQL(query).format(table=sql.Identifier("bench_heap")), params, runs)
+                parts = timed(curr, sql.SQL(query).format(table=sql.Identifier("bench_parts")), params, runs)
+                print(f"{name:<26} {heap:>10.2f} {parts:>14.2f}")
+
+            # What a time-bounded query has to keep cached: the whole index vs one month's
+            curr.execute(INDEX_SIZES_SQL)
+            sizes = curr.fetchone()
+            print(f"index MB: heap {sizes['heap'] / 2**20:.1f}, largest partition {sizes['partition'] / 2**20:.1f}")
+        conn.rollback()
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    runs = 5
+    if "--runs" in args:
+        runs = int(args[args.index("--runs") + 1])
+        del args[args.index("--runs"):args.index("--runs") + 2]
+    main(int(args[0]) if args else 1_000_000, int(args[1]) if len(args) > 1 else 12, runs)
@@ -0,0 +1,53 @@
+# Per-request overhead of the rate limiter: RateLimiter.check alone, and a trivial
+# ASGI app called directly vs wrapped in RateLimitMiddleware (token verification
+# served by its cache, as for a client reusing its token).
+#
+#   python benchmarks/bench_ratelimit.py [requests]
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from auth import generate_mock_jwt
+from middleware import RateLimitMiddleware
+from ratelimit import Limit, RateLimiter
+
+TENANT_ID = "f248d1ee-f3c7-458a-9c17-27cef4b89e38"
+
+async def ok_app(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"{}"})
+
+async def receive():
+    return {"type": "http.request", "body": b"", "more_body": False}
+
+async def send(message):
+    pass
+
+async def per_request(app, scope, requests: int) -> float:
+    await app(scope, receive, send)
+    start = time.perf_counter()
+    for _ in range(requests):
+        await app(scope, receive, send)
+    return (time.perf_counter() - start) / requests * 1e6
+
+async def run(requests: int):
+    # Limits high enough that every request is allowed and does the full bookkeeping
+    limiter = RateLimiter({"default": {"read": Limit(1e9, 1e9)}}, enabled=True)
+    start = time.perf_counter()
+    for _ in range(requests):
+        limiter.check(TENANT_ID, "read")
+    print(f"{'RateLimiter.check':<32} {(time.perf_counter() - start) / requests * 1e6:8.2f} us/call")
+
+    scope = {"type": "http", "method": "GET", "path": "/api/v1/logs/stats",
+             "headers": [(b"authorization", f"Bearer {generate_mock_jwt()}".encode())]}
+    bare = await per_request(ok_app, scope, requests)
+    limited = await per_request(RateLimitMiddleware(ok_app, limiter), scope, requests)
+    print(f"{'ASGI app':<32} {bare:8.2f} us/request")
+    print(f"{'ASGI app + RateLimitMiddleware':<32} {limited:8.2f} us/request (+{limited - bare:.2f})")
+    print(limiter.stats()["allowed"], "allowed")
+
+if __name__ == "__main__":
+    asyncio.run(run(int(sys.argv[1]) if len(sys.argv) > 1 else 100000))
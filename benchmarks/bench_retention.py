@@ -0,0 +1,100 @@
+# Deleting a tenant's logs: the previous single DELETE ... RETURNING * vs the batched
+# retention job. Reports the total time, the longest transaction (how long row locks
+# are held at once), the WAL written and the bytes shipped back to the app. Rows are
+# seeded for one tenant and everything is rolled back at the end.
+#
+#   python benchmarks/bench_retention.py [rows] [batch size]
+import os
+import sys
+import time
+from datetime import datetime, timezone
+from uuid import uuid4
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import psycopg
+from psycopg.rows import dict_row
+
+from db import CONNINFO
+from retention import RetentionWorker
+from bench_bulk_insert import TENANT_ID
+
+SEED_SQL = """
+INSERT INTO audit_logs (tenant_id, action_type, resource_type, resource_id, severity, metadata, created_at)
+SELECT %s, 'UPDATE', 'order', 'order-' || i, 'INFO', jsonb_build_object('request', i, 'note', 'routine update'),
+       now() - make_interval(secs => i)
+FROM generate_series(1, %s) AS i;
+"""
+
+WAL_SQL = "SELECT pg_current_wal_insert_lsn() AS lsn;"
+
+class TimedWorker(RetentionWorker):
+    # Times every batch transaction of the job
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.longest = 0.0
+
+    def run_job(self, conn, job) -> bool:
+        transaction = conn.transaction
+
+        def timed_transaction(*args, **kwargs):
+            return Timed(transaction(*args, **kwargs), self)
+
+        conn.transaction = timed_transaction
+        try:
+            return super().run_job(conn, job)
+        finally:
+            del conn.transaction
+
+class Timed:
+    def __init__(self, context, worker: TimedWorker):
+        self.context = context
+        self.worker = worker
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self.context.__enter__()
+
+    def __exit__(self, *exc):
+        result = self.context.__exit__(*exc)
+        self.worker.longest = max(self.worker.longest, time.perf_counter() - self.start)
+        return result
+
+def wal_since(curr, lsn) -> int:
+    curr.execute("SELECT pg_wal_lsn_diff(pg_current_wal_insert_lsn(), %s)::bigint AS bytes;", (lsn,))
+    return curr.fetchone()["bytes"]
+
+def main(rows: int, batch_size: int):
+    with psycopg.connect(CONNINFO, row_factory=dict_row) as conn:
+        with conn.cursor() as curr:
+            curr.execute(SEED_SQL, (TENANT_ID, rows))
+            curr.execute("ANALYZE audit_logs;")
+            print(f"{'':<24} {'total s':>8} {'longest tx s':>13} {'WAL MB':>8} {'to app MB':>10}")
+
+            with conn.transaction(force_rollback=True):
+                curr.execute(WAL_SQL)
+                lsn = curr.fetchone()["lsn"]
+                start = time.perf_counter()
+                curr.execute("DELETE FROM audit_logs WHERE tenant_id = %s RETURNING *;", (TENANT_ID,))
+                returned = sum(len(repr(row)) for row in curr.fetchall())
+                total = time.perf_counter() - start
+                print(f"{'DELETE ... RETURNING *':<24} {total:>8.2f} {total:>13.2f} "
+                      f"{wal_since(curr, lsn) / 2**20:>8.1f} {returned / 2**20:>10.1f}")
+
+            with conn.transaction(force_rollback=True):
+                curr.execute(WAL_SQL)
+                lsn = curr.fetchone()["lsn"]
+                worker = TimedWorker(batch_size=batch_size, pause=0)
+                job = {"id": uuid4(), "tenant_id": TENANT_ID, "created_at": datetime.now(timezone.utc),
+                       "rules": [{"severity": None, "keep_days": 0}]}
+                start = time.perf_counter()
+                worker.run_job(conn, job)
+                total = time.perf_counter() - start
+                label = f"batched ({batch_size})"
+                print(f"{label:<24} {total:>8.2f} {worker.longest:>13.3f} "
+                      f"{wal_since(curr, lsn) / 2**20:>8.1f} {0:>10.1f}")
+        conn.rollback()
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    main(int(args[0]) if args else 200000, int(args[1]) if len(args) > 1 else 5000)
@@ -0,0 +1,89 @@
+# Memory of a large fetch: bytes per row held by the fetched result as dict rows
+# (dict_row, JSONB decoded), tuple rows and compact LogRow rows (see rows.py), with
+# the time to fetch and to encode the result to JSON. Memory is what tracemalloc sees
+# still allocated once the result is fetched, so only the Python objects of the rows.
+# Rows are seeded for one tenant and rolled back at the end.
+#
+#   python benchmarks/bench_rows.py [rows]
+import asyncio
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import psycopg
+from psycopg.rows import dict_row, tuple_row
+
+from db import CONNINFO, ThreadedCursor
+from rows import fetch_log_rows
+from serialization import dumps
+from bench_bulk_insert import TENANT_ID
+
+SEED_SQL = """
+INSERT INTO audit_logs (tenant_id, user_id, session_id, ip_address, user_agent, action_type, resource_type,
+                        resource_id, severity, before_state, after_state, metadata, created_at)
+SELECT %(tenant)s, gen_random_uuid(), 'sess-' || (i %% 1000), '10.0.0.1', 'Mozilla/5.0 (X11; Linux x86_64)',
+       'UPDATE', 'order', 'order-' || i, 'INFO',
+       jsonb_build_object('status', 'pending', 'total', 120.5, 'items', jsonb_build_array(jsonb_build_object('sku', 'A-1', 'qty', 2))),
+       jsonb_build_object('status', 'paid', 'total', 120.5, 'items', jsonb_build_array(jsonb_build_object('sku', 'A-1', 'qty', 2))),
+       jsonb_build_object('request', i, 'note', 'routine update', 'tags', jsonb_build_array('billing', 'web')),
+       now() - make_interval(secs => i)
+FROM generate_series(1, %(rows)s) AS i;
+"""
+
+FETCH_SQL = "SELECT * FROM audit_logs WHERE tenant_id = %s;"
+
+def fetch_dicts(conn):
+    with conn.cursor(row_factory=dict_row) as curr:
+        curr.execute(FETCH_SQL, (TENANT_ID,))
+        return curr.fetchall()
+
+def fetch_tuples(conn):
+    with conn.cursor(row_factory=tuple_row) as curr:
+        curr.execute(FETCH_SQL, (TENANT_ID,))
+        return curr.fetchall()
+
+def fetch_compact(conn):
+    with conn.cursor() as curr:
+        return asyncio.run(fetch_log_rows(ThreadedCursor(curr), FETCH_SQL, (TENANT_ID,)))
+
+def measure(fetch, conn, rows: int, encode: bool):
+    gc.collect()
+    tracemalloc.start()
+    result = fetch(conn)
+    held, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    gc.collect()
+
+    start = time.perf_counter()
+    result = fetch(conn)
+    fetched = time.perf_counter() - start
+    encoded = None
+    if encode:
+        start = time.perf_counter()
+        for offset in range(0, len(result), 1000):
+            dumps(result[offset:offset + 1000])
+        encoded = time.perf_counter() - start
+    del result
+    gc.collect()
+    return held / rows, fetched, encoded
+
+def main(rows: int):
+    with psycopg.connect(CONNINFO) as conn:
+        with conn.cursor() as curr:
+            curr.execute(SEED_SQL, {"tenant": TENANT_ID, "rows": rows})
+
+        print(f"{rows} rows     {'bytes/row':>10} {'total MB':>9} {'fetch s':>8} {'encode s':>9}")
+        for name, fetch, encode in (("dict_row", fetch_dicts, True), ("tuple_row", fetch_tuples, False),
+                                    ("LogRow", fetch_compact, True)):
+            per_row, fetched, encoded = measure(fetch, conn, rows, encode)
+            encoded = f"{encoded:>9.2f}" if encoded is not None else f"{'-':>9}"
+            print(f"{name:<15} {per_row:>10,.0f} {per_row * rows / 2**20:>9.1f} {fetched:>8.2f} {encoded}")
+        conn.rollback()
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
@@ -0,0 +1,67 @@
+# Latency of GET /logs?q= against table size: the previous ILIKE scan vs the
+# full-text index. Rows are seeded for one tenant (the worst case, every row is
+# the tenant's) and rolled back at the end.
+#
+#   python benchmarks/bench_search.py [sizes...] [--runs N]
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import psycopg
+from psycopg.rows import dict_row
+
+from db import CONNINFO
+from routers.audit_logs import LOG_FIELDS, build_search_query
+from bench_bulk_insert import TENANT_ID
+
+# Mostly repetitive metadata with a rare term every 1000 rows
+SEED_SQL = """
+INSERT INTO audit_logs
+(tenant_id, action_type, resource_type, resource_id, severity, metadata)
+SELECT %s, 'UPDATE', 'order', 'order-' || i, 'INFO',
+       jsonb_build_object('request', i, 'note', CASE WHEN i %% 1000 = 0 THEN 'refund escalated' ELSE 'routine update' END)
+FROM generate_series(%s::int, %s::int) AS i;
+"""
+
+ILIKE_SQL = f"""
+SELECT {', '.join(LOG_FIELDS)} FROM audit_logs
+WHERE tenant_id = %s AND (CAST(resource_id AS TEXT) ILIKE %s OR CAST(metadata AS TEXT) ILIKE %s)
+ORDER BY created_at ASC, id ASC LIMIT %s;
+"""
+
+def timed(curr, sql, params, runs: int) -> float:
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        curr.execute(sql, params)
+        curr.fetchall()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+def main(sizes, runs: int):
+    with psycopg.connect(CONNINFO, row_factory=dict_row) as conn:
+        with conn.cursor() as curr:
+            print(f"{'rows':>9} {'ILIKE ms':>10} {'full-text ms':>13}")
+            seeded = 0
+            for size in sizes:
+                curr.execute(SEED_SQL, (TENANT_ID, seeded + 1, size))
+                seeded = size
+                curr.execute("ANALYZE audit_logs;")
+
+                term = "escalated"
+                ilike = timed(curr, ILIKE_SQL, (TENANT_ID, f"%{term}%", f"%{term}%", 101), runs)
+                sql, params = build_search_query(TENANT_ID, list(LOG_FIELDS), 100, q=term)
+                fts = timed(curr, sql, params, runs)
+                print(f"{size:>9} {ilike:>10.2f} {fts:>13.2f}")
+        conn.rollback()
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    runs = 5
+    if "--runs" in args:
+        runs = int(args[args.index("--runs") + 1])
+        del args[args.index("--runs"):args.index("--runs") + 2]
+    main([int(size) for size in args] or [10000, 100000, 500000], runs)
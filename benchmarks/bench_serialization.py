@@ -0,0 +1,103 @@
+# Rows per second serialized for search, export and ingest responses: the previous
+# jsonable_encoder + JSONResponse (or json.dumps) paths vs serialization.dumps.
+# Rows are built as psycopg's dict_row returns them, no database is needed.
+#
+#   python benchmarks/bench_serialization.py [rows]
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from ipaddress import IPv4Address
+from uuid import uuid4
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import TypeAdapter
+
+import schemas
+import serialization
+from cursors import encode_cursor
+from export import ndjson_lines
+from serialization import FastJSONResponse, dumps
+
+def make_rows(count: int) -> list:
+    tenant_id, start = uuid4(), datetime.now(timezone.utc)
+    return [{
+        "id": uuid4(), "tenant_id": tenant_id, "user_id": uuid4(), "session_id": f"sess-{i % 1000}",
+        "ip_address": IPv4Address("10.0.0.1"), "user_agent": "Mozilla/5.0 (X11; Linux x86_64)",
+        "action_type": "UPDATE", "resource_type": "order", "resource_id": f"order-{i}", "severity": "INFO",
+        "before_state": {"status": "pending", "total": 120.5, "items": [{"sku": "A-1", "qty": 2}]},
+        "after_state": {"status": "paid", "total": 120.5, "items": [{"sku": "A-1", "qty": 2}]},
+        "metadata": {"request": i, "note": "routine update", "tags": ["billing", "web"]},
+        "created_at": start - timedelta(seconds=i),
+    } for i in range(count)]
+
+def rate(fn, rows: int, repeat: int = 5) -> float:
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return rows * repeat / (time.perf_counter() - start)
+
+def report(name: str, before: float, after: float):
+    print(f"  {name:<34} {before:>12,.0f} {after:>12,.0f} {after / before:>7.1f}x")
+
+def run(count: int):
+    rows = make_rows(count)
+    log_adapter = TypeAdapter(schemas.Log)
+    engine = "orjson" if serialization.orjson is not None else "json (orjson not installed)"
+    print(f"rows/s, {count} rows, serialization.dumps uses {engine}")
+    print(f"  {'':<34} {'before':>12} {'after':>12}")
+
+    # GET /logs/: the page is encoded once into the response cache
+    for size in (100, 1000):
+        pages = [{"data": rows[i:i + size], "next_cursor": encode_cursor(rows[i]["created_at"], rows[i]["id"])}
+                 for i in range(0, count, size)]
+        report(f"search, pages of {size}",
+               rate(lambda: [JSONResponse(jsonable_encoder(page)).body for page in pages], count),
+               rate(lambda: [dumps(page) for page in pages], count))
+
+    # POST /logs/: the response model validated and dumped the jsonable_encoder output
+    report("ingest, POST /logs/ response",
+           rate(lambda: [log_adapter.dump_json(log_adapter.validate_python(jsonable_encoder(row)))
+                         for row in rows], count),
+           rate(lambda: [FastJSONResponse(row).body for row in rows], count))
+    # SQS message bodies of the outbox relay, from the decoded JSONB payload
+    payloads = [json.loads(dumps(row)) for row in rows]
+    report("ingest, SQS message bodies",
+           rate(lambda: [json.dumps(payload) for payload in payloads], count),
+           rate(lambda: [dumps(payload).decode() for payload in payloads], count))
+
+    # WebSocket events, serialized once per event
+    report("stream, log events",
+           rate(lambda: [json.dumps(jsonable_encoder({"event": "log", "data": row})) for row in rows], count),
+           rate(lambda: [dumps({"event": "log", "data": row}).decode() for row in rows], count))
+
+    # Archived logs in NDJSON exports, from the segments' pyarrow Tables
+    try:
+        import pyarrow as pa
+    except ImportError:
+        print("pyarrow not installed, skipping export")
+        return
+    table = pa.Table.from_pylist([{**payload, "created_at": row["created_at"],
+                                   **{column: json.dumps(payload[column])
+                                      for column in ("before_state", "after_state", "metadata")}}
+                                  for payload, row in zip(payloads, rows)])
+
+    def previous_ndjson_lines():
+        lines = []
+        for row in table.to_pylist():
+            for column in ("before_state", "after_state", "metadata"):
+                if row[column] is not None:
+                    row[column] = json.loads(row[column])
+            row["created_at"] = row["created_at"].isoformat()
+            lines.append(json.dumps(row, separators=(",", ":")))
+        return ("\n".join(lines) + "\n").encode()
+
+    report("export, archived logs as NDJSON", rate(previous_ndjson_lines, count), rate(lambda: ndjson_lines(table), count))
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
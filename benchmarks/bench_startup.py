@@ -0,0 +1,48 @@
+# Cold-start time of main:app: `import main` in fresh interpreters, with the database
+# reachable and with DATABASE_URL pointing at a closed port (importing must not wait
+# for it), then the slowest modules of the app itself from python -X importtime.
+#
+#   python benchmarks/bench_startup.py [runs]
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_MODULES = {name[:-3] for name in os.listdir(ROOT) if name.endswith(".py")} | {"routers"}
+
+TIMED_IMPORT = "import time; start = time.perf_counter(); import main; print(time.perf_counter() - start)"
+UNREACHABLE = "host=127.0.0.1 port=1 dbname=fastapi user=postgres connect_timeout=1"
+
+def import_seconds(env: dict) -> float:
+    out = subprocess.run([sys.executable, "-c", TIMED_IMPORT], cwd=ROOT, env=env, capture_output=True,
+                         text=True, check=True, timeout=120)
+    return float(out.stdout.strip().splitlines()[-1])
+
+def slowest_modules(env: dict, top: int = 10) -> list:
+    # -X importtime lines: "import time: self [us] | cumulative | imported package"
+    err = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"], cwd=ROOT, env=env,
+                         capture_output=True, text=True, check=True).stderr
+    modules = []
+    for line in err.splitlines():
+        parts = line.split("|")
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        name = parts[2].strip()
+        if name.split(".")[0] in APP_MODULES:
+            modules.append((int(parts[1]), int(parts[0].split(":")[1]), name))
+    return sorted(modules, reverse=True)[:top]
+
+def main(runs: int):
+    env = {key: value for key, value in os.environ.items() if key != "TESTING"}
+    for label, extra in (("database reachable", {}), ("database unreachable", {"DATABASE_URL": UNREACHABLE})):
+        timings = [import_seconds({**env, **extra}) for _ in range(runs)]
+        print(f"import main, {label:<21} median {statistics.median(timings) * 1000:7.1f} ms, "
+              f"min {min(timings) * 1000:7.1f} ms ({runs} runs)")
+
+    print(f"\n{'cumulative ms':>13} {'self ms':>8}  module")
+    for cumulative, own, name in slowest_modules(env):
+        print(f"{cumulative / 1000:>13.1f} {own / 1000:>8.1f}  {name}")
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10)
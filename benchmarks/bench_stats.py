@@ -0,0 +1,74 @@
+# Latency of GET /logs/stats against table size: the previous four aggregate
+# queries over audit_logs vs the rollup read. Rows are seeded for one tenant over
+# the last 90 days and rolled back at the end.
+#
+#   python benchmarks/bench_stats.py [sizes...]
+import os
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import psycopg
+from psycopg.rows import dict_row
+
+from db import CONNINFO
+from rollups import RollupCompactor, STATS_SERIES_SQL, STATS_TOTALS_SQL
+from bench_bulk_insert import TENANT_ID
+
+RUNS = 5
+
+SEED_SQL = """
+INSERT INTO audit_logs
+(tenant_id, action_type, resource_type, resource_id, severity, created_at)
+SELECT %s, (ARRAY['CREATE', 'UPDATE', 'DELETE', 'VIEW'])[1 + i %% 4], 'order', 'order-' || i,
+       (ARRAY['INFO', 'WARNING', 'ERROR', 'CRITICAL'])[1 + i %% 4],
+       now() - make_interval(secs => i %% (90 * 86400))
+FROM generate_series(%s::int, %s::int) AS i;
+"""
+
+# The four queries the endpoint used to run on every call
+PREVIOUS_SQL = [
+    "SELECT COUNT(*) as total from audit_logs WHERE tenant_id = %(tenant_id)s;",
+    "SELECT action_type, COUNT(*) AS count FROM audit_logs WHERE tenant_id = %(tenant_id)s GROUP BY action_type",
+    "SELECT severity, COUNT(*) AS count FROM audit_logs WHERE tenant_id = %(tenant_id)s GROUP BY severity",
+    """SELECT DATE_TRUNC('day', created_at) AS day, COUNT(*) AS count FROM audit_logs
+       WHERE created_at >= %(from)s AND tenant_id = %(tenant_id)s GROUP BY day ORDER BY day;""",
+]
+
+def timed(curr, queries, params) -> float:
+    timings = []
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        for sql in queries:
+            curr.execute(sql, params)
+            curr.fetchall()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+def main(sizes):
+    compactor = RollupCompactor(batch_size=100000)
+    with psycopg.connect(CONNINFO, row_factory=dict_row) as conn:
+        with conn.cursor() as curr:
+            print(f"{'rows':>9} {'previous ms':>12} {'rollups ms':>11} {'compacted ms':>13}")
+            seeded = 0
+            for size in sizes:
+                curr.execute(SEED_SQL, (TENANT_ID, seeded + 1, size))
+                seeded = size
+                curr.execute("ANALYZE audit_logs;")
+
+                params = {"tenant_id": TENANT_ID, "from": datetime.now(timezone.utc) - timedelta(days=7)}
+                window = {**params, "from": "-infinity", "to": "infinity", "bucket": "day"}
+                previous = timed(curr, PREVIOUS_SQL, params)
+                # Deltas not folded yet, then after the compactor ran
+                rollups = timed(curr, [STATS_TOTALS_SQL, STATS_SERIES_SQL], window)
+                while compactor.run_once(conn):
+                    pass
+                compacted = timed(curr, [STATS_TOTALS_SQL, STATS_SERIES_SQL], window)
+                print(f"{size:>9} {previous:>12.2f} {rollups:>11.2f} {compacted:>13.2f}")
+        conn.rollback()
+
+if __name__ == "__main__":
+    main([int(size) for size in sys.argv[1:]] or [10000, 100000, 500000])
@@ -0,0 +1,95 @@
+# WebSocket fan-out load test: N subscribers of one tenant, M broadcast messages,
+# delivery latency percentiles and throughput.
+#
+#   python benchmarks/bench_stream.py [clients] [messages]
+#       in-process: ConnectionManager with stand-in sockets (one slow one included)
+#   python benchmarks/bench_stream.py [clients] [messages] --url http://localhost:8000
+#       real WebSocket clients against a running server (uvicorn main:app),
+#       needs the websockets package; raise `ulimit -n` for thousands of clients
+import asyncio
+import json
+import os
+import sys
+import time
+from uuid import uuid4
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from auth import generate_mock_jwt
+from streaming import ConnectionManager
+
+TENANT_ID = str(uuid4())
+
+def report(name: str, latencies: list, elapsed: float):
+    latencies.sort()
+    p = lambda q: latencies[min(int(len(latencies) * q), len(latencies) - 1)] * 1000
+    print(f"{name}: {len(latencies)} deliveries in {elapsed:.2f} s ({len(latencies) / elapsed:,.0f}/s), "
+          f"latency p50 {p(0.5):.1f} ms  p99 {p(0.99):.1f} ms  max {p(1.0):.1f} ms")
+
+class LocalSocket:
+    def __init__(self, latencies: list, delay: float = 0.0):
+        self.latencies = latencies
+        self.delay = delay
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.latencies.append(time.perf_counter() - json.loads(text)["data"]["sent"])
+
+    async def close(self, code=1000, reason=""):
+        pass
+
+async def in_process(clients: int, messages: int):
+    manager = ConnectionManager(queue_size=messages)
+    latencies = []
+    for _ in range(clients):
+        await manager.connect(TENANT_ID, LocalSocket(latencies))
+    # A consumer 1000x slower than the others must not delay them
+    slow = []
+    await manager.connect(TENANT_ID, LocalSocket(slow, delay=0.01))
+
+    start = time.perf_counter()
+    for _ in range(messages):
+        manager.publish(TENANT_ID, [{"event": "message", "data": {"sent": time.perf_counter()}}])
+        await asyncio.sleep(0)
+    while len(latencies) < clients * messages:
+        await asyncio.sleep(0.001)
+    report("in-process", latencies, time.perf_counter() - start)
+    print(f"slow consumer received {len(slow)}/{messages}", manager.stats())
+
+async def over_network(clients: int, messages: int, url: str):
+    import httpx
+    import websockets
+
+    # The server streams the token's tenant
+    token = generate_mock_jwt()
+    ws_url = url.replace("http", "ws", 1) + f"/api/v1/logs/stream?token={token}"
+    sockets = [await websockets.connect(ws_url) for _ in range(clients)]
+    latencies = []
+
+    async def consume(ws):
+        for _ in range(messages):
+            event = json.loads(await ws.recv())
+            latencies.append(time.time() - float(event["data"]["message"]))
+
+    consumers = [asyncio.create_task(consume(ws)) for ws in sockets]
+    start = time.perf_counter()
+    async with httpx.AsyncClient(base_url=url, headers={"Authorization": f"Bearer {token}"}) as http:
+        for _ in range(messages):
+            await http.post("/api/v1/logs/mock-broadcast", params={"msg": str(time.time())})
+    await asyncio.gather(*consumers)
+    report(f"{clients} websocket clients", latencies, time.perf_counter() - start)
+    await asyncio.gather(*(ws.close() for ws in sockets))
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    url = None
+    if "--url" in args:
+        url = args[args.index("--url") + 1]
+        del args[args.index("--url"):args.index("--url") + 2]
+    clients = int(args[0]) if args else 2000
+    messages = int(args[1]) if len(args) > 1 else 100
+    asyncio.run(over_network(clients, messages, url) if url else in_process(clients, messages))
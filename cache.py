@@ -0,0 +1,214 @@
+# cache.py
+# Tenant-aware response cache for the read endpoints dashboards poll (search, stats,
+# tenant list). Entries are keyed by endpoint + tenant + normalized query string and
+# hold the encoded JSON body with its ETag. Each tenant has a generation number that
+# is part of the key: a write to the tenant bumps it, which orphans every entry of
+# that tenant at once (they age out of the LRU).
+#
+# The in-process LRU is always used. Set CACHE_URL (redis://...) to share entries and
+# generations between processes, this needs the optional redis package.
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, NamedTuple, Optional, Protocol
+from urllib.parse import urlencode
+
+from fastapi import Request, Response
+from starlette.concurrency import run_in_threadpool
+
+from profiling import span
+from serialization import dumps
+
+CACHE_TTL_SECONDS = float(os.getenv("CACHE_TTL_SECONDS", "10"))   # 0 disables the cache
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "1024"))
+CACHE_URL = os.getenv("CACHE_URL")
+
+class CacheEntry(NamedTuple):
+    etag: str
+    body: bytes
+
+    def response(self, request: Request) -> Response:
+        """
+        200 with the cached body, or 304 when the client already holds this version
+        :return: response
+        """
+        headers = {"ETag": self.etag, "Cache-Control": "private, no-cache"}
+        if etag_matches(request.headers.get("if-none-match"), self.etag):
+            return Response(status_code=304, headers=headers)
+        return Response(content=self.body, media_type="application/json", headers=headers)
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    # Weak comparison, as If-None-Match requires
+    return "*" in candidates or etag in [tag[2:] if tag.startswith("W/") else tag for tag in candidates]
+
+class SharedBackend(Protocol):
+    """
+    Cache storage shared by every process
+    """
+    def get(self, key: str) -> Optional[bytes]: ...
+    def set(self, key: str, value: bytes, ttl: float): ...
+    def incr(self, key: str) -> int: ...
+
+class RedisBackend:
+    def __init__(self, url: str):
+        import redis
+        self.client = redis.Redis.from_url(url)
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.client.get(key)
+
+    def set(self, key: str, value: bytes, ttl: float):
+        self.client.set(key, value, px=int(ttl * 1000))
+
+    def incr(self, key: str) -> int:
+        return self.client.incr(key)
+
+class LRUCache:
+    """
+    Thread-safe in-process LRU with a TTL per entry
+    """
+    def __init__(self, maxsize: int, ttl: float, on_evict: Callable[[], None] = lambda: None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Any:
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self.on_evict()
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        # ttl overrides the cache's for this entry
+        with self._lock:
+            self._entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.on_evict()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+class ResponseCache:
+    def __init__(self, ttl: float = CACHE_TTL_SECONDS, maxsize: int = CACHE_MAX_ENTRIES,
+                 shared: Optional[SharedBackend] = None):
+        self.ttl = ttl
+        self.shared = shared
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "shared_hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+        self.local = LRUCache(maxsize, ttl, on_evict=lambda: self._count("evictions"))
+        self._generations: dict = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    def _count(self, name: str):
+        with self._lock:
+            self.counters[name] += 1
+
+    def _generation(self, scope: str) -> int:
+        if self.shared:
+            return int(self.shared.get(f"gen:{scope}") or 0)
+        with self._lock:
+            return self._generations.get(scope, 0)
+
+    def key(self, endpoint: str, scope: str, request: Request) -> str:
+        """
+        Cache key of a request. Read it before querying, so a write landing
+        meanwhile leaves the result under the old, orphaned generation.
+        :return: key
+        """
+        params = urlencode(sorted(request.query_params.multi_items()))
+        return f"{endpoint}:{scope}:{self._generation(scope)}:{params}"
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        if not self.enabled:
+            return None
+        entry = self.local.get(key)
+        if entry is None and self.shared:
+            raw = self.shared.get(key)
+            if raw is not None:
+                etag, body = raw.split(b"\n", 1)
+                entry = CacheEntry(etag=etag.decode(), body=body)
+                self.local.set(key, entry)
+                self._count("shared_hits")
+        self._count("hits" if entry is not None else "misses")
+        return entry
+
+    def set(self, key: str, payload: Any) -> CacheEntry:
+        """
+        Encode a payload once and cache it
+        :return: entry with body and ETag
+        """
+        with span("serialize"):
+            body = dumps(payload)
+        entry = CacheEntry(etag=f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"', body=body)
+        if self.enabled:
+            self.local.set(key, entry)
+            if self.shared:
+                self.shared.set(key, entry.etag.encode() + b"\n" + entry.body, self.ttl)
+        return entry
+
+    def invalidate(self, scope: str):
+        """
+        Drop every entry of a tenant (or of another scope, e.g. the tenant list)
+        :return: None
+        """
+        if self.shared:
+            self.shared.incr(f"gen:{scope}")
+        with self._lock:
+            self._generations[scope] = self._generations.get(scope, 0) + 1
+        self._count("invalidations")
+
+    # The shared backend does network I/O, keep it off the event loop
+    async def akey(self, endpoint: str, scope: str, request: Request) -> str:
+        if self.shared:
+            return await run_in_threadpool(self.key, endpoint, scope, request)
+        return self.key(endpoint, scope, request)
+
+    async def aget(self, key: str) -> Optional[CacheEntry]:
+        if self.shared:
+            return await run_in_threadpool(self.get, key)
+        return self.get(key)
+
+    async def aset(self, key: str, payload: Any) -> CacheEntry:
+        if self.shared:
+            return await run_in_threadpool(self.set, key, payload)
+        return self.set(key, payload)
+
+    async def ainvalidate(self, scope: str):
+        if self.shared:
+            await run_in_threadpool(self.invalidate, scope)
+        else:
+            self.invalidate(scope)
+
+    def clear(self):
+        self.local.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self.counters)
+        return {**counters, "entries": len(self.local), "max_entries": self.local.maxsize,
+                "ttl_seconds": self.ttl, "shared": self.shared is not None}
+
+response_cache = ResponseCache(shared=RedisBackend(CACHE_URL) if CACHE_URL else None)
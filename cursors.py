@@ -0,0 +1,34 @@
+# cursors.py
+# Opaque position tokens shared by search pagination and the resumable log stream.
+# A token is the url-safe base64 of [created_at, id] (plus the rank of a full-text
+# search), so a client can't tell them apart from any other string.
+import base64
+import json
+from datetime import datetime
+from typing import Union
+from uuid import UUID
+
+def encode_cursor(created_at: datetime, id: UUID, rank: Union[float, None] = None) -> str:
+    """
+    Position of a row in (created_at, id) order, or in (rank, created_at, id) order for a full-text search
+    :return: url-safe token
+    """
+    position = [created_at.isoformat(), str(id)]
+    if rank is not None:
+        position.append(rank)
+    raw = json.dumps(position).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def parse_cursor(cursor: str) -> tuple:
+    """
+    Inverse of encode_cursor, raises ValueError for a malformed token
+    :return: (created_at, id) or (created_at, id, rank)
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, id, *rank = json.loads(raw)
+        if len(rank) > 1:
+            raise ValueError("too many values")
+        return (datetime.fromisoformat(created_at), UUID(id), *(float(value) for value in rank))
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid cursor: {e}") from None
@@ -0,0 +1,72 @@
+# dispatcher.py
+# Batched fan-out of logs to SQS and OpenSearch. The outbox relay (see outbox.py)
+# hands over each claimed batch with deliver(), every sink gets the whole batch
+# and failed logs are retried a few times with backoff before being reported back.
+import os
+import random
+import threading
+import time
+from functools import partial
+from typing import Callable, List, Optional, Tuple
+
+from utils import send_logs_to_sqs_batch, bulk_index_logs_to_opensearch
+
+MAX_RETRIES = int(os.getenv("DISPATCH_MAX_RETRIES", "5"))
+
+# A sink takes a batch of logs and returns the ones it failed to deliver
+Sink = Tuple[str, Callable[[List[dict]], List[dict]]]
+
+class LogDispatcher:
+    def __init__(self, sinks: List[Sink], max_retries: int = MAX_RETRIES, backoff: float = 0.1):
+        self.sinks = sinks
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._lock = threading.Lock()
+        self.counters = {"batches": 0, "retries": 0}
+        self.delivered = {name: 0 for name, _ in sinks}
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self.counters, "delivered": dict(self.delivered)}
+
+    def _count(self, name: str, value: int = 1):
+        with self._lock:
+            self.counters[name] += value
+
+    def deliver(self, batch: List[dict], max_retries: Optional[int] = None) -> List[dict]:
+        """
+        Send a batch to every sink, retrying with backoff
+        :return: logs that at least one sink failed to accept
+        """
+        self._count("batches")
+        failed = {}
+        for name, send in self.sinks:
+            for log in self._deliver(name, send, batch, self.max_retries if max_retries is None else max_retries):
+                failed[id(log)] = log
+        return list(failed.values())
+
+    def _deliver(self, name: str, send: Callable[[List[dict]], List[dict]], batch: List[dict],
+                 max_retries: int) -> List[dict]:
+        pending = batch
+        for attempt in range(max_retries + 1):
+            try:
+                pending = send(pending)
+            except Exception as e:
+                print(f"{name} dispatch error: {e}")
+            if not pending:
+                break
+            if attempt < max_retries:
+                self._count("retries")
+                # Exponential backoff with jitter
+                time.sleep(self.backoff * (2 ** attempt) * (1 + random.random()))
+
+        with self._lock:
+            self.delivered[name] += len(batch) - len(pending)
+        if pending:
+            print(f"{name} dispatch gave up on {len(pending)} logs after {max_retries} retries")
+        return pending
+
+dispatcher = LogDispatcher(sinks=[
+    ("sqs", send_logs_to_sqs_batch),
+    ("opensearch", partial(bulk_index_logs_to_opensearch, index="audit-logs")),
+])
@@ -0,0 +1,164 @@
+# export.py
+# Row-based export formats for GET /logs/export (NDJSON, Parquet, Arrow IPC).
+# Rows come from a server-side cursor in chunks and each chunk is written out
+# before the next one is fetched, so memory stays flat for any export size.
+# Parquet / Arrow need the optional pyarrow package.
+#
+# Archived logs (see archive.py) come after the ones in audit_logs, as pyarrow Tables
+# in the same columns, and are rendered like Postgres renders the others.
+import io
+from typing import AsyncIterator, List, Optional
+
+from fastapi import HTTPException, status
+from psycopg.rows import tuple_row
+from starlette.concurrency import run_in_threadpool
+
+from db import stream_rows
+from profiling import span
+from serialization import dumps, loads
+
+EXPORT_MEDIA_TYPES = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+# Columns are rendered to text by Postgres (JSONB included), so the app never
+# decodes and re-encodes the state blobs
+EXPORT_COLUMNS_SQL = """
+id::text AS id, tenant_id::text AS tenant_id, user_id::text AS user_id, session_id,
+abbrev(ip_address) AS ip_address, user_agent, action_type, resource_type, resource_id, severity,
+before_state::text AS before_state, after_state::text AS after_state, metadata::text AS metadata,
+created_at
+"""
+
+TEXT_COLUMNS = ["id", "tenant_id", "user_id", "session_id", "ip_address", "user_agent",
+                "action_type", "resource_type", "resource_id", "severity",
+                "before_state", "after_state", "metadata"]
+
+def arrow_schema():
+    import pyarrow as pa
+    return pa.schema([(name, pa.string()) for name in TEXT_COLUMNS]
+                     + [("created_at", pa.timestamp("us", tz="UTC"))])
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise HTTPException(status_code=status.HTTP_501_NOT_IMPLEMENTED,
+                            detail="Parquet / Arrow export requires the pyarrow package")
+    return pyarrow
+
+JSON_COLUMNS = ("before_state", "after_state", "metadata")
+
+def ndjson_lines(table) -> bytes:
+    # row_to_json: JSONB columns nested as objects, ISO 8601 timestamps
+    lines = []
+    for row in table.to_pylist():
+        for column in JSON_COLUMNS:
+            if row[column] is not None:
+                row[column] = loads(row[column])
+        row["created_at"] = row["created_at"].isoformat()
+        lines.append(dumps(row))
+    return b"\n".join(lines) + b"\n"
+
+def csv_lines(table) -> bytes:
+    # COPY ... CSV: no header, timestamps as Postgres prints them
+    import pyarrow.compute as pc
+    import pyarrow.csv
+    created_at = pc.strftime(table["created_at"], format="%Y-%m-%d %H:%M:%S+00")
+    table = table.set_column(table.schema.get_field_index("created_at"), "created_at", created_at)
+    buffer = io.BytesIO()
+    pyarrow.csv.write_csv(table, buffer, pyarrow.csv.WriteOptions(include_header=False, quoting_style="needed"))
+    return buffer.getvalue()
+
+async def iter_csv(chunks: AsyncIterator[bytes], archived: Optional[AsyncIterator] = None) -> AsyncIterator[bytes]:
+    """
+    The CSV rendered by Postgres, then the archived logs
+    :return: encoded chunks of lines
+    """
+    async for chunk in chunks:
+        yield chunk
+    if archived is not None:
+        async for table in archived:
+            with span("serialize", rows=table.num_rows, archived=True):
+                chunk = await run_in_threadpool(csv_lines, table)
+            yield chunk
+
+async def iter_ndjson(curr, where_sql: str, params: list, archived: Optional[AsyncIterator] = None) -> AsyncIterator[bytes]:
+    """
+    One JSON object per line, serialised by Postgres
+    :return: encoded chunks of lines
+    """
+    sql = f"SELECT row_to_json(a)::text AS line FROM audit_logs a WHERE {where_sql} ORDER BY created_at DESC"
+    async for rows in stream_rows(curr, sql, params, row_factory=tuple_row):
+        with span("serialize", rows=len(rows)):
+            chunk = ("\n".join(row[0] for row in rows) + "\n").encode()
+        yield chunk
+    if archived is not None:
+        async for table in archived:
+            with span("serialize", rows=table.num_rows, archived=True):
+                chunk = await run_in_threadpool(ndjson_lines, table)
+            yield chunk
+
+class _Drain:
+    """
+    Write-only file object, the writer output is collected and handed out after each batch
+    """
+    def __init__(self):
+        self.buffer = bytearray()
+        self.closed = False
+
+    def write(self, data) -> int:
+        self.buffer += data
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self) -> bytes:
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+def _write_batch(writer, schema, rows: List[tuple]):
+    # Tuple rows in schema order, transposed into one array per column
+    import pyarrow as pa
+    columns = zip(*rows)
+    writer.write_batch(pa.RecordBatch.from_arrays([pa.array(values, type=field.type)
+                                                   for values, field in zip(columns, schema)], schema=schema))
+
+async def iter_arrow(curr, where_sql: str, params: list, fmt: str, compression: str = "zstd",
+                     archived: Optional[AsyncIterator] = None) -> AsyncIterator[bytes]:
+    """
+    Parquet file (one row group per fetched chunk) or Arrow IPC stream (one record batch per chunk)
+    :return: encoded chunks of the file
+    """
+    pa = _import_pyarrow()
+    schema = arrow_schema()
+    sink = _Drain()
+    if fmt == "parquet":
+        writer = pa.parquet.ParquetWriter(sink, schema, compression=compression)
+    else:
+        writer = pa.ipc.new_stream(sink, schema, options=pa.ipc.IpcWriteOptions(compression=compression))
+
+    sql = f"SELECT {EXPORT_COLUMNS_SQL} FROM audit_logs WHERE {where_sql} ORDER BY created_at DESC"
+    async for rows in stream_rows(curr, sql, params, row_factory=tuple_row):
+        # Encoding and compression are CPU bound, keep them off the event loop
+        with span("serialize", rows=len(rows)):
+            await run_in_threadpool(_write_batch, writer, schema, rows)
+        yield sink.take()
+    if archived is not None:
+        # Same schema, written as they are
+        async for table in archived:
+            with span("serialize", rows=table.num_rows, archived=True):
+                await run_in_threadpool(writer.write_table, table)
+            yield sink.take()
+
+    writer.close()
+    yield sink.take()
@@ -0,0 +1,304 @@
+# ingest.py
+# Bulk insert paths for audit logs. Every path also writes the log_outbox rows
+# (see outbox.py) in the same transaction as the logs.
+import ipaddress
+import os
+import zlib
+from typing import AsyncIterable, AsyncIterator, Awaitable, Callable, Iterable, List, Optional, Union
+from uuid import uuid4
+
+from fastapi import HTTPException, status
+from psycopg.types.json import Json
+from pydantic import ValidationError
+from starlette.concurrency import run_in_threadpool
+
+from db import ThreadedCursor, acommit
+import schemas
+from streaming import notify_new_logs
+
+BULK_INSERT_METHOD = os.getenv("BULK_INSERT_METHOD", "copy")   # copy | unnest | executemany
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "5000"))
+# NDJSON ingest limits, keep memory bounded however large the stream is
+INGEST_MAX_LINE_BYTES = int(os.getenv("INGEST_MAX_LINE_BYTES", str(1024 * 1024)))
+INGEST_MAX_ERRORS = int(os.getenv("INGEST_MAX_ERRORS", "1000"))   # per-line errors reported back
+INGEST_READ_SIZE = 64 * 1024
+
+# Insert a log together with its outbox row in one statement, so the
+# SQS / OpenSearch fan-out is committed atomically with the log itself.
+# Ids are generated by the app on every insert path, see log_row().
+INSERT_LOG_SQL = """
+WITH new_log AS (
+    INSERT INTO audit_logs
+    (id, tenant_id, user_id, session_id, ip_address, user_agent,
+     action_type, resource_type, resource_id, severity,
+     before_state, after_state, metadata)
+    VALUES
+    (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    RETURNING *
+), outbox AS (
+    INSERT INTO log_outbox (payload)
+    SELECT to_jsonb(new_log) FROM new_log
+)
+SELECT * FROM new_log;
+"""
+
+# One statement per chunk: each column is sent as an array and unnested server side
+INSERT_LOGS_UNNEST_SQL = """
+WITH new_log AS (
+    INSERT INTO audit_logs
+    (id, tenant_id, user_id, session_id, ip_address, user_agent,
+     action_type, resource_type, resource_id, severity,
+     before_state, after_state, metadata)
+    SELECT * FROM unnest(
+        %s::uuid[], %s::uuid[], %s::uuid[], %s::text[], %s::inet[], %s::text[],
+        %s::text[], %s::text[], %s::text[], %s::text[],
+        %s::jsonb[], %s::jsonb[], %s::jsonb[])
+    RETURNING *
+), outbox AS (
+    INSERT INTO log_outbox (payload)
+    SELECT to_jsonb(new_log) FROM new_log
+)
+SELECT COUNT(*) AS inserted FROM new_log;
+"""
+
+# Binary COPY, the outbox rows are written right after from the known ids
+COPY_LOGS_SQL = """
+COPY audit_logs
+(id, tenant_id, user_id, session_id, ip_address, user_agent,
+ action_type, resource_type, resource_id, severity,
+ before_state, after_state, metadata)
+FROM STDIN (FORMAT BINARY)
+"""
+COPY_LOG_TYPES = ["uuid", "uuid", "uuid", "text", "inet", "text",
+                  "text", "text", "text", "text",
+                  "jsonb", "jsonb", "jsonb"]
+
+# The copied rows have the transaction's now() as created_at, which prunes every other partition
+OUTBOX_FROM_IDS_SQL = """
+INSERT INTO log_outbox (payload)
+SELECT to_jsonb(audit_logs) FROM audit_logs WHERE created_at = now() AND id = ANY(%s);
+"""
+
+def log_params(log: schemas.Log) -> tuple:
+    """
+    Column values of a log, in the order of the INSERT statements
+    :return: tuple of 12 values
+    """
+    return (
+        log.tenant_id, log.user_id, log.session_id, log.ip_address, log.user_agent,
+        log.action_type, log.resource_type, log.resource_id, log.severity,
+        Json(log.before_state) if log.before_state is not None else None,
+        Json(log.after_state) if log.after_state is not None else None,
+        Json(log.metadata) if log.metadata is not None else None,
+    )
+
+def log_row(log: schemas.Log) -> tuple:
+    """
+    Insert values of a log with a new id: knowing the ids up front lets every insert
+    path write the outbox rows and the stream notifications without reading back
+    :return: tuple of 13 values, id first
+    """
+    return (uuid4(), *log_params(log))
+
+async def insert_chunk_executemany(curr, rows: List[tuple]) -> int:
+    await curr.executemany(INSERT_LOG_SQL, rows)
+    return len(rows)
+
+async def insert_chunk_unnest(curr, rows: List[tuple]) -> int:
+    # Transpose the rows into one array per column
+    await curr.execute(INSERT_LOGS_UNNEST_SQL, [list(column) for column in zip(*rows)])
+    return (await curr.fetchone())["inserted"]
+
+def _copy_rows(curr, rows: List[tuple]):
+    with curr.copy(COPY_LOGS_SQL) as copy:
+        copy.set_types(COPY_LOG_TYPES)
+        for row in rows:
+            copy.write_row(row)
+
+async def insert_chunk_copy(curr, rows: List[tuple]) -> int:
+    ids = [row[0] for row in rows]
+    # Binary COPY needs typed values: inet as ipaddress objects, jsonb as plain dicts
+    rows = [(*row[:4], ipaddress.ip_interface(row[4]), *row[5:10],
+             *(value.obj if value is not None else None for value in row[10:]))
+            for row in rows]
+
+    if isinstance(curr, ThreadedCursor):
+        await run_in_threadpool(_copy_rows, curr.cursor, rows)
+    else:
+        async with curr.copy(COPY_LOGS_SQL) as copy:
+            copy.set_types(COPY_LOG_TYPES)
+            for row in rows:
+                await copy.write_row(row)
+
+    await curr.execute(OUTBOX_FROM_IDS_SQL, (ids,))
+    return len(rows)
+
+INSERT_CHUNK = {
+    "copy": insert_chunk_copy,
+    "unnest": insert_chunk_unnest,
+    "executemany": insert_chunk_executemany,
+}
+
+async def _as_async(logs: Iterable[schemas.Log]) -> AsyncIterator[schemas.Log]:
+    for log in logs:
+        yield log
+
+async def bulk_insert_logs(curr, logs: Union[Iterable[schemas.Log], AsyncIterable[schemas.Log]],
+                           chunk_size: int = BULK_CHUNK_SIZE, commit_every_chunk: bool = False,
+                           method: Optional[str] = None,
+                           before_chunk: Optional[Callable[[int], Awaitable[None]]] = None) -> int:
+    """
+    Insert logs in chunks of chunk_size rows, logs can be a list or an async stream.
+    With commit_every_chunk each chunk is committed on its own, otherwise the caller
+    commits once at the end. Each chunk also queues its stream notifications.
+    before_chunk is awaited with the row count of each chunk first and may raise to stop.
+    :return: number of inserted rows
+    """
+    insert_chunk = INSERT_CHUNK[method or BULK_INSERT_METHOD]
+    inserted = 0
+    chunk: List[tuple] = []
+
+    if not hasattr(logs, "__aiter__"):
+        logs = _as_async(logs)
+
+    async for log in logs:
+        chunk.append(log_row(log))
+        if len(chunk) >= chunk_size:
+            if before_chunk:
+                await before_chunk(len(chunk))
+            inserted += await insert_chunk(curr, chunk)
+            await notify_new_logs(curr, [(row[1], row[0]) for row in chunk])
+            chunk = []
+            if commit_every_chunk:
+                await acommit(curr)
+
+    if chunk:
+        if before_chunk:
+            await before_chunk(len(chunk))
+        inserted += await insert_chunk(curr, chunk)
+        await notify_new_logs(curr, [(row[1], row[0]) for row in chunk])
+        if commit_every_chunk:
+            await acommit(curr)
+
+    return inserted
+
+class IngestReport:
+    """
+    Outcome of an NDJSON ingest: line count and per-line errors (the first INGEST_MAX_ERRORS of them)
+    """
+    def __init__(self):
+        self.lines = 0
+        self.rejected = 0
+        self.errors: List[dict] = []
+
+    def reject(self, line: int, error: str):
+        self.rejected += 1
+        if len(self.errors) < INGEST_MAX_ERRORS:
+            self.errors.append({"line": line, "error": error})
+
+async def _gunzip(chunks: AsyncIterable[bytes]) -> AsyncIterator[bytes]:
+    # Inflate in bounded pieces, a small compressed chunk can expand to a lot of data
+    decompressor = zlib.decompressobj(wbits=zlib.MAX_WBITS | 16)
+    try:
+        async for chunk in chunks:
+            while chunk:
+                yield decompressor.decompress(chunk, INGEST_READ_SIZE)
+                chunk = decompressor.unconsumed_tail
+        yield decompressor.flush()
+    except zlib.error as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid gzip body: {e}")
+
+async def _split_lines(chunks: AsyncIterable[bytes]) -> AsyncIterator[Optional[bytes]]:
+    """
+    Split a byte stream into lines, lines longer than INGEST_MAX_LINE_BYTES are dropped
+    :return: each line, or None in place of an over-long line
+    """
+    buffer = bytearray()
+    overflow = False
+    async for chunk in chunks:
+        buffer += chunk
+        start = 0
+        while True:
+            end = buffer.find(b"\n", start)
+            if end < 0:
+                break
+            if overflow:
+                overflow = False
+                yield None
+            else:
+                yield bytes(buffer[start:end])
+            start = end + 1
+        del buffer[:start]
+        if len(buffer) > INGEST_MAX_LINE_BYTES:
+            # Drop the partial line and skip the rest of it
+            overflow = True
+            buffer.clear()
+
+    if overflow:
+        yield None
+    elif buffer:
+        yield bytes(buffer)
+
+def _has_nul(value) -> bool:
+    if isinstance(value, str):
+        return "\x00" in value
+    if isinstance(value, dict):
+        return any(_has_nul(key) or _has_nul(item) for key, item in value.items())
+    if isinstance(value, list):
+        return any(_has_nul(item) for item in value)
+    return False
+
+def _column_error(log: schemas.Log, line: bytes) -> Optional[str]:
+    """
+    Values the schema accepts but the audit_logs columns do not. They would fail
+    the whole COPY instead of one line.
+    :return: error message, or None when the log can be inserted
+    """
+    try:
+        ipaddress.ip_interface(log.ip_address)
+    except ValueError:
+        return f"ip_address: {log.ip_address!r} is not a valid IP address"
+    # text and jsonb cannot hold NUL, only look for it when the line has an escaped one
+    if b"\\u0000" in line:
+        for field, value in log:
+            if _has_nul(value):
+                return f"{field}: NUL characters are not allowed"
+    return None
+
+def _validation_message(error: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(str(part) for part in err['loc'])}: {err['msg']}" for err in error.errors())
+
+async def iter_ndjson_logs(chunks: AsyncIterable[bytes], tenant_id: str, report: IngestReport,
+                           gzipped: bool = False) -> AsyncIterator[schemas.Log]:
+    """
+    Validate an NDJSON byte stream line by line. Invalid lines and lines of another
+    tenant are recorded in the report and skipped, the stream goes on.
+    :return: valid logs, one at a time
+    """
+    if gzipped:
+        chunks = _gunzip(chunks)
+
+    line_no = 0
+    async for line in _split_lines(chunks):
+        line_no += 1
+        if line is None:
+            report.lines += 1
+            report.reject(line_no, f"Line exceeds {INGEST_MAX_LINE_BYTES} bytes")
+            continue
+        if not line.strip():
+            continue
+
+        report.lines += 1
+        try:
+            log = schemas.Log.model_validate_json(line)
+        except ValidationError as e:
+            report.reject(line_no, _validation_message(e))
+            continue
+        error = _column_error(log, line)
+        if error:
+            report.reject(line_no, error)
+            continue
+        if str(log.tenant_id) != tenant_id:
+            report.reject(line_no, "Tenant ID mismatch")
+            continue
+        yield log
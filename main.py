@@ -1,17 +1,143 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from typing import Union
+from fastapi import FastAPI, Depends, Query, Response, status
+from fastapi.responses import PlainTextResponse
 
-from middleware import TimePerformanceMiddleware
+from archive import archiver
+from auth import verifier, verify_metrics_access
+from cache import response_cache
+from db import get_db, pool_metrics, open_pools, close_pools, database_ready
+from outbox import relay
+from partitions import maintainer
+from rollups import compactor
+from streaming import listener, manager
+from metrics import CONTENT_TYPE, registry
+from middleware import MetricsMiddleware, ProfilingMiddleware, RateLimitMiddleware
+from profiling import slow_log
+from ratelimit import limiter
+from retention import retention
 from routers import audit_logs_router, tenants_router
-app = FastAPI()
 
-# Register middleware
-app.add_middleware(TimePerformanceMiddleware)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Open the connection pools on the server event loop, waiting for the database with
+    # bounded retries (see db.open_pools), and close them on shutdown
+    await open_pools()
+    maintainer.start()
+    relay.start()
+    compactor.start()
+    listener.start()
+    retention.start()
+    archiver.start()
+    yield
+    archiver.stop()
+    retention.stop()
+    await listener.stop()
+    compactor.stop()
+    relay.stop()
+    maintainer.stop()
+    await close_pools()
+    slow_log.close()
+
+app = FastAPI(lifespan=lifespan)
+
+# Register middleware (the last one added runs first)
+app.add_middleware(RateLimitMiddleware)
+app.add_middleware(ProfilingMiddleware)
+app.add_middleware(MetricsMiddleware)
 
 # Register router for endpoints
 app.include_router(audit_logs_router, prefix="/api/v1", tags=["Audit Logs"])
 app.include_router(tenants_router, prefix="/api/v1", tags=["Tenants"])
 
+# Component stats scraped along with the histograms, as gauges
+for prefix, stats in (("db_pool", pool_metrics), ("outbox", relay.stats), ("rollups", compactor.stats),
+                      ("partitions", maintainer.stats),
+                      ("retention", retention.stats), ("archive", archiver.stats),
+                      ("response_cache", response_cache.stats),
+                      ("stream", manager.stats), ("ratelimit", limiter.stats), ("auth", verifier.stats),
+                      ("slow_log", slow_log.stats)):
+    registry.add_collector(prefix, stats)
+
+# Operators only: the metrics expose every tenant's traffic, and the slow log SQL and plans
+METRICS_AUTH = [Depends(verify_metrics_access)]
+
 # root function
 @app.get("/")
 def root():
-    return {"Testing": "Audit Log"}
\ No newline at end of file
+    return {"Testing": "Audit Log"}
+
+# Liveness: the process is up and serving, no dependency is checked
+@app.get("/health/live", summary="Liveness probe")
+def liveness():
+    return {"status": "ok"}
+
+# Readiness: the database answers. 503 before the pools are open, after they are closed
+# and while the database is unreachable
+@app.get("/health/ready", summary="Readiness probe")
+async def readiness(response: Response):
+    if not await database_ready():
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+        return {"status": "unavailable", "database": "unavailable"}
+    return {"status": "ready", "database": "ok"}
+
+# Prometheus scrape endpoint: request / query / external call histograms and component stats
+@app.get("/metrics", summary="Prometheus metrics", dependencies=METRICS_AUTH, response_class=PlainTextResponse)
+def get_metrics():
+    return PlainTextResponse(registry.render(), media_type=CONTENT_TYPE)
+
+# Database connection pool usage
+@app.get("/metrics/pool", summary="Database connection pool metrics", dependencies=METRICS_AUTH)
+def get_pool_metrics():
+    return pool_metrics()
+
+# Transactional outbox relay: throughput, lag and backlog
+@app.get("/metrics/outbox", summary="Outbox relay metrics", dependencies=METRICS_AUTH)
+def get_outbox_metrics(curr = Depends(get_db)):
+    return {**relay.stats(), **relay.backlog(curr)}
+
+# Stats rollup compactor: runs and deltas waiting to be folded
+@app.get("/metrics/rollups", summary="Stats rollup compactor metrics", dependencies=METRICS_AUTH)
+def get_rollup_metrics(curr = Depends(get_db)):
+    return {**compactor.stats(), **compactor.backlog(curr)}
+
+# audit_logs partitions: bounds, estimated rows and size, rows left in the default partition
+@app.get("/metrics/partitions", summary="audit_logs partition metrics", dependencies=METRICS_AUTH)
+def get_partition_metrics(curr = Depends(get_db)):
+    return {**maintainer.stats(), **maintainer.partitions(curr)}
+
+# Retention worker: jobs run, rows deleted, partitions dropped, jobs waiting
+@app.get("/metrics/retention", summary="Retention worker metrics", dependencies=METRICS_AUTH)
+def get_retention_metrics(curr = Depends(get_db)):
+    return {**retention.stats(), **retention.backlog(curr)}
+
+# Cold tier: segments written and read, archived rows and bytes
+@app.get("/metrics/archive", summary="Archiver metrics", dependencies=METRICS_AUTH)
+def get_archive_metrics(curr = Depends(get_db)):
+    return {**archiver.stats(), **archiver.backlog(curr)}
+
+# Response cache: hits, misses, evictions and invalidations
+@app.get("/metrics/cache", summary="Response cache metrics", dependencies=METRICS_AUTH)
+def get_cache_metrics():
+    return response_cache.stats()
+
+# WebSocket stream: subscribers, queued / delivered / dropped messages
+@app.get("/metrics/stream", summary="Log stream metrics", dependencies=METRICS_AUTH)
+def get_stream_metrics():
+    return manager.stats()
+
+# JWT verification cache: hit rate, failures and trusted key ids
+@app.get("/metrics/auth", summary="JWT verification cache metrics", dependencies=METRICS_AUTH)
+def get_auth_metrics():
+    return verifier.stats()
+
+# Per-tenant rate limits: allowed / limited requests per route class
+@app.get("/metrics/ratelimit", summary="Rate limiter metrics", dependencies=METRICS_AUTH)
+def get_ratelimit_metrics():
+    return limiter.stats()
+
+# Slow requests, slow statements (with their plan when captured) and request profiles
+@app.get("/metrics/slow", summary="Slow log and request profiles", dependencies=METRICS_AUTH)
+def get_slow_log(type: Union[str, None] = Query(None, pattern="^(request|query|profile)$"),
+                 profile_id: Union[str, None] = None, limit: int = Query(50, ge=1, le=1000)):
+    return {**slow_log.stats(), "entries": slow_log.recent(type, profile_id, limit)}
@@ -0,0 +1,210 @@
+# metrics.py
+# In-process Prometheus metrics: labelled counters and histograms, rendered in the text
+# exposition format on GET /metrics together with the stats of the other components.
+# Dependency-free and cheap to update: an observation is a bisect and three additions
+# under a lock, rendering happens at scrape time only.
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+METRICS_SAMPLE_RATE = float(os.getenv("METRICS_SAMPLE_RATE", "1"))   # share of HTTP requests recorded
+METRICS_TENANT_LABEL = os.getenv("METRICS_TENANT_LABEL", "1") == "1"
+METRICS_MAX_TENANTS = int(os.getenv("METRICS_MAX_TENANTS", "100"))   # tenant label values, then "other"
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000, 100_000_000)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels: tuple = (), value: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + value
+
+    def value(self, labels: tuple = ()) -> float:
+        return self._values.get(labels, 0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        lines.extend(f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}" for labels, value in values)
+        return lines
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts (the last one is +Inf), sum, count]
+        self._series: Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels: tuple, value: float):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def count(self, labels: tuple) -> int:
+        series = self._series.get(labels)
+        return series[2] if series else 0
+
+    def render(self) -> List[str]:
+        with self._lock:
+            snapshot = [(labels, list(series[0]), series[1], series[2]) for labels, series in self._series.items()]
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, counts, total, count in snapshot:
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += bucket_count
+                le = bound if bound == "+Inf" else _number(float(bound))
+                bucket_labels = _labels(self.labelnames, labels, f'le="{le}"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {count}")
+        return lines
+
+def stats_gauges(prefix: str, stats: dict) -> List[str]:
+    """
+    Numeric values of a component's stats() as gauges, nested dicts flattened into the name
+    :return: exposition lines
+    """
+    lines = []
+    for key, value in stats.items():
+        name = f"{prefix}_{key}"
+        if isinstance(value, dict):
+            lines.extend(stats_gauges(name, value))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            lines.extend([f"# TYPE {name} gauge", f"{name} {_number(value)}"])
+    return lines
+
+class Registry:
+    def __init__(self):
+        self.metrics: List = []
+        self.collectors: List[Tuple[str, Callable[[], dict]]] = []
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, help, labelnames)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        metric = Histogram(name, help, labelnames, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, prefix: str, stats: Callable[[], dict]):
+        # Read at scrape time
+        self.collectors.append((prefix, stats))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        for prefix, stats in self.collectors:
+            try:
+                lines.extend(stats_gauges(prefix, stats()))
+            except Exception as e:
+                print(f"Metrics collector {prefix} error: {e}")
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+HTTP_REQUESTS = registry.counter(
+    "http_requests_total", "HTTP requests, all of them whatever the sample rate", ("method",))
+HTTP_DURATION = registry.histogram(
+    "http_request_duration_seconds", "HTTP request latency, sampled (see metrics_sample_rate)",
+    ("method", "route", "status", "tenant"))
+HTTP_REQUEST_BYTES = registry.histogram(
+    "http_request_size_bytes", "HTTP request body size from Content-Length, sampled",
+    ("method", "route"), SIZE_BUCKETS)
+HTTP_RESPONSE_BYTES = registry.histogram(
+    "http_response_size_bytes", "HTTP response body size, sampled", ("method", "route"), SIZE_BUCKETS)
+DB_DURATION = registry.histogram(
+    "db_query_duration_seconds", "Database statement time, results included", ("operation",))
+EXTERNAL_DURATION = registry.histogram(
+    "external_call_duration_seconds", "SQS / OpenSearch call time", ("service", "operation", "outcome"))
+EXTERNAL_BYTES = registry.histogram(
+    "external_payload_bytes", "SQS / OpenSearch request payload size", ("service", "operation"), SIZE_BUCKETS)
+registry.add_collector("metrics", lambda: {"sample_rate": METRICS_SAMPLE_RATE})
+
+# Statement kinds used as the operation label, anything else is OTHER
+DB_OPERATIONS = {"SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "COPY", "LISTEN", "NOTIFY",
+                 "ANALYZE", "CREATE", "DROP", "ALTER", "TRUNCATE", "EXPLAIN"}
+
+def query_operation(query) -> str:
+    if isinstance(query, bytes):
+        query = query.decode(errors="replace")
+    if not isinstance(query, str):
+        # psycopg.sql.Composed and friends
+        return "OTHER"
+    head = query[:100].lstrip()[:10].split(None, 1)
+    operation = head[0].upper() if head else ""
+    return operation if operation in DB_OPERATIONS else "OTHER"
+
+def observe_query(query, seconds: float):
+    DB_DURATION.observe((query_operation(query),), seconds)
+
+_tenants: set = set()
+_tenants_lock = threading.Lock()
+
+def tenant_label(tenant_id: Optional[str]) -> str:
+    """
+    Tenant label value, the first METRICS_MAX_TENANTS tenants seen keep their own series
+    :return: tenant id, "other" or "" for unauthenticated requests
+    """
+    if not tenant_id or not METRICS_TENANT_LABEL:
+        return ""
+    if tenant_id in _tenants:
+        return tenant_id
+    with _tenants_lock:
+        if len(_tenants) < METRICS_MAX_TENANTS:
+            _tenants.add(tenant_id)
+            return tenant_id
+    return "other"
+
+@contextmanager
+def external_call(service: str, operation: str, payload_size: Optional[int] = None):
+    """
+    Time a call to SQS / OpenSearch, outcome "error" when it raises
+    :return: None
+    """
+    if payload_size is not None:
+        EXTERNAL_BYTES.observe((service, operation), payload_size)
+    outcome = "error"
+    start = time.perf_counter()
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        EXTERNAL_DURATION.observe((service, operation, outcome), time.perf_counter() - start)
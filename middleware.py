@@ -1,15 +1,190 @@
 # middleware.py
 
+import random
 import time
-from starlette.middleware.base import BaseHTTPMiddleware, RequestResponseEndpoint
-from starlette.requests import Request
-from starlette.responses import Response
+from typing import Optional
 
+import jwt
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from auth import is_operator_token, verifier
+from metrics import (HTTP_DURATION, HTTP_REQUEST_BYTES, HTTP_REQUESTS, HTTP_RESPONSE_BYTES,
+                     METRICS_SAMPLE_RATE, tenant_label)
+from profiling import PROFILE_SAMPLE_RATE, SLOW_REQUEST_MS, Profile, slow_log, wants_profile
+from ratelimit import RateLimiter, limiter, rate_limited_response, route_class
+
+TENANT_SCOPE_KEY = "audit_log.tenant_id"
+
+
+class MetricsMiddleware:
+    """
+    Latency and payload size histograms per route, status and tenant (see metrics.py).
+    Plain ASGI: only the response start and body messages are looked at, nothing is
+    printed or buffered. Requests outside the sample are counted and passed through.
+    """
+    def __init__(self, app: ASGIApp, sample_rate: float = METRICS_SAMPLE_RATE):
+        self.app = app
+        self.sample_rate = sample_rate
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        method = scope["method"]
+        HTTP_REQUESTS.inc((method,))
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            await self.app(scope, receive, send)
+            return
 
-class TimePerformanceMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next: RequestResponseEndpoint) -> Response:
         start = time.perf_counter()
-        response = await call_next(request)
-        duration = time.perf_counter() - start
-        print(f"{request.method} {request.url.path} took {duration:.4f} seconds")
-        return response
+        status_code = 500
+        sent = 0
+
+        async def send_wrapper(message):
+            nonlocal status_code, sent
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            elif message["type"] == "http.response.body":
+                sent += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration = time.perf_counter() - start
+            route = route_template(scope)
+            HTTP_DURATION.observe((method, route, str(status_code), tenant_label(tenant_of(scope))), duration)
+            HTTP_RESPONSE_BYTES.observe((method, route), sent)
+            for name, value in scope["headers"]:
+                if name == b"content-length":
+                    HTTP_REQUEST_BYTES.observe((method, route), int(value))
+                    break
+
+
+class ProfilingMiddleware:
+    """
+    Profiles the requests sampled or asking for it (X-Profile: 1 with the operator
+    credential), and writes requests over SLOW_REQUEST_MS to the slow log (see
+    profiling.py). Plain ASGI, a request that is neither profiled nor slow costs a
+    header scan and two clock reads.
+    """
+    def __init__(self, app: ASGIApp, sample_rate: float = PROFILE_SAMPLE_RATE, slow_ms: float = SLOW_REQUEST_MS):
+        self.app = app
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        profile = None
+        if wants_profile(scope["headers"], self.sample_rate, operator_credentials):
+            profile = Profile("request", method=scope["method"], path=scope["path"])
+            token = profile.activate()
+        start = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if profile is not None:
+                    # Spans finished by now, a streamed body is still to come
+                    message = {**message, "headers": [*message.get("headers", []),
+                                                      (b"server-timing", profile.server_timing().encode()),
+                                                      (b"x-profile-id", profile.id.encode())]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration_ms = (time.perf_counter() - start) * 1000
+            if profile is not None:
+                profile.finish(token)
+            slow = duration_ms >= self.slow_ms
+            if slow or profile is not None:
+                route = route_template(scope)
+                entry = {"method": scope["method"], "route": route, "status": status_code,
+                         "duration_ms": round(duration_ms, 3), "tenant": tenant_of(scope)}
+                if profile is not None:
+                    profile.root.attrs["route"] = route
+                    entry["profile_id"] = profile.id
+                    entry["spans"] = profile.to_dict()
+                slow_log.write("request" if slow else "profile", entry)
+
+
+class RateLimitMiddleware:
+    """
+    Per-tenant request limits, before any endpoint work. Plain ASGI: no extra task or
+    body wrapping per request. Requests without a valid token pass through, the
+    endpoint answers them 401.
+    """
+    def __init__(self, app: ASGIApp, limiter: RateLimiter = limiter):
+        self.app = app
+        self.limiter = limiter
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] == "http" and self.limiter.enabled:
+            name = route_class(scope["method"], scope["path"])
+            tenant_id = tenant_of(scope) if name else None
+            if tenant_id:
+                wait = await self.limiter.acheck(tenant_id, name)
+                if wait:
+                    await rate_limited_response(wait)(scope, receive, send)
+                    return
+        await self.app(scope, receive, send)
+
+
+_route_prefixes: dict = {}   # id(route) -> prefix, routes live as long as the app
+
+
+def route_template(scope: Scope) -> str:
+    """
+    Route template of a request once the router matched it, never the raw path.
+    The matched route's path can be relative to its included router, the prefix
+    is found once per route from the first request path it matched.
+    :return: e.g. /api/v1/logs/{id}
+    """
+    route = scope.get("route")
+    path_format = getattr(route, "path_format", None)
+    if path_format is None:
+        return "unmatched"
+    prefix = _route_prefixes.get(id(route))
+    if prefix is None:
+        path = scope["path"]
+        prefix = next((path[:i] for i in range(len(path)) if path[i] == "/" and route.path_regex.match(path[i:])), "")
+        _route_prefixes[id(route)] = prefix
+    return prefix + path_format
+
+
+def tenant_of(scope: Scope) -> Optional[str]:
+    # Tenant of the Bearer token, verified through the cache verify_jwt uses as well,
+    # and kept in the scope for the other middlewares
+    if TENANT_SCOPE_KEY not in scope:
+        scope[TENANT_SCOPE_KEY] = _verified_tenant(scope)
+    return scope[TENANT_SCOPE_KEY]
+
+
+def bearer_token(headers: list) -> Optional[str]:
+    for name, value in headers:
+        if name == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            return token.strip() if scheme.lower() == "bearer" else None
+    return None
+
+
+def operator_credentials(headers: list) -> bool:
+    # The credential of the operator endpoints, see auth.verify_metrics_access
+    token = bearer_token(headers)
+    return token is not None and is_operator_token(token)
+
+
+def _verified_tenant(scope: Scope) -> Optional[str]:
+    token = bearer_token(scope["headers"])
+    if token is None:
+        return None
+    try:
+        return str(verifier.verify(token).tenant_id)
+    except jwt.PyJWTError:
+        return None
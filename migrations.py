@@ -0,0 +1,451 @@
+# migrations.py
+# Versioned schema changes, applied in order and recorded in schema_migrations.
+#
+#   python migrations.py            # apply pending migrations
+#   python migrations.py --list     # show applied / pending migrations
+import re
+import sys
+from typing import List, NamedTuple
+
+import psycopg
+from psycopg import Connection
+
+class Migration(NamedTuple):
+    name: str
+    statements: List[str]
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction block
+    transactional: bool = True
+
+MIGRATIONS = [
+    Migration("0001_initial_schema", [
+        """
+        CREATE TABLE IF NOT EXISTS public.tenants (
+            id UUID DEFAULT gen_random_uuid(),
+            name TEXT NOT NULL,
+            status TEXT DEFAULT 'active',
+            created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (id),
+            CONSTRAINT chk_status CHECK (status IN ('active', 'inactive', 'suspended'))
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS public.audit_logs
+        (
+            id uuid DEFAULT gen_random_uuid(),
+            tenant_id uuid NOT NULL,
+            user_id uuid,
+            session_id text,
+            ip_address inet,
+            user_agent text,
+            action_type text NOT NULL,
+            resource_type text NOT NULL,
+            resource_id text NOT NULL,
+            severity text NOT NULL,
+            before_state jsonb,
+            after_state jsonb,
+            metadata jsonb,
+            created_at timestamp with time zone DEFAULT current_timestamp,
+            PRIMARY KEY (id),
+            CONSTRAINT chk_action_type CHECK (action_type IN ('CREATE', 'UPDATE', 'DELETE', 'VIEW')),
+            CONSTRAINT chk_severity CHECK (severity in ('INFO', 'WARNING', 'ERROR', 'CRITICAL'))
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_audit_tenant ON public.audit_logs (tenant_id)",
+        "CREATE INDEX IF NOT EXISTS idx_audit_resource ON public.audit_logs (resource_type, resource_id)",
+    ]),
+    Migration("0002_log_outbox", [
+        """
+        CREATE TABLE IF NOT EXISTS public.log_outbox
+        (
+            id bigserial,
+            payload jsonb NOT NULL,
+            attempts integer NOT NULL DEFAULT 0,
+            next_attempt_at timestamp with time zone NOT NULL DEFAULT current_timestamp,
+            created_at timestamp with time zone NOT NULL DEFAULT current_timestamp,
+            PRIMARY KEY (id)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_log_outbox_next_attempt ON public.log_outbox (next_attempt_at)",
+    ]),
+    # Tenant-leading composites for every search filter (+ created_at, id for the keyset order),
+    # which also serve the stats and export queries. BRIN for tenant-less time range scans,
+    # GIN for metadata containment queries.
+    Migration("0003_audit_log_indexes", [
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_audit_tenant_created ON public.audit_logs (tenant_id, created_at, id)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_audit_tenant_user ON public.audit_logs (tenant_id, user_id, created_at, id)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_audit_tenant_session ON public.audit_logs (tenant_id, session_id, created_at, id)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_audit_tenant_action ON public.audit_logs (tenant_id, action_type, created_at, id)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_audit_tenant_severity ON public.audit_logs (tenant_id, severity, created_at, id)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_audit_tenant_resource ON public.audit_logs (tenant_id, resource_type, created_at, id)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_audit_created_brin ON public.audit_logs USING brin (created_at)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_audit_metadata_gin ON public.audit_logs USING gin (metadata jsonb_path_ops)",
+        # Covered by the composites above / never used by any query
+        "DROP INDEX CONCURRENTLY IF EXISTS public.idx_audit_tenant",
+        "DROP INDEX CONCURRENTLY IF EXISTS public.idx_audit_created_at",
+    ], transactional=False),
+    # Full-text search for ?q=, the expression must match SEARCH_VECTOR_SQL in routers/audit_logs.py.
+    # An expression index is maintained on every insert path (INSERT, unnest, COPY) with no extra column.
+    Migration("0004_audit_log_search", [
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_audit_search ON public.audit_logs USING gin (
+            (to_tsvector('simple'::regconfig, resource_id) ||
+             jsonb_to_tsvector('simple'::regconfig, coalesce(metadata, '{}'::jsonb), '["all"]'::jsonb))
+        )
+        """,
+    ], transactional=False),
+    # Hourly count rollups for GET /logs/stats (see rollups.py). The triggers are statement-level
+    # with transition tables, one aggregated delta row set per INSERT / COPY / DELETE statement.
+    # Audit logs are never updated, so there is no UPDATE trigger.
+    Migration("0005_audit_log_rollups", [
+        """
+        CREATE TABLE IF NOT EXISTS public.audit_log_rollups
+        (
+            tenant_id uuid NOT NULL,
+            bucket timestamp with time zone NOT NULL,
+            action_type text NOT NULL,
+            severity text NOT NULL,
+            count bigint NOT NULL,
+            PRIMARY KEY (tenant_id, bucket, action_type, severity)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS public.audit_log_rollup_deltas
+        (
+            id bigserial,
+            tenant_id uuid NOT NULL,
+            bucket timestamp with time zone NOT NULL,
+            action_type text NOT NULL,
+            severity text NOT NULL,
+            count bigint NOT NULL,
+            PRIMARY KEY (id)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_rollup_deltas_tenant ON public.audit_log_rollup_deltas (tenant_id, bucket)",
+        """
+        CREATE OR REPLACE FUNCTION public.audit_logs_rollup_delta() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                INSERT INTO public.audit_log_rollup_deltas (tenant_id, bucket, action_type, severity, count)
+                SELECT tenant_id, date_trunc('hour', created_at, 'UTC'), action_type, severity, COUNT(*)
+                FROM new_rows
+                GROUP BY 1, 2, 3, 4;
+            ELSE
+                INSERT INTO public.audit_log_rollup_deltas (tenant_id, bucket, action_type, severity, count)
+                SELECT tenant_id, date_trunc('hour', created_at, 'UTC'), action_type, severity, -COUNT(*)
+                FROM old_rows
+                GROUP BY 1, 2, 3, 4;
+            END IF;
+            RETURN NULL;
+        END
+        $$
+        """,
+        """
+        CREATE OR REPLACE TRIGGER audit_logs_rollup_insert AFTER INSERT ON public.audit_logs
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION public.audit_logs_rollup_delta()
+        """,
+        """
+        CREATE OR REPLACE TRIGGER audit_logs_rollup_delete AFTER DELETE ON public.audit_logs
+        REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION public.audit_logs_rollup_delta()
+        """,
+        # Backfill, the trigger lock on audit_logs holds off writes until this commits
+        """
+        INSERT INTO public.audit_log_rollups (tenant_id, bucket, action_type, severity, count)
+        SELECT tenant_id, date_trunc('hour', created_at, 'UTC'), action_type, severity, COUNT(*)
+        FROM public.audit_logs
+        GROUP BY 1, 2, 3, 4
+        ON CONFLICT DO NOTHING
+        """,
+    ]),
+    # Monthly range partitions of audit_logs on created_at (UTC months), so time-bounded
+    # queries only read the partitions they cover and old months can be dropped whole.
+    # The table is copied into the partitioned one within this transaction: on a large
+    # table, run it in a maintenance window. The primary key must include the partition
+    # key, ids stay unique (gen_random_uuid / uuid4) but are only enforced per created_at.
+    Migration("0006_audit_log_partitions", [
+        "ALTER TABLE public.audit_logs RENAME TO audit_logs_heap",
+        "ALTER INDEX public.audit_logs_pkey RENAME TO audit_logs_heap_pkey",
+        """
+        CREATE TABLE public.audit_logs
+        (
+            id uuid NOT NULL DEFAULT gen_random_uuid(),
+            tenant_id uuid NOT NULL,
+            user_id uuid,
+            session_id text,
+            ip_address inet,
+            user_agent text,
+            action_type text NOT NULL,
+            resource_type text NOT NULL,
+            resource_id text NOT NULL,
+            severity text NOT NULL,
+            before_state jsonb,
+            after_state jsonb,
+            metadata jsonb,
+            created_at timestamp with time zone NOT NULL DEFAULT current_timestamp,
+            PRIMARY KEY (id, created_at),
+            CONSTRAINT chk_action_type CHECK (action_type IN ('CREATE', 'UPDATE', 'DELETE', 'VIEW')),
+            CONSTRAINT chk_severity CHECK (severity in ('INFO', 'WARNING', 'ERROR', 'CRITICAL'))
+        ) PARTITION BY RANGE (created_at)
+        """,
+        # Catches rows of a month without a partition yet, moved out when it is created
+        "CREATE TABLE public.audit_logs_default PARTITION OF public.audit_logs DEFAULT",
+        # Partitions are built detached and attached: ATTACH PARTITION does not block
+        # reads and writes on audit_logs the way CREATE TABLE ... PARTITION OF does
+        """
+        CREATE OR REPLACE FUNCTION public.create_audit_log_partitions(first_month timestamptz, last_month timestamptz)
+        RETURNS integer
+        LANGUAGE plpgsql AS $$
+        DECLARE
+            month_start timestamptz := date_trunc('month', first_month, 'UTC');
+            month_end timestamptz;
+            partition_name text;
+            created integer := 0;
+        BEGIN
+            -- One maintainer at a time, e.g. with several app processes
+            PERFORM pg_advisory_xact_lock(hashtext('public.audit_logs partitions'));
+            WHILE month_start <= last_month LOOP
+                month_end := (month_start AT TIME ZONE 'UTC' + interval '1 month') AT TIME ZONE 'UTC';
+                partition_name := 'audit_logs_p' || to_char(month_start AT TIME ZONE 'UTC', 'YYYYMM');
+                IF to_regclass('public.' || partition_name) IS NULL THEN
+                    EXECUTE format('CREATE TABLE public.%I (LIKE public.audit_logs INCLUDING DEFAULTS INCLUDING CONSTRAINTS)',
+                                   partition_name);
+                    IF EXISTS (SELECT 1 FROM public.audit_logs_default
+                               WHERE created_at >= month_start AND created_at < month_end) THEN
+                        EXECUTE format('WITH moved AS (DELETE FROM public.audit_logs_default '
+                                       'WHERE created_at >= $1 AND created_at < $2 RETURNING *) '
+                                       'INSERT INTO public.%I SELECT * FROM moved', partition_name)
+                        USING month_start, month_end;
+                    END IF;
+                    EXECUTE format('ALTER TABLE public.audit_logs ATTACH PARTITION public.%I FOR VALUES FROM (%L) TO (%L)',
+                                   partition_name, month_start, month_end);
+                    created := created + 1;
+                END IF;
+                month_start := month_end;
+            END LOOP;
+            RETURN created;
+        END
+        $$
+        """,
+        """
+        SELECT public.create_audit_log_partitions(
+            coalesce((SELECT min(created_at) FROM public.audit_logs_heap), now()), now() + interval '3 months')
+        """,
+        # Copied before the indexes and the rollup triggers exist: the rollups count these rows already
+        """
+        INSERT INTO public.audit_logs
+        SELECT id, tenant_id, user_id, session_id, ip_address, user_agent, action_type, resource_type,
+               resource_id, severity, before_state, after_state, metadata, coalesce(created_at, now())
+        FROM public.audit_logs_heap
+        """,
+        "DROP TABLE public.audit_logs_heap",
+        # The indexes of 0001, 0003 and 0004, created on every partition
+        "CREATE INDEX idx_audit_resource ON public.audit_logs (resource_type, resource_id)",
+        "CREATE INDEX idx_audit_tenant_created ON public.audit_logs (tenant_id, created_at, id)",
+        "CREATE INDEX idx_audit_tenant_user ON public.audit_logs (tenant_id, user_id, created_at, id)",
+        "CREATE INDEX idx_audit_tenant_session ON public.audit_logs (tenant_id, session_id, created_at, id)",
+        "CREATE INDEX idx_audit_tenant_action ON public.audit_logs (tenant_id, action_type, created_at, id)",
+        "CREATE INDEX idx_audit_tenant_severity ON public.audit_logs (tenant_id, severity, created_at, id)",
+        "CREATE INDEX idx_audit_tenant_resource ON public.audit_logs (tenant_id, resource_type, created_at, id)",
+        "CREATE INDEX idx_audit_created_brin ON public.audit_logs USING brin (created_at)",
+        "CREATE INDEX idx_audit_metadata_gin ON public.audit_logs USING gin (metadata jsonb_path_ops)",
+        """
+        CREATE INDEX idx_audit_search ON public.audit_logs USING gin (
+            (to_tsvector('simple'::regconfig, resource_id) ||
+             jsonb_to_tsvector('simple'::regconfig, coalesce(metadata, '{}'::jsonb), '["all"]'::jsonb))
+        )
+        """,
+        # Statement-level triggers on the partitioned table see the rows of every partition
+        """
+        CREATE TRIGGER audit_logs_rollup_insert AFTER INSERT ON public.audit_logs
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION public.audit_logs_rollup_delta()
+        """,
+        """
+        CREATE TRIGGER audit_logs_rollup_delete AFTER DELETE ON public.audit_logs
+        REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION public.audit_logs_rollup_delta()
+        """,
+    ]),
+    # Per-tenant retention rules and the batched delete jobs applying them (see retention.py)
+    Migration("0007_retention", [
+        """
+        CREATE TABLE IF NOT EXISTS public.retention_policies
+        (
+            tenant_id uuid NOT NULL,
+            rules jsonb NOT NULL,
+            updated_at timestamp with time zone NOT NULL DEFAULT current_timestamp,
+            PRIMARY KEY (tenant_id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS public.retention_jobs
+        (
+            id uuid DEFAULT gen_random_uuid(),
+            tenant_id uuid NOT NULL,
+            rules jsonb NOT NULL,
+            source text NOT NULL DEFAULT 'request',
+            status text NOT NULL DEFAULT 'queued',
+            deleted bigint NOT NULL DEFAULT 0,
+            batches integer NOT NULL DEFAULT 0,
+            error text,
+            created_at timestamp with time zone NOT NULL DEFAULT current_timestamp,
+            started_at timestamp with time zone,
+            finished_at timestamp with time zone,
+            updated_at timestamp with time zone NOT NULL DEFAULT current_timestamp,
+            PRIMARY KEY (id),
+            CONSTRAINT chk_retention_source CHECK (source IN ('request', 'policy')),
+            CONSTRAINT chk_retention_status CHECK (status IN ('queued', 'running', 'done', 'failed'))
+        )
+        """,
+        # One active job per tenant
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_retention_jobs_active ON public.retention_jobs (tenant_id)
+        WHERE status IN ('queued', 'running')
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_retention_jobs_tenant ON public.retention_jobs (tenant_id, created_at)",
+        # Monthly partitions wholly before a cutoff are dropped instead of deleted row by
+        # row. DROP fires no trigger, so the rollups get the negative deltas here.
+        """
+        CREATE OR REPLACE FUNCTION public.drop_audit_log_partitions(before timestamptz)
+        RETURNS integer
+        LANGUAGE plpgsql AS $$
+        DECLARE
+            partition_name text;
+            dropped integer := 0;
+        BEGIN
+            PERFORM pg_advisory_xact_lock(hashtext('public.audit_logs partitions'));
+            FOR partition_name IN
+                SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+                WHERE i.inhparent = 'public.audit_logs'::regclass AND c.relname ~ '^audit_logs_p[0-9]{6}$'
+                  AND (to_date(substr(c.relname, 13), 'YYYYMM')::timestamp + interval '1 month') AT TIME ZONE 'UTC' <= before
+                ORDER BY c.relname
+            LOOP
+                EXECUTE format('INSERT INTO public.audit_log_rollup_deltas (tenant_id, bucket, action_type, severity, count) '
+                               'SELECT tenant_id, date_trunc(''hour'', created_at, ''UTC''), action_type, severity, -COUNT(*) '
+                               'FROM public.%I GROUP BY 1, 2, 3, 4', partition_name);
+                EXECUTE format('ALTER TABLE public.audit_logs DETACH PARTITION public.%I', partition_name);
+                EXECUTE format('DROP TABLE public.%I', partition_name);
+                dropped := dropped + 1;
+            END LOOP;
+            RETURN dropped;
+        END
+        $$
+        """,
+    ]),
+    # Catalog of the archived segment files (see archive.py), and rollups that keep
+    # counting archived logs: rows deleted while audit_logs.archiving is on leave no delta
+    Migration("0008_archive_segments", [
+        """
+        CREATE TABLE IF NOT EXISTS public.archive_segments
+        (
+            id uuid DEFAULT gen_random_uuid(),
+            tenant_id uuid NOT NULL,
+            day date NOT NULL,
+            path text NOT NULL,
+            rows bigint NOT NULL,
+            bytes bigint NOT NULL,
+            min_created_at timestamp with time zone NOT NULL,
+            max_created_at timestamp with time zone NOT NULL,
+            action_types jsonb NOT NULL,
+            counts jsonb NOT NULL,
+            created_at timestamp with time zone NOT NULL DEFAULT current_timestamp,
+            PRIMARY KEY (id)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_archive_segments_tenant ON public.archive_segments (tenant_id, min_created_at)",
+        """
+        CREATE OR REPLACE FUNCTION public.audit_logs_rollup_delta() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                INSERT INTO public.audit_log_rollup_deltas (tenant_id, bucket, action_type, severity, count)
+                SELECT tenant_id, date_trunc('hour', created_at, 'UTC'), action_type, severity, COUNT(*)
+                FROM new_rows
+                GROUP BY 1, 2, 3, 4;
+            ELSIF coalesce(current_setting('audit_logs.archiving', true), '') <> 'on' THEN
+                INSERT INTO public.audit_log_rollup_deltas (tenant_id, bucket, action_type, severity, count)
+                SELECT tenant_id, date_trunc('hour', created_at, 'UTC'), action_type, severity, -COUNT(*)
+                FROM old_rows
+                GROUP BY 1, 2, 3, 4;
+            END IF;
+            RETURN NULL;
+        END
+        $$
+        """,
+    ]),
+    # Outbox leases (see outbox.py): a relay marks the rows it publishes with claimed_at in a
+    # short transaction instead of keeping them locked while the sinks are called
+    Migration("0009_outbox_lease", [
+        "ALTER TABLE public.log_outbox ADD COLUMN IF NOT EXISTS claimed_at timestamp with time zone",
+    ]),
+]
+
+# A failed (or cancelled) CREATE INDEX CONCURRENTLY leaves an INVALID index behind,
+# which IF NOT EXISTS then skips on every re-run
+CONCURRENT_INDEX = re.compile(r"CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+IF\s+NOT\s+EXISTS\s+(\w+)", re.IGNORECASE)
+
+INVALID_INDEX_SQL = "SELECT 1 FROM pg_index WHERE indexrelid = to_regclass(%s) AND NOT indisvalid"
+
+def drop_invalid_index(conn: Connection, statement: str) -> bool:
+    """
+    Drop the index a CREATE INDEX CONCURRENTLY IF NOT EXISTS statement builds when a
+    previous run left it INVALID, so the statement builds it again
+    :return: True when an invalid index was dropped
+    """
+    match = CONCURRENT_INDEX.search(statement)
+    if not match:
+        return False
+    name = f"public.{match.group(1)}"
+    if conn.execute(INVALID_INDEX_SQL, (name,)).fetchone() is None:
+        return False
+    print(f"Dropping invalid index {name}")
+    conn.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+    return True
+
+def applied_migrations(conn: Connection) -> List[str]:
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS public.schema_migrations (
+            name text PRIMARY KEY,
+            applied_at timestamp with time zone DEFAULT current_timestamp
+        )
+    """)
+    return [row[0] for row in conn.execute("SELECT name FROM public.schema_migrations ORDER BY name").fetchall()]
+
+def migrate(conn: Connection) -> List[str]:
+    """
+    Apply the pending migrations, conn must be in autocommit mode
+    :return: names of the applied migrations
+    """
+    done = set(applied_migrations(conn))
+    applied = []
+    for migration in MIGRATIONS:
+        if migration.name in done:
+            continue
+        print(f"Applying {migration.name}")
+        if migration.transactional:
+            with conn.transaction():
+                for statement in migration.statements:
+                    conn.execute(statement)
+                conn.execute("INSERT INTO public.schema_migrations (name) VALUES (%s)", (migration.name,))
+        else:
+            # Every statement must be idempotent, a failed run is simply re-applied
+            for statement in migration.statements:
+                drop_invalid_index(conn, statement)
+                conn.execute(statement)
+            conn.execute("INSERT INTO public.schema_migrations (name) VALUES (%s)", (migration.name,))
+        applied.append(migration.name)
+    return applied
+
+if __name__ == "__main__":
+    from db import CONNINFO
+
+    with psycopg.connect(CONNINFO, autocommit=True) as conn:
+        if "--list" in sys.argv:
+            done = set(applied_migrations(conn))
+            for migration in MIGRATIONS:
+                print(f"{'applied' if migration.name in done else 'pending':<8} {migration.name}")
+        else:
+            applied = migrate(conn)
+            print(f"{len(applied)} migration(s) applied")
@@ -0,0 +1,163 @@
+# outbox.py
+# Transactional outbox: every created log gets a log_outbox row in the same
+# transaction as the insert. Relay workers claim pending rows in batches with
+# FOR UPDATE SKIP LOCKED (so any number of relays can run side by side) and a
+# claimed_at lease, publish them through the dispatcher sinks with no transaction
+# open and delete them once delivered. The rows of a relay that dies while
+# publishing are claimed again once the lease expires.
+import os
+import threading
+import time
+from typing import List
+
+from psycopg import Connection, Cursor
+
+from db import pool
+from dispatcher import LogDispatcher, dispatcher
+
+RELAY_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "500"))
+RELAY_WORKERS = int(os.getenv("OUTBOX_WORKERS", "1"))
+RELAY_POLL_SECONDS = float(os.getenv("OUTBOX_POLL_SECONDS", "0.5"))   # idle wait once the outbox is drained
+RELAY_RETRY_SECONDS = float(os.getenv("OUTBOX_RETRY_SECONDS", "1"))   # base delay before a failed row is retried
+RELAY_LEASE_SECONDS = float(os.getenv("OUTBOX_LEASE_SECONDS", "60"))  # claimed rows are hidden from other relays
+
+CLAIM_SQL = """
+WITH pending AS (
+    SELECT id
+    FROM log_outbox
+    WHERE next_attempt_at <= now()
+      AND (claimed_at IS NULL OR claimed_at < now() - make_interval(secs => %s))
+    ORDER BY id
+    LIMIT %s
+    FOR UPDATE SKIP LOCKED
+)
+UPDATE log_outbox
+SET claimed_at = now()
+FROM pending
+WHERE log_outbox.id = pending.id
+RETURNING log_outbox.id, log_outbox.payload, log_outbox.created_at, log_outbox.claimed_at;
+"""
+
+# Both only touch rows still under this relay's lease, an expired lease may have been taken over
+DELETE_SQL = "DELETE FROM log_outbox WHERE id = ANY(%s) AND claimed_at = %s;"
+
+RESCHEDULE_SQL = """
+UPDATE log_outbox
+SET attempts = attempts + 1,
+    claimed_at = NULL,
+    next_attempt_at = now() + make_interval(secs => %s * power(2, LEAST(attempts, 10)))
+WHERE id = ANY(%s) AND claimed_at = %s;
+"""
+
+BACKLOG_SQL = "SELECT COUNT(*) AS pending, MIN(created_at) AS oldest FROM log_outbox;"
+
+class OutboxRelay:
+    def __init__(self, publisher: LogDispatcher, batch_size: int = RELAY_BATCH_SIZE, workers: int = RELAY_WORKERS,
+                 poll_interval: float = RELAY_POLL_SECONDS, retry_delay: float = RELAY_RETRY_SECONDS,
+                 lease: float = RELAY_LEASE_SECONDS):
+        self.publisher = publisher
+        self.batch_size = batch_size
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.retry_delay = retry_delay
+        self.lease = lease
+        self._threads: List[threading.Thread] = []
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self.counters = {"published": 0, "failed": 0, "batches": 0, "publish_seconds": 0.0}
+        self.last_lag_seconds = 0.0
+
+    def start(self):
+        if self._threads:
+            return
+        self._stop.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"outbox-relay-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: float = 10.0):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def run_once(self, conn: Connection) -> int:
+        """
+        Claim one batch of pending outbox rows, publish it and remove the delivered rows
+        :return: number of rows claimed
+        """
+        with conn.transaction():
+            with conn.cursor() as curr:
+                curr.execute(CLAIM_SQL, (self.lease, self.batch_size))
+                rows = curr.fetchall()
+        if not rows:
+            return 0
+
+        # No transaction is open while the sinks (and their retry backoff) run, the lease
+        # keeps other relays away from these rows
+        start = time.perf_counter()
+        payloads = [row["payload"] for row in rows]
+        # Keep the in-process retries short, failed rows are rescheduled in the table
+        failed = {id(log) for log in self.publisher.deliver(payloads, max_retries=1)}
+        elapsed = time.perf_counter() - start
+
+        done = [row["id"] for row in rows if id(row["payload"]) not in failed]
+        retry = [row["id"] for row in rows if id(row["payload"]) in failed]
+        claimed_at = rows[0]["claimed_at"]
+        with conn.transaction():
+            with conn.cursor() as curr:
+                if done:
+                    curr.execute(DELETE_SQL, (done, claimed_at))
+                if retry:
+                    curr.execute(RESCHEDULE_SQL, (self.retry_delay, retry, claimed_at))
+
+        oldest = min(row["created_at"] for row in rows)
+        with self._lock:
+            self.counters["published"] += len(done)
+            self.counters["failed"] += len(retry)
+            self.counters["batches"] += 1
+            self.counters["publish_seconds"] += elapsed
+            self.last_lag_seconds = max(time.time() - oldest.timestamp(), 0.0)
+
+        return len(rows)
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self.counters)
+        busy = counters.pop("publish_seconds")
+        return {
+            **counters,
+            "rows_per_second": round(counters["published"] / busy, 1) if busy else 0.0,
+            "lag_seconds": round(self.last_lag_seconds, 3),
+            "workers": len(self._threads),
+            # Per-sink delivery counters of the publisher
+            "dispatch": self.publisher.stats(),
+        }
+
+    def backlog(self, curr: Cursor) -> dict:
+        """
+        Rows still waiting to be published and the age of the oldest one
+        :return: pending count, oldest_age_seconds
+        """
+        curr.execute(BACKLOG_SQL)
+        row = curr.fetchone()
+        oldest = row["oldest"]
+        return {
+            "pending": row["pending"],
+            "oldest_age_seconds": round(max(time.time() - oldest.timestamp(), 0.0), 3) if oldest else 0.0,
+        }
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                with pool.connection() as conn:
+                    claimed = self.run_once(conn)
+            except Exception as e:
+                print("Outbox relay error:", e)
+                claimed = 0
+            # Keep draining while batches come back full, otherwise wait for new rows
+            if claimed < self.batch_size:
+                self._stop.wait(self.poll_interval)
+
+relay = OutboxRelay(publisher=dispatcher)
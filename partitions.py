@@ -0,0 +1,101 @@
+# partitions.py
+# Monthly partitions of audit_logs (see migration 0006). The maintainer creates the
+# partitions of the coming months ahead of time, so inserts never land in the
+# default partition; a month that did get rows there has them moved into its new
+# partition. Partitions are created by create_audit_log_partitions() in the
+# database, which serializes concurrent maintainers with an advisory lock.
+import os
+import threading
+import time
+from typing import List
+
+from psycopg import Connection, Cursor
+
+from db import pool
+
+PARTITION_PREMAKE_MONTHS = int(os.getenv("PARTITION_PREMAKE_MONTHS", "3"))   # months created ahead
+PARTITION_CHECK_SECONDS = float(os.getenv("PARTITION_CHECK_SECONDS", "3600"))
+
+CREATE_PARTITIONS_SQL = """
+SELECT public.create_audit_log_partitions(now(), now() + make_interval(months => %s)) AS created;
+"""
+
+# Partitions with their bounds, oldest first, the default partition last
+PARTITIONS_SQL = """
+SELECT c.relname AS name, pg_get_expr(c.relpartbound, c.oid) AS bounds,
+       c.reltuples::bigint AS estimated_rows, pg_total_relation_size(c.oid) AS bytes
+FROM pg_inherits i
+JOIN pg_class c ON c.oid = i.inhrelid
+WHERE i.inhparent = 'public.audit_logs'::regclass
+ORDER BY c.relname = 'audit_logs_default', c.relname;
+"""
+
+DEFAULT_ROWS_SQL = "SELECT COUNT(*) AS count FROM audit_logs_default;"
+
+class PartitionMaintainer:
+    def __init__(self, premake_months: int = PARTITION_PREMAKE_MONTHS, interval: float = PARTITION_CHECK_SECONDS):
+        self.premake_months = premake_months
+        self.interval = interval
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self.counters = {"created": 0, "runs": 0, "errors": 0}
+        self.last_run_at = None
+
+    def start(self):
+        if self._thread:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="partition-maintainer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+        self._thread = None
+
+    def run_once(self, conn: Connection) -> int:
+        """
+        Create the missing partitions from this month to premake_months ahead
+        :return: number of partitions created
+        """
+        with conn.transaction():
+            with conn.cursor() as curr:
+                curr.execute(CREATE_PARTITIONS_SQL, (self.premake_months,))
+                created = curr.fetchone()["created"]
+
+        with self._lock:
+            self.counters["created"] += created
+            self.counters["runs"] += 1
+            self.last_run_at = time.time()
+        return created
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                **self.counters,
+                "premake_months": self.premake_months,
+                "seconds_since_last_run": round(time.time() - self.last_run_at, 3) if self.last_run_at else None,
+                "running": self._thread is not None,
+            }
+
+    def partitions(self, curr: Cursor) -> dict:
+        curr.execute(PARTITIONS_SQL)
+        partitions: List[dict] = curr.fetchall()
+        # Rows here are read by every query the planner cannot prune it from
+        curr.execute(DEFAULT_ROWS_SQL)
+        return {"partitions": partitions, "default_rows": curr.fetchone()["count"]}
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                with pool.connection() as conn:
+                    self.run_once(conn)
+            except Exception as e:
+                print("Partition maintainer error:", e)
+                with self._lock:
+                    self.counters["errors"] += 1
+            self._stop.wait(self.interval)
+
+maintainer = PartitionMaintainer()
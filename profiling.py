@@ -0,0 +1,364 @@
+# profiling.py
+# Request-scoped profiling and the slow log.
+#
+# A profiled request (sampled with PROFILE_SAMPLE_RATE, or header X-Profile: 1 with the
+# operator credential of /metrics) records a span tree: auth, validation, the endpoint
+# with each SQL statement (parameter shape and row count, never the values),
+# serialization, SQS / OpenSearch calls. The open span lives in a ContextVar, so code
+# records spans without being handed the request, and outside a profiled request a
+# span costs one ContextVar lookup. The response carries a Server-Timing summary and
+# X-Profile-Id, the tree goes to the slow log.
+#
+# Requests over SLOW_REQUEST_MS and statements over SLOW_QUERY_MS are written to the
+# slow log as one JSON object per line, profiled or not, from a background thread.
+# With PROFILE_EXPLAIN=1 and a local database, slow SELECTs are run again under
+# EXPLAIN ANALYZE for their plan.
+import asyncio
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar, Token
+from datetime import datetime, timezone
+from functools import wraps
+from typing import Any, Callable, Dict, List, Mapping, Optional
+from uuid import uuid4
+
+from fastapi.routing import APIRoute
+from psycopg import sql
+
+from metrics import query_operation
+
+PROFILE_HEADER = os.getenv("PROFILE_HEADER", "x-profile").lower().encode()   # "1" profiles the request
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_MAX_SPANS = int(os.getenv("PROFILE_MAX_SPANS", "1000"))   # per request, e.g. a long export
+PROFILE_EXPLAIN = os.getenv("PROFILE_EXPLAIN", "0") == "1"
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "1000"))
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+SLOW_LOG_FILE = os.getenv("SLOW_LOG_FILE")   # JSON lines appended here, printed otherwise
+SLOW_LOG_SIZE = int(os.getenv("SLOW_LOG_SIZE", "200"))   # recent entries served on GET /metrics/slow
+
+SQL_TEXT_CHARS = 500
+LOCAL_HOSTS = ("localhost", "127.0.0.1", "::1")
+EXPLAIN_SQL = "EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) "
+# Statements ANALYZE must not run a second time: data-modifying CTEs (WITH ... INSERT),
+# notifications, sequence and setting changes, locks. String literals are left out first.
+EXPLAIN_UNSAFE = re.compile(r"\b(INSERT|UPDATE|DELETE|MERGE|pg_notify|nextval|setval|set_config|pg_advisory\w*)\b",
+                            re.IGNORECASE)
+SQL_LITERAL = re.compile(r"'(?:[^']|'')*'")
+# Wrapper spans left out of Server-Timing, their children are reported
+TIMING_SKIP = ("handler",)
+
+class Span:
+    __slots__ = ("profile", "name", "attrs", "start", "end", "children")
+
+    def __init__(self, profile: "Profile", name: str, attrs: dict, start: Optional[float] = None):
+        self.profile = profile
+        self.name = name
+        self.attrs = attrs
+        self.start = start if start is not None else time.perf_counter()
+        self.end: Optional[float] = None
+        self.children: List["Span"] = []
+
+    def add(self, name: str, attrs: dict, start: Optional[float] = None) -> Optional["Span"]:
+        # None once the profile holds PROFILE_MAX_SPANS spans
+        if not self.profile.reserve():
+            return None
+        child = Span(self.profile, name, attrs, start)
+        self.children.append(child)
+        return child
+
+    def finish(self, end: Optional[float] = None):
+        self.end = end if end is not None else time.perf_counter()
+
+    def to_dict(self, origin: float) -> dict:
+        end = self.end if self.end is not None else time.perf_counter()
+        entry = {"name": self.name, "start_ms": round((self.start - origin) * 1000, 3),
+                 "duration_ms": round((end - self.start) * 1000, 3)}
+        if self.attrs:
+            entry["attrs"] = self.attrs
+        if self.children:
+            entry["children"] = [child.to_dict(origin) for child in self.children]
+        return entry
+
+class Profile:
+    def __init__(self, name: str, max_spans: int = PROFILE_MAX_SPANS, **attrs):
+        self.id = uuid4().hex
+        self.max_spans = max_spans
+        self.spans = 0
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self.root = Span(self, name, attrs)
+
+    def reserve(self) -> bool:
+        with self._lock:
+            if self.spans >= self.max_spans:
+                self.dropped += 1
+                return False
+            self.spans += 1
+            return True
+
+    def activate(self) -> Token:
+        return _current.set(self.root)
+
+    def finish(self, token: Token):
+        self.root.finish()
+        _current.reset(token)
+
+    def totals(self) -> Dict[str, float]:
+        """
+        Seconds per span category (the name up to the first dot), finished spans only.
+        A span nested in one of its own category is not counted twice.
+        :return: {category: seconds}
+        """
+        totals: Dict[str, float] = {}
+
+        def walk(span: Span, categories: frozenset):
+            for child in span.children:
+                category = child.name.split(".", 1)[0]
+                if child.end is not None and category not in categories and category not in TIMING_SKIP:
+                    totals[category] = totals.get(category, 0.0) + child.end - child.start
+                walk(child, categories | {category})
+
+        walk(self.root, frozenset())
+        return totals
+
+    def server_timing(self) -> str:
+        # Server-Timing header, e.g. "auth;dur=0.2, sql;dur=12.5, total;dur=15.1" (milliseconds)
+        parts = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in self.totals().items()]
+        parts.append(f"total;dur={(time.perf_counter() - self.root.start) * 1000:.2f}")
+        return ", ".join(parts)
+
+    def to_dict(self) -> dict:
+        tree = self.root.to_dict(self.root.start)
+        if self.dropped:
+            tree["dropped_spans"] = self.dropped
+        return tree
+
+# The open span of the profiled request being served, None outside one
+_current: ContextVar[Optional[Span]] = ContextVar("profile_span", default=None)
+
+def wants_profile(headers: List[tuple], sample_rate: float = PROFILE_SAMPLE_RATE,
+                  is_operator: Callable[[List[tuple]], bool] = lambda headers: False) -> bool:
+    """
+    X-Profile: 1 is honored for the operator only, a profile costs the server and its
+    slow-log entry carries SQL text. Anyone can opt out of sampling with X-Profile: 0.
+    :return: True when the request is profiled
+    """
+    for name, value in headers:
+        if name == PROFILE_HEADER:
+            if value not in (b"1", b"true"):
+                return False
+            if is_operator(headers):
+                return True
+            break
+    return sample_rate > 0 and random.random() < sample_rate
+
+@contextmanager
+def span(name: str, **attrs):
+    """
+    Time the block as a child of the open span, when the request is profiled
+    :return: the span, or None
+    """
+    parent = _current.get()
+    child = parent.add(name, attrs) if parent is not None else None
+    if child is None:
+        yield None
+        return
+    token = _current.set(child)
+    try:
+        yield child
+    finally:
+        child.finish()
+        _current.reset(token)
+
+def add_span(name: str, start: float, end: Optional[float] = None, **attrs) -> Optional[Span]:
+    # A span timed by the caller, added finished
+    parent = _current.get()
+    child = parent.add(name, attrs, start) if parent is not None else None
+    if child is not None:
+        child.finish(end)
+    return child
+
+class SlowLog:
+    """
+    Slow requests, slow statements and request profiles, one JSON object per entry.
+    write() only queues the line, a listener thread prints it or appends it to the
+    file, so the event loop never waits on stdout or the disk.
+    """
+    def __init__(self, size: int = SLOW_LOG_SIZE, path: Optional[str] = SLOW_LOG_FILE):
+        self.path = path
+        self.entries: deque = deque(maxlen=size)
+        self._lock = threading.Lock()
+        self.counters = {"request": 0, "query": 0, "profile": 0}
+
+        handler = logging.FileHandler(path) if path else logging.StreamHandler(sys.stdout)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        lines: queue.SimpleQueue = queue.SimpleQueue()
+        self.logger = logging.getLogger(f"slow_log.{id(self)}")
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+        self.logger.addHandler(logging.handlers.QueueHandler(lines))
+        self.listener = logging.handlers.QueueListener(lines, handler)
+        self.listener.start()
+
+    def write(self, kind: str, entry: dict):
+        entry = {"type": kind, "at": datetime.now(timezone.utc).isoformat(), **entry}
+        with self._lock:
+            self.entries.append(entry)
+            self.counters[kind] += 1
+        self.logger.info(json.dumps(entry, default=str))
+
+    def close(self):
+        # Writes out what is queued
+        self.listener.stop()
+
+    def recent(self, kind: Optional[str] = None, profile_id: Optional[str] = None, limit: int = 50) -> List[dict]:
+        """
+        Latest entries first
+        :return: entries
+        """
+        with self._lock:
+            entries = list(self.entries)
+        entries = [entry for entry in reversed(entries)
+                   if (kind is None or entry["type"] == kind)
+                   and (profile_id is None or entry.get("profile_id") == profile_id)]
+        return entries[:limit]
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self.counters)
+        return {**counters, "slow_request_ms": SLOW_REQUEST_MS, "slow_query_ms": SLOW_QUERY_MS,
+                "sample_rate": PROFILE_SAMPLE_RATE, "explain": PROFILE_EXPLAIN}
+
+slow_log = SlowLog()
+
+def sql_text(query) -> str:
+    if isinstance(query, bytes):
+        query = query.decode(errors="replace")
+    elif not isinstance(query, str):
+        # psycopg.sql.Composed and friends
+        return f"<{type(query).__name__}>"
+    return " ".join(query.split())[:SQL_TEXT_CHARS]
+
+def _type_name(value: Any) -> str:
+    if isinstance(value, (list, tuple)):
+        return f"{type(value).__name__}[{len(value)}]"
+    return type(value).__name__
+
+def params_shape(params) -> Any:
+    """
+    Types of the statement parameters (lengths of the arrays), never their values
+    :return: {name: type} or [type, ...]
+    """
+    if params is None:
+        return None
+    if isinstance(params, Mapping):
+        return {str(key): _type_name(value) for key, value in params.items()}
+    return [_type_name(value) for value in params]
+
+def record_query(query, params, start: float, rows: int = -1, error: Optional[BaseException] = None) -> Optional[dict]:
+    """
+    Add the sql span of a profiled request, called by the cursor once a statement ran
+    :return: the slow log entry of a statement over SLOW_QUERY_MS (the cursor writes it), else None
+    """
+    end = time.perf_counter()
+    parent = _current.get()
+    slow = (end - start) * 1000 >= SLOW_QUERY_MS
+    if parent is None and not slow:
+        return None
+
+    attrs = {"sql": sql_text(query), "params": params_shape(params), "rows": rows}
+    if error is not None:
+        attrs["error"] = type(error).__name__
+    if parent is not None:
+        child = parent.add("sql", attrs, start)
+        if child is not None:
+            child.finish(end)
+    if not slow:
+        return None
+    return {"duration_ms": round((end - start) * 1000, 3), **attrs,
+            "profile_id": parent.profile.id if parent is not None else None}
+
+def explain_wanted(query, host: Optional[str]) -> bool:
+    # Read-only statements only, ANALYZE runs them again. host is None or a path for
+    # a Unix socket, both local.
+    if not PROFILE_EXPLAIN or query_operation(query) not in ("SELECT", "WITH"):
+        return False
+    if isinstance(query, bytes):
+        query = query.decode(errors="replace")
+    if EXPLAIN_UNSAFE.search(SQL_LITERAL.sub("''", query)):
+        return False
+    return not host or host.startswith("/") or host in LOCAL_HOSTS
+
+def explain_statement(query):
+    if isinstance(query, sql.Composable):
+        return sql.SQL(EXPLAIN_SQL) + query
+    if isinstance(query, bytes):
+        query = query.decode()
+    return EXPLAIN_SQL + query
+
+def profiled_endpoint(endpoint: Callable) -> Callable:
+    """
+    Wrap an endpoint in an "endpoint" span, the time since the last dependency is the
+    request validation. FastAPI reads the signature through functools.wraps.
+    :return: wrapped endpoint, async if the endpoint is
+    """
+    if asyncio.iscoroutinefunction(endpoint):
+        @wraps(endpoint)
+        async def wrapper(*args, **kwargs):
+            with _endpoint_span(endpoint.__name__):
+                return await endpoint(*args, **kwargs)
+    else:
+        @wraps(endpoint)
+        def wrapper(*args, **kwargs):
+            with _endpoint_span(endpoint.__name__):
+                return endpoint(*args, **kwargs)
+    return wrapper
+
+@contextmanager
+def _endpoint_span(name: str):
+    parent = _current.get()
+    if parent is not None:
+        # Query / path / body parsing and validation run after the dependencies (auth,
+        # connection checkout), right before the endpoint
+        previous = parent.children[-1].end if parent.children and parent.children[-1].end else parent.start
+        add_span("validation", previous)
+    with span("endpoint", function=name):
+        yield
+
+class ProfiledRoute(APIRoute):
+    """
+    Route recording the phases of a profiled request in a "handler" span: dependencies,
+    validation, the endpoint, then the serialization of what it returned
+    """
+    def __init__(self, path: str, endpoint: Callable, **kwargs):
+        super().__init__(path, profiled_endpoint(endpoint), **kwargs)
+
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+
+        async def profiled_handler(request):
+            if _current.get() is None:
+                return await handler(request)
+            with span("handler") as handler_span:
+                response = await handler(request)
+                children = handler_span.children if handler_span is not None else []
+                endpoint = next((child for child in reversed(children) if child.name == "endpoint"), None)
+                if endpoint is not None and endpoint.end is not None:
+                    add_span("serialize", endpoint.end)
+            return response
+
+        return profiled_handler
@@ -0,0 +1,212 @@
+# ratelimit.py
+# Per-tenant rate limiting. Requests are counted in token buckets keyed by the JWT's
+# tenant_id and a route class (ingest, export, read, write), rows ingested in a bucket
+# of their own. A request over its limit gets 429 with Retry-After.
+#
+# Buckets live in process by default, each worker then enforces the limits on its own
+# share of the traffic. Set RATE_LIMIT_URL (redis://...) to share them between
+# processes, this needs the optional redis package.
+import json
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Optional, Protocol
+
+from fastapi import HTTPException, status
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1") == "1"
+RATE_LIMITS = os.getenv("RATE_LIMITS")   # JSON {"default" | "<tenant_id>": {"<limit>": [rate, burst] | null}}
+RATE_LIMIT_URL = os.getenv("RATE_LIMIT_URL")
+RATE_LIMIT_MAX_BUCKETS = int(os.getenv("RATE_LIMIT_MAX_BUCKETS", "100000"))   # in-process store
+
+class Limit(NamedTuple):
+    rate: float    # tokens per second
+    burst: float   # bucket capacity
+
+# Requests per second per tenant and route class, and ingested rows per second
+DEFAULT_LIMITS = {
+    "ingest": Limit(20, 40),
+    "export": Limit(0.2, 2),
+    "read": Limit(50, 100),
+    "write": Limit(10, 20),
+    "rows": Limit(5000, 50000),
+}
+
+# (method, path) -> route class, other API routes are "read" (GET) or "write"
+ROUTE_CLASSES = {
+    ("POST", "/api/v1/logs"): "ingest",
+    ("POST", "/api/v1/logs/bulk"): "ingest",
+    ("POST", "/api/v1/logs/ingest"): "ingest",
+    ("GET", "/api/v1/logs/export"): "export",
+}
+API_PREFIX = "/api/"
+
+def route_class(method: str, path: str) -> Optional[str]:
+    """
+    Limit a request counts against, None for routes that are not limited
+    :return: route class
+    """
+    if not path.startswith(API_PREFIX):
+        return None
+    name = ROUTE_CLASSES.get((method, path.rstrip("/")))
+    if name:
+        return name
+    return "read" if method in ("GET", "HEAD") else "write"
+
+class BucketStore(Protocol):
+    """
+    Token buckets, take() refills a bucket and removes cost tokens when it has enough
+    """
+    def take(self, key: str, rate: float, burst: float, cost: float) -> float: ...
+    def clear(self): ...
+
+class LocalBucketStore:
+    def __init__(self, max_buckets: int = RATE_LIMIT_MAX_BUCKETS):
+        self.max_buckets = max_buckets
+        self._buckets: OrderedDict = OrderedDict()   # key -> [tokens, updated_at]
+        self._lock = threading.Lock()
+
+    def take(self, key: str, rate: float, burst: float, cost: float) -> float:
+        """
+        :return: 0 when allowed, else seconds until it would be
+        """
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [burst, now]
+                if len(self._buckets) > self.max_buckets:
+                    # The least recently used bucket starts over full
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+            tokens = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+            # A cost above the burst is let through on a full bucket and paid off afterwards
+            needed = min(cost, burst)
+            if tokens < needed:
+                bucket[0] = tokens
+                return (needed - tokens) / rate
+            bucket[0] = tokens - cost
+            return 0.0
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+# Same algorithm as LocalBucketStore.take, atomic in Redis and timed by the Redis clock
+TAKE_SCRIPT = """
+local rate, burst, cost = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+local tokens = tonumber(bucket[1]) or burst
+local updated_at = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + (now - updated_at) * rate)
+local needed = math.min(cost, burst)
+local wait = 0
+if tokens < needed then
+    wait = (needed - tokens) / rate
+else
+    tokens = tokens - cost
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated_at', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil((burst - tokens) / rate * 1000) + 1000)
+return tostring(wait)
+"""
+
+class RedisBucketStore:
+    def __init__(self, url: str):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.script = self.client.register_script(TAKE_SCRIPT)
+
+    def take(self, key: str, rate: float, burst: float, cost: float) -> float:
+        return float(self.script(keys=[f"ratelimit:{key}"], args=[rate, burst, cost]))
+
+    def clear(self):
+        pass
+
+def parse_limits(raw: Optional[str]) -> Dict[str, Dict[str, Optional[Limit]]]:
+    # {"default": {"rows": [10000, 100000]}, "<tenant_id>": {"export": null}}, null lifts a limit
+    if not raw:
+        return {}
+    return {scope: {name: Limit(*value) if value else None for name, value in limits.items()}
+            for scope, limits in json.loads(raw).items()}
+
+class RateLimiter:
+    def __init__(self, limits: Optional[Dict[str, Dict[str, Optional[Limit]]]] = None,
+                 store: Optional[BucketStore] = None, enabled: bool = RATE_LIMIT_ENABLED):
+        limits = limits or {}
+        self.enabled = enabled
+        self.defaults: Dict[str, Optional[Limit]] = {**DEFAULT_LIMITS, **limits.get("default", {})}
+        self.tenants = {scope: overrides for scope, overrides in limits.items() if scope != "default"}
+        self.store = store if store is not None else LocalBucketStore()
+        self.shared = not isinstance(self.store, LocalBucketStore)
+        self._lock = threading.Lock()
+        self.counters: Dict[str, int] = {"allowed": 0, "limited": 0}
+        self.limited: Dict[str, int] = {}
+
+    def limit(self, tenant_id: str, name: str) -> Optional[Limit]:
+        overrides = self.tenants.get(tenant_id)
+        if overrides and name in overrides:
+            return overrides[name]
+        return self.defaults.get(name)
+
+    def check(self, tenant_id: str, name: str, cost: float = 1) -> float:
+        """
+        Count cost against a tenant's limit
+        :return: 0 when allowed, else the seconds to wait
+        """
+        limit = self.limit(tenant_id, name)
+        if not self.enabled or limit is None:
+            return 0.0
+        wait = self.store.take(f"{tenant_id}:{name}", limit.rate, limit.burst, cost)
+        with self._lock:
+            if wait:
+                self.counters["limited"] += 1
+                self.limited[name] = self.limited.get(name, 0) + 1
+            else:
+                self.counters["allowed"] += 1
+        return wait
+
+    async def acheck(self, tenant_id: str, name: str, cost: float = 1) -> float:
+        # The shared store does network I/O, keep it off the event loop
+        if self.shared:
+            return await run_in_threadpool(self.check, tenant_id, name, cost)
+        return self.check(tenant_id, name, cost)
+
+    async def charge_rows(self, tenant_id, rows: int):
+        """
+        Count ingested rows against the tenant's row quota
+        :return: None, raises 429 when over it
+        """
+        wait = await self.acheck(str(tenant_id), "rows", rows)
+        if wait:
+            raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                                detail="Row quota exceeded", headers={"Retry-After": retry_after(wait)})
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self.counters)
+            limited = dict(self.limited)
+        return {**counters, "limited_by": limited, "enabled": self.enabled, "shared": self.shared,
+                "buckets": len(self.store) if not self.shared else None,
+                "defaults": {name: limit._asdict() if limit else None for name, limit in self.defaults.items()}}
+
+def retry_after(wait: float) -> str:
+    # Whole seconds, rounded up so the retry is allowed
+    return str(max(1, math.ceil(wait)))
+
+def rate_limited_response(wait: float) -> JSONResponse:
+    return JSONResponse({"detail": "Rate limit exceeded"}, status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                        headers={"Retry-After": retry_after(wait)})
+
+limiter = RateLimiter(parse_limits(RATE_LIMITS), store=RedisBucketStore(RATE_LIMIT_URL) if RATE_LIMIT_URL else None)
@@ -0,0 +1,296 @@
+# retention.py
+# Log retention. A tenant's policy keeps logs for N days, per severity or for all of
+# them; DELETE /logs/cleanup queues a job applying it (or an explicit rule), and the
+# worker queues one for every tenant with a policy each RETENTION_CHECK_SECONDS.
+#
+# A job deletes in batches of RETENTION_BATCH_SIZE, oldest first, each batch a short
+# transaction of its own, with a pause in between so locks, WAL and replication lag
+# stay bounded. Batches walk the (tenant_id, created_at, id) order with a keyset
+# position, never rescanning the dead rows of earlier batches, and the deleted rows
+# are never sent back. Progress is recorded with every batch in retention_jobs, so
+# any worker can report it. With RETENTION_MAX_DAYS set, the monthly partitions older
+# than that are dropped whole, for every tenant. Archived segments (see archive.py)
+# are deleted once every rule of the job covers all of their logs.
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+from uuid import UUID
+
+from psycopg import Connection, Cursor
+from psycopg.types.json import Jsonb
+
+from archive import archiver
+from cache import response_cache
+from db import pool
+
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "5000"))
+RETENTION_PAUSE_SECONDS = float(os.getenv("RETENTION_PAUSE_SECONDS", "0.1"))   # between batches
+RETENTION_POLL_SECONDS = float(os.getenv("RETENTION_POLL_SECONDS", "5"))   # idle wait for queued jobs
+RETENTION_CHECK_SECONDS = float(os.getenv("RETENTION_CHECK_SECONDS", "3600"))   # policy jobs, partition drops
+RETENTION_STALE_SECONDS = float(os.getenv("RETENTION_STALE_SECONDS", "300"))   # running job taken over
+RETENTION_MAX_DAYS = int(os.getenv("RETENTION_MAX_DAYS", "0")) or None   # drop partitions older than this
+RETENTION_LOCK_TIMEOUT = os.getenv("RETENTION_LOCK_TIMEOUT", "5s")   # partition drops give up, retried later
+
+JOB_FIELDS = "id, tenant_id, rules, source, status, deleted, batches, error, created_at, started_at, finished_at"
+
+ENQUEUE_SQL = f"""
+INSERT INTO retention_jobs (tenant_id, rules, source) VALUES (%s, %s, %s)
+ON CONFLICT (tenant_id) WHERE status IN ('queued', 'running') DO NOTHING
+RETURNING {JOB_FIELDS};
+"""
+
+# A job for every tenant with a policy, unless one is queued or running already
+SCHEDULE_SQL = """
+INSERT INTO retention_jobs (tenant_id, rules, source)
+SELECT tenant_id, rules, 'policy' FROM retention_policies
+ON CONFLICT (tenant_id) WHERE status IN ('queued', 'running') DO NOTHING;
+"""
+
+# Oldest queued job, or a running one whose worker stopped reporting progress
+CLAIM_SQL = f"""
+UPDATE retention_jobs SET status = 'running', started_at = coalesce(started_at, now()), updated_at = now()
+WHERE id = (
+    SELECT id FROM retention_jobs
+    WHERE status = 'queued' OR (status = 'running' AND updated_at < now() - make_interval(secs => %s))
+    ORDER BY created_at
+    LIMIT 1
+    FOR UPDATE SKIP LOCKED
+)
+RETURNING {JOB_FIELDS};
+"""
+
+PROGRESS_SQL = "UPDATE retention_jobs SET deleted = deleted + %s, batches = batches + 1, updated_at = now() WHERE id = %s;"
+
+FINISH_SQL = """
+UPDATE retention_jobs SET status = %s, error = %s, finished_at = now(), updated_at = now() WHERE id = %s;
+"""
+
+# A stopped worker hands its job back
+REQUEUE_SQL = "UPDATE retention_jobs SET status = 'queued', updated_at = now() WHERE id = %s;"
+
+JOB_SQL = f"SELECT {JOB_FIELDS} FROM retention_jobs WHERE tenant_id = %s AND id = %s;"
+JOBS_SQL = f"SELECT {JOB_FIELDS} FROM retention_jobs WHERE tenant_id = %s ORDER BY created_at DESC LIMIT %s;"
+POLICY_SQL = "SELECT rules, updated_at FROM retention_policies WHERE tenant_id = %s;"
+UPSERT_POLICY_SQL = """
+INSERT INTO retention_policies (tenant_id, rules) VALUES (%s, %s)
+ON CONFLICT (tenant_id) DO UPDATE SET rules = EXCLUDED.rules, updated_at = now()
+RETURNING rules, updated_at;
+"""
+DELETE_POLICY_SQL = "DELETE FROM retention_policies WHERE tenant_id = %s;"
+
+BACKLOG_SQL = "SELECT COUNT(*) FILTER (WHERE status = 'queued') AS queued, " \
+              "COUNT(*) FILTER (WHERE status = 'running') AS running FROM retention_jobs;"
+
+DROP_PARTITIONS_SQL = "SELECT public.drop_audit_log_partitions(now() - make_interval(days => %s)) AS dropped;"
+
+# Start of the keyset walk
+FIRST_POSITION = (datetime.min.replace(tzinfo=timezone.utc), UUID(int=0))
+
+def batch_sql(severity: Optional[str], excluded: List[str]) -> str:
+    """
+    Delete statement of one batch: the oldest rows past the cutoff after the keyset position.
+    Reports the rows selected and the position of the last one, not the rows.
+    A rule without a severity covers the severities without a rule of their own.
+    :return: sql
+    """
+    conditions = ["tenant_id = %(tenant_id)s", "created_at < %(cutoff)s",
+                  "created_at >= %(after_at)s", "(created_at, id) > (%(after_at)s, %(after_id)s)"]
+    if severity:
+        conditions.append("severity = %(severity)s")
+    elif excluded:
+        conditions.append("severity <> ALL(%(excluded)s)")
+    return f"""
+WITH batch AS (
+    SELECT id, created_at FROM audit_logs
+    WHERE {' AND '.join(conditions)}
+    ORDER BY created_at, id
+    LIMIT %(limit)s
+), deleted AS (
+    DELETE FROM audit_logs a USING batch b WHERE a.id = b.id AND a.created_at = b.created_at
+    RETURNING 1
+)
+SELECT (SELECT COUNT(*) FROM batch) AS selected, (SELECT COUNT(*) FROM deleted) AS deleted, last.created_at, last.id
+FROM (SELECT 1) AS one
+LEFT JOIN LATERAL (SELECT created_at, id FROM batch ORDER BY created_at DESC, id DESC LIMIT 1) AS last ON true;
+"""
+
+def enqueue_job(curr: Cursor, tenant_id, rules: List[dict], source: str = "request") -> Optional[dict]:
+    """
+    Queue a retention job for the tenant
+    :return: the job, None when the tenant has one queued or running already
+    """
+    curr.execute(ENQUEUE_SQL, (tenant_id, Jsonb(rules), source))
+    return curr.fetchone()
+
+class RetentionWorker:
+    def __init__(self, batch_size: int = RETENTION_BATCH_SIZE, pause: float = RETENTION_PAUSE_SECONDS,
+                 poll_interval: float = RETENTION_POLL_SECONDS, check_interval: float = RETENTION_CHECK_SECONDS,
+                 max_days: Optional[int] = RETENTION_MAX_DAYS):
+        self.batch_size = batch_size
+        self.pause = pause
+        self.poll_interval = poll_interval
+        self.check_interval = check_interval
+        self.max_days = max_days
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self.counters = {"jobs": 0, "failed": 0, "deleted": 0, "batches": 0, "scheduled": 0,
+                         "partitions_dropped": 0, "errors": 0}
+        self.last_check_at = None
+        self.current_job = None
+
+    def start(self):
+        if self._thread:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="retention-worker", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+        self._thread = None
+
+    def check(self, conn: Connection):
+        """
+        Queue the policy jobs and drop the partitions past RETENTION_MAX_DAYS
+        :return: None
+        """
+        with conn.transaction():
+            with conn.cursor() as curr:
+                curr.execute(SCHEDULE_SQL)
+                scheduled = curr.rowcount
+        dropped = 0
+        if self.max_days:
+            with conn.transaction():
+                with conn.cursor() as curr:
+                    # DETACH locks audit_logs: wait a little for running queries, not behind them
+                    curr.execute("SELECT set_config('lock_timeout', %s, true);", (RETENTION_LOCK_TIMEOUT,))
+                    curr.execute(DROP_PARTITIONS_SQL, (self.max_days,))
+                    dropped = curr.fetchone()["dropped"]
+            if archiver.enabled:
+                archiver.drop_segments(conn, datetime.now(timezone.utc) - timedelta(days=self.max_days))
+            if dropped:
+                # Cached stats count the dropped rows, for every tenant
+                response_cache.clear()
+
+        with self._lock:
+            self.counters["scheduled"] += scheduled
+            self.counters["partitions_dropped"] += dropped
+            self.last_check_at = time.time()
+
+    def run_once(self, conn: Connection) -> Optional[dict]:
+        """
+        Claim a job and run it to the end, the checks first when they are due
+        :return: the job run, None when none was queued
+        """
+        if self.last_check_at is None or time.time() - self.last_check_at >= self.check_interval:
+            self.check(conn)
+
+        with conn.transaction():
+            with conn.cursor() as curr:
+                curr.execute(CLAIM_SQL, (RETENTION_STALE_SECONDS,))
+                job = curr.fetchone()
+        if job is None:
+            return None
+
+        with self._lock:
+            self.current_job = job["id"]
+        try:
+            finished = self.run_job(conn, job)
+            status, error = ("done", None) if finished else ("queued", None)
+        except Exception as e:
+            status, error = "failed", str(e)
+            print("Retention job error:", e)
+        finally:
+            with self._lock:
+                self.current_job = None
+            response_cache.invalidate(str(job["tenant_id"]))
+
+        with conn.transaction():
+            with conn.cursor() as curr:
+                if status == "queued":
+                    curr.execute(REQUEUE_SQL, (job["id"],))
+                else:
+                    curr.execute(FINISH_SQL, (status, error, job["id"]))
+                curr.execute(JOB_SQL, (job["tenant_id"], job["id"]))
+                job = curr.fetchone()
+
+        with self._lock:
+            if status != "queued":
+                self.counters["jobs"] += 1
+            if status == "failed":
+                self.counters["failed"] += 1
+        return job
+
+    def run_job(self, conn: Connection, job: dict) -> bool:
+        """
+        Delete the rows of every rule in batches, cutoffs relative to the job's creation
+        :return: False when the worker was stopped before the end
+        """
+        rules = job["rules"]
+        own = [rule["severity"] for rule in rules if rule.get("severity")]
+        for rule in rules:
+            statement = batch_sql(rule.get("severity"), own)
+            params = {"tenant_id": job["tenant_id"], "severity": rule.get("severity"), "excluded": own,
+                      "cutoff": job["created_at"] - timedelta(days=rule["keep_days"]), "limit": self.batch_size}
+            after_at, after_id = FIRST_POSITION
+            while True:
+                with conn.transaction():
+                    with conn.cursor() as curr:
+                        curr.execute(statement, {**params, "after_at": after_at, "after_id": after_id})
+                        batch = curr.fetchone()
+                        curr.execute(PROGRESS_SQL, (batch["deleted"], job["id"]))
+
+                with self._lock:
+                    self.counters["deleted"] += batch["deleted"]
+                    self.counters["batches"] += 1
+                if batch["selected"] < self.batch_size:
+                    break
+                after_at, after_id = batch["created_at"], batch["id"]
+                if self._stop.wait(self.pause):
+                    return False
+
+        # Segments are immutable: they go once every rule lets all their logs go
+        if archiver.enabled and any(not rule.get("severity") for rule in rules):
+            before = min(job["created_at"] - timedelta(days=rule["keep_days"]) for rule in rules)
+            dropped = archiver.drop_segments(conn, before, job["tenant_id"])
+            with conn.transaction():
+                with conn.cursor() as curr:
+                    curr.execute(PROGRESS_SQL, (dropped, job["id"]))
+            with self._lock:
+                self.counters["deleted"] += dropped
+        return True
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                **self.counters,
+                "current_job": self.current_job,
+                "batch_size": self.batch_size,
+                "max_days": self.max_days,
+                "seconds_since_last_check": round(time.time() - self.last_check_at, 3) if self.last_check_at else None,
+                "running": self._thread is not None,
+            }
+
+    def backlog(self, curr: Cursor) -> dict:
+        curr.execute(BACKLOG_SQL)
+        return curr.fetchone()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                with pool.connection() as conn:
+                    job = self.run_once(conn)
+            except Exception as e:
+                print("Retention worker error:", e)
+                with self._lock:
+                    self.counters["errors"] += 1
+                job = None
+            if job is None:
+                self._stop.wait(self.poll_interval)
+
+retention = RetentionWorker()
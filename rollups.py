@@ -0,0 +1,152 @@
+# rollups.py
+# Precomputed log counts for GET /logs/stats. Inserts and deletes on audit_logs
+# append per-statement count deltas to audit_log_rollup_deltas (statement-level
+# triggers, see migration 0005), so ingest never contends on a shared counter row.
+# The compactor folds the deltas into audit_log_rollups, one row per
+# (tenant, hour, action_type, severity). Stats read both tables: a handful of
+# rows whatever the size of audit_logs.
+import os
+import threading
+import time
+from datetime import timedelta
+from typing import List
+
+from psycopg import Connection, Cursor
+
+from db import pool
+
+ROLLUP_BATCH_SIZE = int(os.getenv("ROLLUP_BATCH_SIZE", "10000"))
+ROLLUP_POLL_SECONDS = float(os.getenv("ROLLUP_POLL_SECONDS", "5"))
+STATS_BUCKET_SIZES = {"hour": timedelta(hours=1), "day": timedelta(days=1), "week": timedelta(weeks=1)}
+STATS_MAX_BUCKETS = int(os.getenv("STATS_MAX_BUCKETS", "2000"))   # series points per request
+
+# Fold one batch of deltas into the rollups, deltas are claimed with SKIP LOCKED
+# so several compactors can run side by side
+COMPACT_SQL = """
+WITH claimed AS (
+    DELETE FROM audit_log_rollup_deltas
+    WHERE id IN (
+        SELECT id FROM audit_log_rollup_deltas ORDER BY id LIMIT %s FOR UPDATE SKIP LOCKED
+    )
+    RETURNING tenant_id, bucket, action_type, severity, count
+), folded AS (
+    INSERT INTO audit_log_rollups AS r (tenant_id, bucket, action_type, severity, count)
+    SELECT tenant_id, bucket, action_type, severity, SUM(count)
+    FROM claimed
+    GROUP BY tenant_id, bucket, action_type, severity
+    ON CONFLICT (tenant_id, bucket, action_type, severity) DO UPDATE SET count = r.count + EXCLUDED.count
+)
+SELECT COUNT(*) AS deltas FROM claimed;
+"""
+
+BACKLOG_SQL = "SELECT COUNT(*) AS pending FROM audit_log_rollup_deltas;"
+
+# Hour buckets of a tenant overlapping [from, to), compacted or not yet
+ROLLUP_SOURCE_SQL = """
+    SELECT bucket, action_type, severity, count FROM audit_log_rollups
+    WHERE tenant_id = %(tenant_id)s
+      AND bucket >= date_trunc('hour', %(from)s::timestamptz, 'UTC') AND bucket < %(to)s::timestamptz
+    UNION ALL
+    SELECT bucket, action_type, severity, count FROM audit_log_rollup_deltas
+    WHERE tenant_id = %(tenant_id)s
+      AND bucket >= date_trunc('hour', %(from)s::timestamptz, 'UTC') AND bucket < %(to)s::timestamptz
+"""
+
+# Total, per action_type and per severity in one pass (action_type / severity are never NULL,
+# so NULL marks the grouping set a row belongs to)
+STATS_TOTALS_SQL = f"""
+SELECT action_type, severity, COALESCE(SUM(count), 0)::bigint AS count
+FROM ({ROLLUP_SOURCE_SQL}) AS r
+GROUP BY GROUPING SETS ((), (action_type), (severity))
+ORDER BY count DESC;
+"""
+
+STATS_SERIES_SQL = f"""
+SELECT date_trunc(%(bucket)s, bucket, 'UTC') AS bucket, SUM(count)::bigint AS count
+FROM ({ROLLUP_SOURCE_SQL}) AS r
+GROUP BY 1
+HAVING SUM(count) <> 0
+ORDER BY 1;
+"""
+
+def split_totals(rows: List[dict]) -> dict:
+    """
+    Split the STATS_TOTALS_SQL grouping sets
+    :return: total_logs, by_action, by_severity
+    """
+    total, by_action, by_severity = 0, [], []
+    for row in rows:
+        if row["action_type"] is not None:
+            if row["count"]:
+                by_action.append({"action_type": row["action_type"], "count": row["count"]})
+        elif row["severity"] is not None:
+            if row["count"]:
+                by_severity.append({"severity": row["severity"], "count": row["count"]})
+        else:
+            total = row["count"]
+    return {"total_logs": total, "by_action": by_action, "by_severity": by_severity}
+
+class RollupCompactor:
+    def __init__(self, batch_size: int = ROLLUP_BATCH_SIZE, poll_interval: float = ROLLUP_POLL_SECONDS):
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self.counters = {"compacted": 0, "runs": 0}
+        self.last_run_at = None
+
+    def start(self):
+        if self._thread:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="rollup-compactor", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+        self._thread = None
+
+    def run_once(self, conn: Connection) -> int:
+        """
+        Fold one batch of deltas into the rollups
+        :return: number of deltas folded
+        """
+        with conn.transaction():
+            with conn.cursor() as curr:
+                curr.execute(COMPACT_SQL, (self.batch_size,))
+                folded = curr.fetchone()["deltas"]
+
+        with self._lock:
+            self.counters["compacted"] += folded
+            self.counters["runs"] += 1
+            self.last_run_at = time.time()
+        return folded
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                **self.counters,
+                "seconds_since_last_run": round(time.time() - self.last_run_at, 3) if self.last_run_at else None,
+                "running": self._thread is not None,
+            }
+
+    def backlog(self, curr: Cursor) -> dict:
+        curr.execute(BACKLOG_SQL)
+        return {"pending_deltas": curr.fetchone()["pending"]}
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                with pool.connection() as conn:
+                    folded = self.run_once(conn)
+            except Exception as e:
+                print("Rollup compactor error:", e)
+                folded = 0
+            # Keep folding while batches come back full
+            if folded < self.batch_size:
+                self._stop.wait(self.poll_interval)
+
+compactor = RollupCompactor()
@@ -1,67 +1,77 @@
-from datetime import datetime, timedelta
-from typing import Union, List
+from datetime import datetime, timedelta, timezone
+from functools import partial
+from typing import AsyncIterator, Union, List
 from uuid import UUID
-import io, csv
+import zlib
 
-from fastapi import APIRouter, status, HTTPException, Response, Depends
-from fastapi.encoders import jsonable_encoder
-from psycopg.types.json import  Json
+from fastapi import APIRouter, status, HTTPException, Query, Request, Response, Depends
+from psycopg.types.json import Jsonb
+from starlette.concurrency import run_in_threadpool
 from starlette.responses import StreamingResponse
 from starlette.websockets import WebSocket, WebSocketDisconnect
 
-from db import curr, commit
-from auth import verify_jwt
-from utils import send_log_to_sqs, index_log_to_opensearch
+from archive import archiver, segments_query
+from cache import response_cache
+from cursors import encode_cursor, parse_cursor
+from db import get_db, get_async_db, async_db_cursor, commit, acommit, stream_copy
+from export import EXPORT_MEDIA_TYPES, iter_arrow, iter_csv, iter_ndjson
+from ingest import INSERT_LOG_SQL, IngestReport, bulk_insert_logs, iter_ndjson_logs, log_row
+from profiling import ProfiledRoute
+from ratelimit import limiter
+from retention import DELETE_POLICY_SQL, JOB_SQL, JOBS_SQL, POLICY_SQL, UPSERT_POLICY_SQL, enqueue_job
+from rollups import STATS_BUCKET_SIZES, STATS_MAX_BUCKETS, STATS_SERIES_SQL, STATS_TOTALS_SQL, split_totals
+from rows import fetch_log_rows
+from serialization import FastJSONResponse
+from streaming import manager, notify_new_logs, parse_filter, parse_since
+from auth import Claims, verify_jwt, websocket_claims
 import schemas
 
-router = APIRouter(prefix="/logs")
-
-# Set up connection manager for broadcasting
-class ConnectionManager:
-    def __init__(self):
-        self.active: dict[UUID, list[WebSocket]] = {}
-
-    async def connect(self, tenant_id: UUID, ws: WebSocket):
-        await ws.accept()
-        self.active.setdefault(tenant_id, []).append(ws)
-
-    def disconnect(self, tenant_id: UUID, ws: WebSocket):
-        conns = self.active.get(tenant_id, [])
-        if ws in conns:
-            conns.remove(ws)
-            if not conns:
-                del self.active[tenant_id]
-
-    async def broadcast(self, tenant_id: UUID, message: dict):
-        """
-        Send message to clients
-        :return: None
-        """
-        conns = self.active.get(tenant_id, [])
-        for ws in conns:
-            try:
-                await ws.send_json(message)
-            except Exception as e:
-                print(f"Exception: {e}")
-                pass
-
-manager = ConnectionManager()
+# Rows are returned as FastJSONResponse, encoded straight from the dict_row values
+router = APIRouter(prefix="/logs", route_class=ProfiledRoute, default_response_class=FastJSONResponse)
 
-# GET endpoints
-#  Return all or filtered logs
-@router.get("/", summary="Search audit logs (filtered, tenant scoped)")
-def search_log(
-        user_id: Union[UUID, None] = None,
-        session_id: Union[str, None] = None,
-        action_type: Union[str, None] = None,
-        resource_type: Union[str, None] = None,
-        severity: Union[str, None] = None,
-        q: Union[str, None] = None,
-        user = Depends(verify_jwt)
-    ):
+CLEANUP_JOBS_PATH = "/api/v1/logs/cleanup/jobs"
+EXPORT_GZIP_LEVEL = 5   # favour speed, CSV compresses well already at low levels
 
-    tenant_id = UUID(user["tenant_id"])
-    conditions = []
+# GET endpoints
+# Columns that can be requested with `fields=`
+LOG_FIELDS = ("id", "tenant_id", "user_id", "session_id", "ip_address", "user_agent",
+              "action_type", "resource_type", "resource_id", "severity",
+              "before_state", "after_state", "metadata", "created_at")
+SEARCH_DEFAULT_LIMIT = 100
+SEARCH_MAX_LIMIT = 1000
+
+# Search document of a log, must stay identical to the idx_audit_search expression in migrations.py
+SEARCH_VECTOR_SQL = ("(to_tsvector('simple'::regconfig, resource_id) || "
+                     "jsonb_to_tsvector('simple'::regconfig, coalesce(metadata, '{}'::jsonb), '[\"all\"]'::jsonb))")
+SEARCH_RANK_SQL = f"ts_rank({SEARCH_VECTOR_SQL}, query)"
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        return parse_cursor(cursor)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+def parse_fields(fields: Union[str, None]) -> List[str]:
+    if not fields:
+        return list(LOG_FIELDS)
+    selected = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in selected if field not in LOG_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Unknown fields: {', '.join(unknown)}")
+    return selected
+
+def build_search_query(tenant_id: UUID, columns: List[str], limit: int,
+                       user_id: Union[UUID, None] = None, session_id: Union[str, None] = None,
+                       action_type: Union[str, None] = None, severity: Union[str, None] = None,
+                       resource_type: Union[str, None] = None, q: Union[str, None] = None,
+                       from_: Union[datetime, None] = None, to: Union[datetime, None] = None,
+                       after: Union[tuple, None] = None) -> tuple:
+    """
+    SQL of one search page, fetching limit + 1 rows to tell whether there is a next page.
+    With q the rows are ranked by relevance and after is (created_at, id, rank).
+    :return: (sql, params)
+    """
+    conditions = ["tenant_id = %s"]
     params: list = [tenant_id]
 
     if user_id:
@@ -85,105 +95,263 @@ def search_log(
         params.append(resource_type)
 
     if q:
-        # Example fuzzy search in resource_id and metadata
-        conditions.append("(CAST(resource_id AS TEXT) ILIKE %s OR CAST(metadata AS TEXT) ILIKE %s)")
-        params.extend([f"%{q}%", f"%{q}%"])
-
-    base_sql = "SELECT * FROM audit_logs WHERE tenant_id = %s"
-    if conditions:
-        base_sql += " AND ".join(conditions)
-    base_sql += " ORDER BY created_at ASC;"
-    curr.execute(base_sql, params)
-    logs = curr.fetchall()
-    return {"data": logs}
+        # Full-text match on resource_id and metadata, served by idx_audit_search
+        conditions.append(f"{SEARCH_VECTOR_SQL} @@ query")
+
+    if from_:
+        conditions.append("created_at >= %s")
+        params.append(from_)
+
+    if to:
+        conditions.append("created_at < %s")
+        params.append(to)
+
+    if after and q:
+        # Keyset pagination in rank order: lower ranks, or the same rank further in (created_at, id)
+        conditions.append(f"({SEARCH_RANK_SQL} < %s OR ({SEARCH_RANK_SQL} = %s AND (created_at, id) > (%s, %s)))")
+        params.extend([after[2], after[2], after[0], after[1]])
+    elif after:
+        # Keyset pagination: continue right after the last row of the previous page. The
+        # plain created_at bound lets the planner skip the partitions before the cursor,
+        # it cannot prune on the row comparison.
+        conditions.append("created_at >= %s AND (created_at, id) > (%s, %s)")
+        params.extend([after[0], *after])
+
+    if q:
+        # The tsquery is parsed once and joined in, best matches first
+        sql = f"SELECT {', '.join(columns)}, {SEARCH_RANK_SQL} AS rank"
+        sql += " FROM audit_logs, websearch_to_tsquery('simple', %s) AS query WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY rank DESC, created_at ASC, id ASC LIMIT %s;"
+        params.insert(0, q)
+    else:
+        sql = f"SELECT {', '.join(columns)} FROM audit_logs WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY created_at ASC, id ASC LIMIT %s;"
+    params.append(limit + 1)
+    return sql, params
+
+def as_utc(value: Union[datetime, None]) -> Union[datetime, None]:
+    # Timestamps without an offset are taken as UTC
+    return value.replace(tzinfo=timezone.utc) if value and not value.tzinfo else value
+
+async def merge_archived(curr, logs: List[dict], tenant_id: UUID, columns: List[str], limit: int,
+                         from_: Union[datetime, None], to: Union[datetime, None],
+                         after: Union[tuple, None], equals: dict) -> List[dict]:
+    """
+    Merge the archived logs matching a search into its page of audit_logs rows (see archive.py)
+    :return: up to limit + 1 rows, in (created_at, id) order
+    """
+    from_, to = as_utc(from_), as_utc(to)
+    bounds = [value for value in (from_, after[0] if after else None) if value]
+    lower = max(bounds) if bounds else None
+    sql, params = segments_query(tenant_id, lower, to, equals.get("action_type"))
+    await curr.execute(sql, params)
+    segments = await curr.fetchall()
+    if not segments:
+        return logs
+
+    archived = await run_in_threadpool(archiver.search, segments, columns, limit, from_, to, after, equals)
+    return sorted(logs + archived, key=lambda log: (log["created_at"], log["id"]))[:limit + 1]
+
+#  Return all or filtered logs
+@router.get("/", summary="Search audit logs (filtered, tenant scoped, keyset paginated)")
+async def search_log(
+        request: Request,
+        user_id: Union[UUID, None] = None,
+        session_id: Union[str, None] = None,
+        action_type: Union[str, None] = None,
+        resource_type: Union[str, None] = None,
+        severity: Union[str, None] = None,
+        q: Union[str, None] = None,
+        from_: Union[datetime, None] = Query(None, alias="from"),
+        to: Union[datetime, None] = None,
+        limit: int = Query(SEARCH_DEFAULT_LIMIT, ge=1, le=SEARCH_MAX_LIMIT),
+        cursor: Union[str, None] = None,
+        fields: Union[str, None] = Query(None, description="Comma-separated columns to return"),
+        user: Claims = Depends(verify_jwt)
+    ):
+
+    tenant_id = user.tenant_id
+    cache_key = await response_cache.akey("search", str(tenant_id), request)
+    cached = await response_cache.aget(cache_key)
+    if cached:
+        return cached.response(request)
+
+    selected = parse_fields(fields)
+    # id and created_at are always read, the cursor is built from them
+    columns = list(dict.fromkeys(selected + ["created_at", "id"]))
+
+    after = decode_cursor(cursor) if cursor else None
+    if after and (len(after) == 3) != bool(q):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Cursor does not match the query")
+
+    base_sql, params = build_search_query(
+        tenant_id, columns, limit,
+        user_id=user_id, session_id=session_id, action_type=action_type, severity=severity,
+        resource_type=resource_type, q=q, from_=from_, to=to, after=after,
+    )
+    async with async_db_cursor() as curr:
+        # Compact rows: a page holds up to SEARCH_MAX_LIMIT logs until it is encoded
+        logs = await fetch_log_rows(curr, base_sql, params)
+        if archiver.enabled and not q:
+            # Relevance ranking is Postgres' own, q searches cover audit_logs only
+            equals = {"user_id": user_id, "session_id": session_id, "action_type": action_type,
+                      "severity": severity, "resource_type": resource_type}
+            logs = await merge_archived(curr, logs, tenant_id, columns, limit, from_, to, after,
+                                        {column: value for column, value in equals.items() if value})
+
+    next_cursor = None
+    if len(logs) > limit:
+        logs = logs[:limit]
+        next_cursor = encode_cursor(logs[-1]["created_at"], logs[-1]["id"], logs[-1]["rank"] if q else None)
+
+    if len(columns) != len(selected) or q:
+        logs = [{field: log[field] for field in selected} for log in logs]
+
+    entry = await response_cache.aset(cache_key, {"data": logs, "next_cursor": next_cursor})
+    return entry.response(request)
 
 # Return log statistics (tenant-scoped) **
 @router.get("/stats", summary="Get audit logs statistics (tenant-scoped)")
-def get_stats(user = Depends(verify_jwt)):
-    tenant_id = UUID(user["tenant_id"])
-    total_count_sql = "SELECT COUNT(*) as total from audit_logs WHERE tenant_id = %s;"
-    total_action_type_sql = """
-        SELECT action_type, COUNT(*) AS count
-        FROM audit_logs
-        WHERE tenant_id = %s
-        GROUP BY action_type
-        ORDER BY count DESC
+async def get_stats(
+        request: Request,
+        from_: Union[datetime, None] = Query(None, alias="from"),
+        to: Union[datetime, None] = None,
+        bucket: str = Query("day", pattern="^(hour|day|week)$"),
+        user: Claims = Depends(verify_jwt)
+    ):
+    tenant_id = user.tenant_id
+    cache_key = await response_cache.akey("stats", str(tenant_id), request)
+    cached = await response_cache.aget(cache_key)
+    if cached:
+        return cached.response(request)
+
+    # Counts come from the hourly rollups, so the window is widened to whole hours.
+    # Totals cover all history by default, the series the last 7 days.
+    # Timestamps without an offset are taken as UTC
+    from_, to = as_utc(from_), as_utc(to)
+    series_from = from_ or datetime.now(timezone.utc) - timedelta(days=7)
+    series_to = to or datetime.now(timezone.utc)
+    if series_to <= series_from:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="'to' must be after 'from'")
+    if (series_to - series_from) / STATS_BUCKET_SIZES[bucket] > STATS_MAX_BUCKETS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"Window spans more than {STATS_MAX_BUCKETS} {bucket} buckets")
+
+    window = {"tenant_id": tenant_id, "from": from_ or "-infinity", "to": to or "infinity"}
+    async with async_db_cursor() as curr:
+        await curr.execute(STATS_TOTALS_SQL, window)
+        totals = split_totals(await curr.fetchall())
+
+        await curr.execute(STATS_SERIES_SQL, {**window, "from": series_from, "bucket": bucket})
+        series = await curr.fetchall()
+
+    entry = await response_cache.aset(cache_key, {**totals, "bucket": bucket, "series": series})
+    return entry.response(request)
+
+async def gzip_chunks(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
     """
-    total_severity_count_sql = """
-        SELECT severity, COUNT(*) as count
-        FROM audit_logs
-        WHERE tenant_id = %s
-        GROUP BY severity
-        ORDER BY count DESC
+    Gzip a byte stream on the fly
+    :return: compressed chunks
     """
-    total_logs_for_last_week_sql = """
-        SELECT DATE_TRUNC('day', created_at) AS day,
-        COUNT(*) AS count
-        FROM audit_logs
-        WHERE created_at >= %s AND tenant_id = %s
-        GROUP BY day
-        ORDER BY day;
+    compressor = zlib.compressobj(EXPORT_GZIP_LEVEL, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    async for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def build_export_filter(tenant_id: UUID, from_: Union[datetime, None] = None,
+                        to: Union[datetime, None] = None) -> tuple:
     """
+    WHERE clause shared by every export format
+    :return: (where_sql, params)
+    """
+    conditions = ["tenant_id = %s"]
+    params: list = [tenant_id]
 
-    # 1. Total count
-    curr.execute(total_count_sql, (tenant_id,))
-    total = curr.fetchone()["total"]
-    # 2. Counts by action_type
-    curr.execute(total_action_type_sql, (tenant_id,))
-    by_action = curr.fetchall()
-    # 3. Counts by severity
-    curr.execute(total_severity_count_sql, (tenant_id,))
-    by_severity = curr.fetchall()
-    # 4. Logs per day for the last 7 days
-    seven_days_ago = datetime.utcnow() - timedelta(days=7)
-    curr.execute(total_logs_for_last_week_sql, (seven_days_ago,tenant_id,))
-    per_day = curr.fetchall()
+    if from_:
+        conditions.append("created_at >= %s")
+        params.append(from_)
 
-    return {
-        "total_logs": total,
-        "by_action": by_action,
-        "by_severity": by_severity,
-        "last_7_days": per_day
-    }
+    if to:
+        conditions.append("created_at < %s")
+        params.append(to)
+
+    return " AND ".join(conditions), params
 
 # Export logs (tenant-scoped) **
-@router.get("/export", summary="Export logs to CSV format file (tenant-scoped)")
-def export_log(user = Depends(verify_jwt)):
-    tenant_id = UUID(user["tenant_id"])
-    sql = "SELECT * FROM audit_logs WHERE tenant_id = %s ORDER BY created_at DESC;"
-
-    curr.execute(sql, (tenant_id,))
-    rows = curr.fetchall()
-
-    # Generate CSV stream chunks
-    def iter_csv():
-        buffer = io.StringIO()
-        writer = csv.writer(buffer)
-
-        # Write header
-        if rows:
-            writer.writerow(rows[0].keys())
-            yield buffer.getvalue()
-            buffer.seek(0)
-            buffer.truncate(0)
-        # Write each row
-        for row in rows:
-            writer.writerow(row.values())
-            yield buffer.getvalue()
-            buffer.seek(0)
-            buffer.truncate(0)
+@router.get("/export", summary="Export logs to CSV, NDJSON, Parquet or Arrow format file (tenant-scoped)")
+async def export_log(
+        request: Request,
+        format: str = Query("csv", pattern="^(csv|ndjson|parquet|arrow)$"),
+        from_: Union[datetime, None] = Query(None, alias="from"),
+        to: Union[datetime, None] = None,
+        user: Claims = Depends(verify_jwt),
+        curr = Depends(get_async_db)
+    ):
+    where_sql, params = build_export_filter(user.tenant_id, from_, to)
+
+    # Archived logs follow the others, they are older (see archive.py)
+    archived = None
+    if archiver.enabled:
+        sql, segment_params = segments_query(user.tenant_id, as_utc(from_), as_utc(to))
+        await curr.execute(sql, segment_params)
+        segments = await curr.fetchall()
+        if segments:
+            archived = archiver.iter_tables(segments, as_utc(from_), as_utc(to))
+
+    if format == "csv":
+        # Postgres renders the CSV and streams it out, rows are never materialised in the app
+        sql = f"SELECT * FROM audit_logs WHERE {where_sql} ORDER BY created_at DESC"
+        chunks = stream_copy(curr, f"COPY ({sql}) TO STDOUT WITH (FORMAT CSV, HEADER)", params)
+        if archived is not None:
+            chunks = iter_csv(chunks, archived)
+    elif format == "ndjson":
+        chunks = iter_ndjson(curr, where_sql, params, archived)
+    else:
+        # Parquet / Arrow are compressed column by column already
+        chunks = iter_arrow(curr, where_sql, params, format, archived=archived)
+
+    headers = {"Content-Disposition": f'attachment; filename="audit_logs.{format}"', "Vary": "Accept-Encoding"}
+    if format in ("csv", "ndjson") and "gzip" in request.headers.get("accept-encoding", ""):
+        chunks = gzip_chunks(chunks)
+        headers["Content-Encoding"] = "gzip"
 
     # return as StreamingResponse for downloading
     return StreamingResponse(
-        iter_csv(),
-        media_type="text/csv",
-        headers={}
+        chunks,
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers=headers
     )
 
+# Retention policy (tenant-scoped): days logs are kept, per severity
+@router.get("/retention", summary="Get the retention policy (tenant-scoped)")
+def get_retention_policy(user: Claims = Depends(verify_jwt), curr = Depends(get_db)):
+    curr.execute(POLICY_SQL, (user.tenant_id,))
+    return curr.fetchone() or {"rules": [], "updated_at": None}
+
+# Replace the retention policy (admin only), no rules removes it
+@router.put("/retention", summary="Set the retention policy (tenant-scoped, admin only)")
+def set_retention_policy(policy: schemas.RetentionPolicy, user: Claims = Depends(verify_jwt), curr = Depends(get_db)):
+    if user.role != "admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required")
+    severities = [rule.severity for rule in policy.rules]
+    if len(set(severities)) != len(severities):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="One rule per severity")
+
+    if policy.rules:
+        curr.execute(UPSERT_POLICY_SQL, (user.tenant_id, Jsonb(policy.model_dump()["rules"])))
+        saved = curr.fetchone()
+    else:
+        curr.execute(DELETE_POLICY_SQL, (user.tenant_id,))
+        saved = {"rules": [], "updated_at": None}
+    commit(curr)
+    return saved
+
 #  Return logs by id
 @router.get("/{id}", summary="Search log by id (tenant-scoped)")
-def search_log_id(id: UUID, user = Depends(verify_jwt)):
-    tenant_id = UUID(user["tenant_id"])
+def search_log_id(id: UUID, user: Claims = Depends(verify_jwt), curr = Depends(get_db)):
+    tenant_id = user.tenant_id
 
     sql = "SELECT * FROM audit_logs where id = %s AND tenant_id = %s;"
     param = [id, tenant_id]
@@ -195,126 +363,139 @@ def search_log_id(id: UUID, user = Depends(verify_jwt)):
         # trigger exception
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Log with id {id} does not exist")
 
-    return log
+    return FastJSONResponse(log)
 
 # POST endpoints
 # Create log entry (with tenant-ID)
 @router.post("/", status_code=status.HTTP_201_CREATED,
              response_model=schemas.Log, summary="Create new log entry (tenant-scoped)")
-def create_log(log: schemas.Log, token: dict = Depends(verify_jwt)):
-    tenant_id = token.get("tenant_id")
-    if tenant_id != str(log.tenant_id):
+async def create_log(log: schemas.Log, token: Claims = Depends(verify_jwt), curr = Depends(get_async_db)):
+    tenant_id = token.tenant_id
+    if tenant_id != log.tenant_id:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Tenant ID mismatch")
+    await limiter.charge_rows(tenant_id, 1)
 
-    sql = """
-    INSERT INTO audit_logs 
-    (tenant_id, user_id, session_id, ip_address, user_agent,
-     action_type, resource_type, resource_id, severity,
-     before_state, after_state, metadata)
-    VALUES
-    (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-    RETURNING *;
-    """
+    await curr.execute(INSERT_LOG_SQL, log_row(log))
+    new_log = await curr.fetchone()
+    await notify_new_logs(curr, [(new_log["tenant_id"], new_log["id"])])
 
-    params = (
-        log.tenant_id, log.user_id, log.session_id, log.ip_address, log.user_agent,
-        log.action_type, log.resource_type, log.resource_id, log.severity,
-        Json(log.before_state) if log.before_state is not None else None,
-        Json(log.after_state) if log.after_state is not None else None,
-        Json(log.metadata) if log.metadata is not None else None,
-    )
-
-    curr.execute(sql, params)
-    new_log = curr.fetchone()
-
-    # Commit the insert statement
-    commit()
-
-    # Send to SQS
-    send_log_to_sqs(jsonable_encoder({
-        **log.model_dump(),
-        "tenant_id": str(tenant_id)
-    }))
+    # Commit the log and its outbox row, the outbox relay publishes to SQS and OpenSearch
+    await acommit(curr)
+    await response_cache.ainvalidate(str(tenant_id))
 
-    # Call OpenSearch
-    index_log_to_opensearch(log=log.model_dump(), index="audit-logs")
-
-    return jsonable_encoder(new_log)
+    return FastJSONResponse(new_log, status_code=status.HTTP_201_CREATED)
 
 # Create entries in bulk (with tenant ID)
 @router.post("/bulk", status_code=status.HTTP_201_CREATED, summary="Create log entries in bulk (tenant-scoped)")
-def create_bulk(logs: List[schemas.Log], token: dict = Depends(verify_jwt)):
+async def create_bulk(logs: List[schemas.Log], commit_every_chunk: bool = False,
+                      token: Claims = Depends(verify_jwt), curr = Depends(get_async_db)):
     if not logs:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Request body is empty")
 
-    # verify tenant_id
-    tenant_id = token.get("tenant_id")
-    if tenant_id != str(logs[0].tenant_id):
+    # verify tenant_id, of every log: the batch is copied as is
+    tenant_id = token.tenant_id
+    if any(log.tenant_id != tenant_id for log in logs):
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Tenant ID mismatch")
+    # The whole batch is charged up front, it is inserted all or nothing
+    await limiter.charge_rows(tenant_id, len(logs))
+
+    # COPY (or unnest) in chunks, each chunk also writes its outbox rows
+    inserted = await bulk_insert_logs(curr, logs, commit_every_chunk=commit_every_chunk)
+    # Commit the logs and their outbox rows, the outbox relay publishes to SQS and OpenSearch
+    await acommit(curr)
+    await response_cache.ainvalidate(str(tenant_id))
+
+    return {"Data inserted": inserted}
+
+NDJSON_MEDIA_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+
+# Stream NDJSON entries (with tenant ID)
+@router.post("/ingest", status_code=status.HTTP_201_CREATED, summary="Stream log entries as NDJSON (tenant-scoped)")
+async def ingest_logs(request: Request, commit_every_chunk: bool = False,
+                      token: Claims = Depends(verify_jwt), curr = Depends(get_async_db)):
+    media_type = request.headers.get("content-type", "").split(";")[0].strip()
+    if media_type not in NDJSON_MEDIA_TYPES:
+        raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                            detail="Content-Type must be application/x-ndjson")
+    encoding = request.headers.get("content-encoding", "identity").lower()
+    if encoding not in ("identity", "gzip"):
+        raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                            detail="Content-Encoding must be gzip or identity")
+
+    # The body is read, validated and inserted chunk by chunk, never held in memory as a whole
+    report = IngestReport()
+    logs = iter_ndjson_logs(request.stream(), tenant_id=str(token.tenant_id), report=report,
+                            gzipped=encoding == "gzip")
+    # The row quota is charged chunk by chunk as the stream is read
+    inserted = await bulk_insert_logs(curr, logs, commit_every_chunk=commit_every_chunk,
+                                      before_chunk=partial(limiter.charge_rows, token.tenant_id))
+    await acommit(curr)
+    await response_cache.ainvalidate(str(token.tenant_id))
 
-    sql = """
-    INSERT INTO audit_logs 
-    (tenant_id, user_id, session_id, ip_address, user_agent,
-     action_type, resource_type, resource_id, severity,
-     before_state, after_state, metadata)
-    VALUES
-    (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-    RETURNING *;
-    """
-    params = []
-    for log in logs:
-        params.append((
-            log.tenant_id, log.user_id, log.session_id, log.ip_address, log.user_agent,
-            log.action_type, log.resource_type, log.resource_id, log.severity,
-            Json(log.before_state) if log.before_state is not None else None,
-            Json(log.after_state)  if log.after_state  is not None else None,
-            Json(log.metadata)     if log.metadata     is not None else None,
-        ))
-
-    # Execute many
-    curr.executemany(sql, params)
-    commit()
-
-    for log in logs:
-        # send to SQS
-        send_log_to_sqs(jsonable_encoder({
-            **log.model_dump(),
-            "tenant_id": str(log.tenant_id)
-        }))
-        # call OpenSearch
-        index_log_to_opensearch(log=log.model_dump(), index="audit-logs")
-
-    return {"Data inserted": len(params)}
+    return {
+        "Data inserted": inserted,
+        "lines": report.lines,
+        "rejected": report.rejected,
+        "errors": report.errors,
+    }
 
 # DELETE
-# delete old logs (tenant-scoped) - WIP
-@router.delete("/cleanup", status_code=status.HTTP_204_NO_CONTENT, summary="Delete log entry (tenant-scoped)")
-def delete_logs(token: dict = Depends(verify_jwt)):
-    tenant_id = token.get("tenant_id")
-
-    sql = "DELETE FROM audit_logs WHERE tenant_id = %s RETURNING *;"
-    param = (tenant_id,)
-
-    curr.execute(sql, param)
+# Queue a cleanup job (tenant-scoped): 202 with the job and its Location, 409 while one is pending;
+# the retention worker deletes the rows in batches
+@router.delete("/cleanup", status_code=status.HTTP_202_ACCEPTED, summary="Queue a log cleanup job (tenant-scoped)")
+def delete_logs(response: Response,
+                keep_days: Union[int, None] = Query(None, ge=0),
+                severity: Union[str, None] = Query(None, pattern="^(INFO|WARNING|ERROR|CRITICAL)$"),
+                token: Claims = Depends(verify_jwt), curr = Depends(get_db)):
+    tenant_id = token.tenant_id
+
+    # Without parameters the tenant's retention policy is applied, or every log is deleted
+    # when it has none. Rows are deleted in batches by the retention worker.
+    rules = [{"severity": severity, "keep_days": keep_days or 0}]
+    if keep_days is None and severity is None:
+        curr.execute(POLICY_SQL, (tenant_id,))
+        policy = curr.fetchone()
+        if policy:
+            rules = policy["rules"]
+
+    job = enqueue_job(curr, tenant_id, rules)
     # Commit sql statement
-    commit()
-
-    return Response(status_code=status.HTTP_204_NO_CONTENT)
+    commit(curr)
+
+    if not job:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="A cleanup job is already queued or running")
+    response.headers["Location"] = f"{CLEANUP_JOBS_PATH}/{job['id']}"
+    return job
+
+# Cleanup jobs, latest first: status, rows deleted so far
+@router.get("/cleanup/jobs", summary="List log cleanup jobs (tenant-scoped)")
+def list_cleanup_jobs(limit: int = Query(20, ge=1, le=100), user: Claims = Depends(verify_jwt), curr = Depends(get_db)):
+    curr.execute(JOBS_SQL, (user.tenant_id, limit))
+    return FastJSONResponse({"data": curr.fetchall()})
+
+@router.get("/cleanup/jobs/{job_id}", summary="Get a log cleanup job (tenant-scoped)")
+def get_cleanup_job(job_id: UUID, user: Claims = Depends(verify_jwt), curr = Depends(get_db)):
+    curr.execute(JOB_SQL, (user.tenant_id, job_id))
+    job = curr.fetchone()
+    if not job:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Cleanup job {job_id} does not exist")
+    return job
 
 # Delete logs by id
 @router.delete("/cleanup/{id}", status_code=status.HTTP_204_NO_CONTENT, summary="Delete log entry by id (tenant-scoped)")
-def delete_log(id: UUID, token: dict = Depends(verify_jwt)):
-    tenant_id = token.get("tenant_id")
-    sql = "DELETE FROM audit_logs WHERE tenant_id = %s AND id = %s RETURNING *;"
+def delete_log(id: UUID, token: Claims = Depends(verify_jwt), curr = Depends(get_db)):
+    tenant_id = token.tenant_id
+    sql = "DELETE FROM audit_logs WHERE tenant_id = %s AND id = %s RETURNING id;"
     param = [tenant_id, id]
 
     curr.execute(sql, param)
     deleted_log = curr.fetchone()
 
     # Commit sql statement
-    commit()
+    commit(curr)
 
     if deleted_log:
+        response_cache.invalidate(str(tenant_id))
         return Response(status_code=status.HTTP_204_NO_CONTENT)
     else:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Log with id {id} does not exist")
@@ -322,22 +503,43 @@ def delete_log(id: UUID, token: dict = Depends(verify_jwt)):
 # WEBSOCKET
 # real-time log streaming **
 @router.websocket("/stream", name="Real time log streaming")
-async def log_stream(websocket: WebSocket, tenant_id: UUID):
-    # Establish connection
-    await manager.connect(tenant_id, websocket)
+async def log_stream(websocket: WebSocket, tenant_id: Union[UUID, None] = None, token: Union[str, None] = None,
+                     severity: Union[str, None] = None, action_type: Union[str, None] = None,
+                     since: Union[str, None] = None):
+    # The tenant is the token's, a tenant_id parameter must match it
+    claims = websocket_claims(websocket, token)
+    if claims is None:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Invalid JWT token")
+        return
+    if tenant_id is not None and tenant_id != claims.tenant_id:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Tenant ID mismatch")
+        return
+
+    # Resume after the cursor of the last event received
+    try:
+        position = parse_since(since) if since else None
+    except ValueError:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Invalid cursor")
+        return
+
+    # Establish connection, optionally filtered (comma-separated severities / action types)
+    subscriber = await manager.connect(claims.tenant_id, websocket, severities=parse_filter(severity),
+                                       action_types=parse_filter(action_type), since=position)
 
     try:
-        # Keep connection alive until client disconnects
+        # Keep connection alive until client disconnects, messages are sent by the subscriber's writer task
         while True:
             await websocket.receive_text()
     except WebSocketDisconnect:
-        manager.disconnect(tenant_id, websocket)
+        pass
+    finally:
+        manager.disconnect(subscriber)
 
 @router.post("/mock-broadcast")
-async def mock_broadcast(tenant_id: UUID, msg: str):
+async def mock_broadcast(msg: str, token: Claims = Depends(verify_jwt)):
     """
-    To test websocket broadcast test by creating a mock endpoint
+    To test websocket broadcast test by creating a mock endpoint, sent to the caller's tenant
     :return: None
     """
-    await manager.broadcast(tenant_id, message={"message": str})
+    await manager.broadcast(token.tenant_id, message={"message": msg})
     return {"status": "sent"}
@@ -1,24 +1,33 @@
 from http.client import HTTPException
 from typing import Union
-from fastapi import APIRouter, status as http_status, Depends, HTTPException
+from fastapi import APIRouter, status as http_status, Depends, HTTPException, Request
 
-from auth import verify_jwt
-from db import curr, commit
+from auth import Claims, verify_jwt
+from cache import response_cache
+from db import get_db, db_cursor, commit
+from profiling import ProfiledRoute
 import schemas
 from utils import send_log_to_sqs, index_log_to_opensearch
 
-router = APIRouter(prefix="/tenants")
+router = APIRouter(prefix="/tenants", route_class=ProfiledRoute)
 
 # GET
 # List accessible tenant (admin only)
 @router.get("/", summary="List tenants (admin only)")
-def search_tenant(name: Union[str, None] = None,
+def search_tenant(request: Request,
+                  name: Union[str, None] = None,
                   status: Union[str, None] = None,
-                  user=Depends(verify_jwt)
+                  user: Claims = Depends(verify_jwt)
                   ):
-    if user["role"] != "admin":
+    if user.role != "admin":
         raise HTTPException(status_code=http_status.HTTP_403_FORBIDDEN, detail="Admin access required")
 
+    # The tenant list is not tenant-scoped, it has a cache scope of its own
+    cache_key = response_cache.key("tenants", "tenants", request)
+    cached = response_cache.get(cache_key)
+    if cached:
+        return cached.response(request)
+
     conditions = []
     params = []
 
@@ -36,16 +45,17 @@ def search_tenant(name: Union[str, None] = None,
         base_sql += " WHERE " + " AND ".join(conditions)
     base_sql += " ORDER BY created_at DESC;"
 
-    curr.execute(base_sql, params)
-    tenants = curr.fetchall()
+    with db_cursor() as curr:
+        curr.execute(base_sql, params)
+        tenants = curr.fetchall()
 
-    return {"data": tenants}
+    return response_cache.set(cache_key, {"data": tenants}).response(request)
 
 # POST
 # Create new tenant (admin only)
 @router.post("/", status_code=http_status.HTTP_201_CREATED, response_model=schemas.Tenant, summary="Create a new tenant (admin only)")
-def create_tenant(tenant: schemas.Tenant, user=Depends(verify_jwt)):
-    if user["role"] != "admin":
+def create_tenant(tenant: schemas.Tenant, user: Claims = Depends(verify_jwt), curr=Depends(get_db)):
+    if user.role != "admin":
         raise HTTPException(status_code=http_status.HTTP_403_FORBIDDEN, detail="Admin access required")
 
     sql = """
@@ -60,12 +70,13 @@ def create_tenant(tenant: schemas.Tenant, user=Depends(verify_jwt)):
     new_tenant = curr.fetchone()
 
     # Commit statement
-    commit()
+    commit(curr)
+    response_cache.invalidate("tenants")
 
     # Send to SQS
     send_log_to_sqs({
         **tenant.model_dump(),
-        "tenant_id": str(user["tenant_id"])
+        "tenant_id": str(user.tenant_id)
     })
 
     index_log_to_opensearch(log=tenant.model_dump(), index="tenants")
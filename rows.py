@@ -0,0 +1,106 @@
+# rows.py
+# Compact rows for large results. dict_row builds one dict per log, repeating the 14
+# column names, and psycopg decodes every JSONB blob into nested dicts as it loads the
+# row. A LogRow holds only the tuple of values and a layout shared by every row of the
+# result (column names and positions). JSONB columns are kept as the text Postgres
+# sent and decoded when the field is read or the row is serialized.
+#
+# LogRow is a read-only Mapping, so code written for dict rows (row["id"], row.get(),
+# dict(row)) works unchanged.
+from collections.abc import Mapping
+from typing import Any, Dict, FrozenSet, List, NamedTuple, Tuple
+
+from psycopg.adapt import Loader
+from psycopg.rows import no_result
+from starlette.concurrency import run_in_threadpool
+
+from db import ThreadedCursor
+from serialization import loads
+
+JSON_TYPES = ("json", "jsonb")
+
+class RawJsonLoader(Loader):
+    # JSON / JSONB left as the text Postgres sent
+    def load(self, data) -> bytes:
+        return bytes(data)
+
+class RowLayout(NamedTuple):
+    names: Tuple[str, ...]
+    positions: Dict[str, int]
+    lazy: FrozenSet[int]   # positions of the JSON columns, decoded on access
+
+class LogRow(Mapping):
+    __slots__ = ("_layout", "_values")
+
+    def __init__(self, layout: RowLayout, values: Tuple[Any, ...]):
+        self._layout = layout
+        self._values = values
+
+    def _value(self, position: int) -> Any:
+        value = self._values[position]
+        if position in self._layout.lazy and value is not None:
+            # Not cached: the row stays as small as it was loaded
+            return loads(value)
+        return value
+
+    def __getitem__(self, name: str) -> Any:
+        return self._value(self._layout.positions[name])
+
+    def __iter__(self):
+        return iter(self._layout.names)
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def __contains__(self, name) -> bool:
+        return name in self._layout.positions
+
+    def items(self):
+        # Pairs in column order, what dict(row) and the serializer read
+        values = self._values
+        if self._layout.lazy:
+            values = list(values)
+            for position in self._layout.lazy:
+                if values[position] is not None:
+                    values[position] = loads(values[position])
+        return zip(self._layout.names, values)
+
+    def __repr__(self) -> str:
+        return f"LogRow({dict(self.items())!r})"
+
+def compact_row(cursor):
+    """
+    psycopg row factory: LogRow objects sharing one layout per result
+    :return: row maker
+    """
+    description = cursor.description
+    if description is None:
+        return no_result
+    names = tuple(column.name for column in description)
+    json_oids = {cursor.adapters.types[name].oid for name in JSON_TYPES}
+    layout = RowLayout(names, {name: position for position, name in enumerate(names)},
+                       frozenset(position for position, column in enumerate(description)
+                                 if column.type_code in json_oids))
+    return lambda values: LogRow(layout, values)
+
+def _compact(curr):
+    curr.row_factory = compact_row
+    for name in JSON_TYPES:
+        curr.adapters.register_loader(name, RawJsonLoader)
+    return curr
+
+async def fetch_log_rows(curr, query: str, params=None) -> List[LogRow]:
+    """
+    Run a query on a new cursor of curr's connection and fetch the result as LogRow objects
+    :return: rows
+    """
+    if isinstance(curr, ThreadedCursor):
+        def fetch():
+            with _compact(curr.connection.cursor()) as compact:
+                compact.execute(query, params)
+                return compact.fetchall()
+        return await run_in_threadpool(fetch)
+
+    async with _compact(curr.connection.cursor()) as compact:
+        await compact.execute(query, params)
+        return await compact.fetchall()
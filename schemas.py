@@ -1,6 +1,6 @@
 from datetime import datetime
-from pydantic import BaseModel, EmailStr
-from typing import Union, Dict, Any, Optional
+from pydantic import BaseModel, EmailStr, Field
+from typing import Union, Dict, Any, List, Literal, Optional
 from uuid import UUID
 
 # Declare class using Python types
@@ -11,10 +11,11 @@ class Log(BaseModel):
     session_id: str
     ip_address: str
     user_agent: str
-    action_type: str
+    # Same values as the chk_action_type / chk_severity constraints of audit_logs
+    action_type: Literal["CREATE", "UPDATE", "DELETE", "VIEW"]
     resource_type: str
     resource_id: str
-    severity: str
+    severity: Literal["INFO", "WARNING", "ERROR", "CRITICAL"]
     before_state: Optional[Dict[str, Any]] = None
     after_state: Optional[Dict[str, Any]] = None
     metadata: Optional[Dict[str, Any]] = None
@@ -24,4 +25,12 @@ class Tenant(BaseModel):
     id: Union[UUID, None] = None
     name: str
     status: str
-    created_at: Optional[datetime] = None
\ No newline at end of file
+    created_at: Optional[datetime] = None
+
+class RetentionRule(BaseModel):
+    # No severity: the severities without a rule of their own
+    severity: Optional[Literal["INFO", "WARNING", "ERROR", "CRITICAL"]] = None
+    keep_days: int = Field(ge=1)
+
+class RetentionPolicy(BaseModel):
+    rules: List[RetentionRule]
@@ -0,0 +1,76 @@
+# serialization.py
+# JSON encoding of API responses, stream events and queue messages. Rows come from
+# psycopg's dict_row with UUID, datetime, inet (ipaddress) and decoded JSONB values.
+# They are encoded straight to bytes, without the jsonable_encoder pass that rebuilds
+# every dict (and every nested JSONB blob) in Python before json.dumps walks it again.
+#
+# orjson encodes UUID and datetime natively, default() covers the other column types.
+# Without the optional orjson package the standard json module is used, same output.
+import json
+from collections.abc import Mapping
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from enum import Enum
+from ipaddress import IPv4Address, IPv4Interface, IPv4Network, IPv6Address, IPv6Interface, IPv6Network
+from typing import Any
+from uuid import UUID
+
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+IP_TYPES = (IPv4Address, IPv6Address, IPv4Interface, IPv6Interface, IPv4Network, IPv6Network)
+
+def default(value: Any) -> Any:
+    """
+    JSON form of the values the encoder has no native support for, as jsonable_encoder renders them
+    :return: encodable value
+    """
+    if isinstance(value, IP_TYPES):
+        return str(value)
+    if isinstance(value, Mapping):
+        # Compact rows (see rows.py), their JSONB columns are decoded here
+        return dict(value.items())
+    if isinstance(value, Decimal):
+        return int(value) if value.as_tuple().exponent >= 0 else float(value)
+    if isinstance(value, BaseModel):
+        return value.model_dump(mode="json")
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    if isinstance(value, timedelta):
+        return value.total_seconds()
+    # Native to orjson, needed by the json fallback
+    if isinstance(value, UUID):
+        return str(value)
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    if isinstance(value, Enum):
+        return value.value
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def dumps(value: Any) -> bytes:
+    """
+    Compact UTF-8 JSON, as JSONResponse renders it
+    :return: encoded bytes
+    """
+    if orjson is not None:
+        return orjson.dumps(value, default=default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(value, default=default, ensure_ascii=False, allow_nan=False,
+                      separators=(",", ":")).encode()
+
+def loads(data) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSONResponse encoded with dumps(). Returned directly by an endpoint, its content
+    also skips FastAPI's jsonable_encoder pass.
+    """
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -0,0 +1,486 @@
+# streaming.py
+# Real-time fan-out of new logs to the /logs/stream WebSocket subscribers.
+#
+# Every insert path queues a Postgres NOTIFY with the new log ids in the same
+# transaction (notify_new_logs), so notifications are sent on commit only.
+# Each worker process LISTENs on the channel, reads the logs of tenants it has
+# subscribers for and hands every event, serialised once, to the subscribers.
+# A subscriber has its own bounded queue drained by its own writer task: a slow
+# client never holds up the others, it is dropped from (or loses messages) instead.
+#
+# Log events carry a cursor, a client reconnecting with ?since=<cursor> is first
+# sent what it missed: from the per-tenant ring buffer of recent events when the
+# cursor is still in it (exact, in commit order), otherwise with a keyset query on
+# audit_logs in (created_at, id) order. The subscriber is registered before the
+# backfill starts, so live events queue up meanwhile and none fall in between.
+#
+# While a subscriber catches up (replay or backfill) its live events queue up
+# without limit, the slow consumer policy applies once it has sent them.
+#
+# created_at is the start time of the inserting transaction, not its commit time:
+# a log committed late by a long transaction can sort before a cursor the client
+# already has, and the keyset backfill misses it. Opt-in, STREAM_BACKFILL_WINDOW
+# re-scans that many seconds behind the cursor to pick those up, at the cost of
+# sending the logs of that window again.
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Deque, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+from uuid import UUID
+
+import psycopg
+from starlette.websockets import WebSocket
+
+from cursors import encode_cursor, parse_cursor
+from db import CONNINFO, async_db_cursor
+from serialization import dumps
+
+STREAM_CHANNEL = "audit_log_stream"
+STREAM_NOTIFY = os.getenv("STREAM_NOTIFY", "1") == "1"
+STREAM_QUEUE_SIZE = int(os.getenv("STREAM_QUEUE_SIZE", "1000"))          # messages buffered per subscriber
+STREAM_SLOW_POLICY = os.getenv("STREAM_SLOW_POLICY", "disconnect")       # disconnect | drop (oldest)
+STREAM_NOTIFY_IDS = 150   # ids per notification, a NOTIFY payload must stay under 8000 bytes
+STREAM_REPLAY_SIZE = int(os.getenv("STREAM_REPLAY_SIZE", "10000"))       # recent events kept per tenant, 0 disables
+STREAM_REPLAY_LINGER = float(os.getenv("STREAM_REPLAY_LINGER", "300"))   # seconds a tenant's buffer outlives its last subscriber
+STREAM_BACKFILL_MAX = int(os.getenv("STREAM_BACKFILL_MAX", "10000"))     # rows read from audit_logs per resume
+STREAM_BACKFILL_PAGE = 500
+STREAM_BACKFILL_WINDOW = float(os.getenv("STREAM_BACKFILL_WINDOW", "0"))    # seconds re-scanned behind a cursor, opt-in
+STREAM_DEDUPE_SECONDS = 60   # how long live events are checked against a backfill
+
+# Close code for slow consumers, and for a backfill cut at STREAM_BACKFILL_MAX: "Try Again Later"
+SLOW_CONSUMER_CLOSE_CODE = 1013
+
+STREAM_COLUMNS = """
+id, tenant_id, user_id, session_id, ip_address, user_agent, action_type, resource_type,
+resource_id, severity, before_state, after_state, metadata, created_at
+"""
+
+FETCH_LOGS_SQL = f"SELECT {STREAM_COLUMNS} FROM audit_logs WHERE tenant_id = %s AND id = ANY(%s) ORDER BY created_at, id;"
+# The logs of a notification were inserted by one transaction, their created_at is its now():
+# one partition and one index range instead of an id lookup in every partition
+FETCH_LOGS_AT_SQL = f"""
+SELECT {STREAM_COLUMNS} FROM audit_logs WHERE tenant_id = %s AND created_at = %s AND id = ANY(%s) ORDER BY id;
+"""
+
+BACKFILL_SQL = f"""
+SELECT {STREAM_COLUMNS} FROM audit_logs
+WHERE tenant_id = %(tenant_id)s AND created_at >= %(created_at)s AND (created_at, id) > (%(created_at)s, %(id)s)
+  AND (%(severities)s::text[] IS NULL OR severity = ANY(%(severities)s::text[]))
+  AND (%(action_types)s::text[] IS NULL OR action_type = ANY(%(action_types)s::text[]))
+ORDER BY created_at, id
+LIMIT %(limit)s;
+"""
+
+# Each payload gets the transaction's now(), the created_at of the logs it announces
+NOTIFY_SQL = """
+SELECT pg_notify(%s, jsonb_set(payload::jsonb, '{at}', to_jsonb(now()))::text) FROM unnest(%s::text[]) AS payload;
+"""
+
+async def notify_new_logs(curr, logs: List[Tuple[UUID, UUID]]):
+    """
+    Queue the stream notifications of new logs, sent by Postgres when the transaction commits
+    :return: None
+    """
+    if not STREAM_NOTIFY or not logs:
+        return
+    ids_by_tenant: Dict[str, List[str]] = {}
+    for tenant_id, log_id in logs:
+        ids_by_tenant.setdefault(str(tenant_id), []).append(str(log_id))
+    payloads = [json.dumps({"t": tenant_id, "ids": ids[i:i + STREAM_NOTIFY_IDS]})
+                for tenant_id, ids in ids_by_tenant.items()
+                for i in range(0, len(ids), STREAM_NOTIFY_IDS)]
+    await curr.execute(NOTIFY_SQL, (STREAM_CHANNEL, payloads))
+
+def parse_filter(value: Optional[str]) -> Optional[Set[str]]:
+    # "ERROR,critical" -> {"ERROR", "CRITICAL"}
+    if not value:
+        return None
+    return {item.strip().upper() for item in value.split(",") if item.strip()}
+
+class StreamEvent(NamedTuple):
+    # A serialised event, with what filtering and de-duplication need
+    log_id: Optional[str]
+    severity: Optional[str]
+    action_type: Optional[str]
+    text: str
+
+def parse_since(cursor: str) -> Tuple[datetime, UUID]:
+    """
+    Position of a stream cursor, raises ValueError for anything else
+    :return: (created_at, id)
+    """
+    position = parse_cursor(cursor)
+    if len(position) != 2:
+        raise ValueError("Not a stream cursor")
+    return position
+
+def log_event(row: dict) -> StreamEvent:
+    text = dumps({"event": "log", "cursor": encode_cursor(row["created_at"], row["id"]), "data": row}).decode()
+    return StreamEvent(str(row["id"]), row["severity"], row["action_type"], text)
+
+class Subscriber:
+    """
+    One WebSocket connection: its filters, its send queue and its writer task.
+    A resumed connection first sends the replayed events, or the backfill read from since.
+    """
+    def __init__(self, manager: "ConnectionManager", ws: WebSocket, tenant_id: str,
+                 severities: Optional[Set[str]] = None, action_types: Optional[Set[str]] = None,
+                 replay: Optional[List[StreamEvent]] = None, since: Optional[Tuple[datetime, UUID]] = None):
+        self.manager = manager
+        self.ws = ws
+        self.tenant_id = tenant_id
+        self.severities = severities
+        self.action_types = action_types
+        # Bounded by offer(): queue_size, plus what queued up while catching up
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.loop = asyncio.get_running_loop()
+        self.closed = False
+        self.dropped = 0
+        # Sending the replay or the backfill: live events queue up without limit meanwhile,
+        # then the client gets to drain them before the slow consumer policy applies again
+        self.catching_up = bool(replay) or since is not None
+        self.backlog = 0
+        self.writer = self.loop.create_task(self._write(replay or [], since))
+
+    def wants(self, severity: Optional[str], action_type: Optional[str]) -> bool:
+        if self.severities and severity not in self.severities:
+            return False
+        if self.action_types and action_type not in self.action_types:
+            return False
+        return True
+
+    def deliver(self, event: StreamEvent):
+        # Publishers may run on another event loop or thread than the connection
+        try:
+            same_loop = asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            same_loop = False
+        if same_loop:
+            self.offer(event)
+        else:
+            self.loop.call_soon_threadsafe(self.offer, event)
+
+    def offer(self, event: StreamEvent):
+        if self.closed:
+            return
+        if self.catching_up or self.queue.qsize() < self.manager.queue_size + self.backlog:
+            self.queue.put_nowait(event)
+            return
+
+        if self.manager.slow_policy == "drop":
+            # Make room by dropping the oldest message
+            self.queue.get_nowait()
+            self.queue.put_nowait(event)
+            self.dropped += 1
+            self.manager._count("dropped")
+        else:
+            self.manager._count("slow_disconnects")
+            self.close(SLOW_CONSUMER_CLOSE_CODE, "Consumer too slow")
+
+    def close(self, code: int = 1000, reason: str = ""):
+        if self.closed:
+            return
+        self.closed = True
+        self.writer.cancel()
+        self.loop.create_task(self._close(code, reason))
+
+    async def _close(self, code: int, reason: str):
+        try:
+            await self.ws.close(code=code, reason=reason)
+        except Exception:
+            pass
+
+    async def _backfill(self, since: Tuple[datetime, UUID]) -> Optional[Set[str]]:
+        """
+        Send the logs after since from audit_logs, page by page, starting STREAM_BACKFILL_WINDOW
+        seconds before it for the logs of transactions that committed after the cursor's
+        :return: ids sent, or None when STREAM_BACKFILL_MAX was reached and the connection closed
+        """
+        start = (since[0] - timedelta(seconds=STREAM_BACKFILL_WINDOW), UUID(int=0)) if STREAM_BACKFILL_WINDOW else since
+        params = {"tenant_id": UUID(self.tenant_id), "created_at": start[0], "id": start[1],
+                  "severities": sorted(self.severities) if self.severities else None,
+                  "action_types": sorted(self.action_types) if self.action_types else None,
+                  "limit": STREAM_BACKFILL_PAGE}
+        sent: Set[str] = set()
+        while True:
+            async with async_db_cursor() as curr:
+                await curr.execute(BACKFILL_SQL, params)
+                rows = await curr.fetchall()
+            for row in rows:
+                if row["id"] == since[1]:
+                    # The client's own last event
+                    continue
+                event = log_event(row)
+                await self.ws.send_text(event.text)
+                sent.add(event.log_id)
+            self.manager._count("backfilled", len(rows))
+            if len(rows) < STREAM_BACKFILL_PAGE:
+                return sent
+            if len(sent) >= STREAM_BACKFILL_MAX:
+                # The client resumes from its last cursor, live events queued meanwhile are dropped
+                self.close(SLOW_CONSUMER_CLOSE_CODE, "Backfill limit reached, resume from the last cursor")
+                return None
+            params.update(created_at=rows[-1]["created_at"], id=rows[-1]["id"])
+
+    async def _write(self, replay: List[StreamEvent], since: Optional[Tuple[datetime, UUID]]):
+        try:
+            for event in replay:
+                if self.wants(event.severity, event.action_type):
+                    await self.ws.send_text(event.text)
+                    self.manager._count("replayed")
+
+            # The notification of a backfilled log can still be on its way, live events
+            # are checked against the backfill for a while
+            sent: Set[str] = set()
+            if since is not None:
+                sent = await self._backfill(since)
+                if sent is None:
+                    return
+                dedupe_until = time.monotonic() + STREAM_DEDUPE_SECONDS
+
+            if self.catching_up:
+                # The events queued so far come on top of the queue_size limit until sent
+                self.backlog = self.queue.qsize()
+                self.catching_up = False
+
+            while True:
+                event = await self.queue.get()
+                if self.backlog:
+                    self.backlog -= 1
+                if sent:
+                    if event.log_id in sent:
+                        sent.discard(event.log_id)
+                        continue
+                    if time.monotonic() > dedupe_until:
+                        sent = set()
+                await self.ws.send_text(event.text)
+                self.manager._count("delivered")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # The socket is gone, the receive loop of the endpoint cleans up
+            print(f"Stream writer error: {e}")
+            self.closed = True
+
+class ConnectionManager:
+    def __init__(self, queue_size: int = STREAM_QUEUE_SIZE, slow_policy: str = STREAM_SLOW_POLICY,
+                 replay_size: int = STREAM_REPLAY_SIZE, replay_linger: float = STREAM_REPLAY_LINGER):
+        self.queue_size = queue_size
+        self.slow_policy = slow_policy
+        self.replay_size = replay_size
+        self.replay_linger = replay_linger
+        self.active: Dict[str, Set[Subscriber]] = {}
+        # Recent log events per tenant in commit order, fed while the tenant has subscribers
+        # and for replay_linger seconds after the last one left (deadline in lingering)
+        self.replay: Dict[str, Deque[StreamEvent]] = {}
+        self.lingering: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self.counters = {"published": 0, "serialized": 0, "delivered": 0, "dropped": 0, "slow_disconnects": 0,
+                         "resumes": 0, "replayed": 0, "backfilled": 0}
+
+    def _count(self, name: str, value: int = 1):
+        with self._lock:
+            self.counters[name] += value
+
+    async def connect(self, tenant_id: UUID, ws: WebSocket, severities: Optional[Set[str]] = None,
+                      action_types: Optional[Set[str]] = None,
+                      since: Optional[Tuple[datetime, UUID]] = None) -> Subscriber:
+        """
+        Register a subscriber, resumed after the since position when given
+        :return: subscriber
+        """
+        await ws.accept()
+        tenant = str(tenant_id)
+        with self._lock:
+            # Under the lock publish_logs can't slip an event between the replay and the live queue
+            replay = None
+            if since is not None:
+                self.counters["resumes"] += 1
+                replay = self._replay_after(tenant, str(since[1]))
+            subscriber = Subscriber(self, ws, tenant, severities, action_types, replay=replay,
+                                    since=since if replay is None else None)
+            self.active.setdefault(tenant, set()).add(subscriber)
+            self.lingering.pop(tenant, None)
+            if self.replay_size and tenant not in self.replay:
+                self.replay[tenant] = deque(maxlen=self.replay_size)
+        return subscriber
+
+    def _replay_after(self, tenant: str, log_id: str) -> Optional[List[StreamEvent]]:
+        # Events buffered after log_id, None when it is not (or no longer) in the buffer
+        events = self.replay.get(tenant)
+        if not events:
+            return None
+        for position in range(len(events) - 1, -1, -1):
+            if events[position].log_id == log_id:
+                return list(events)[position + 1:]
+        return None
+
+    def disconnect(self, subscriber: Subscriber):
+        with self._lock:
+            conns = self.active.get(subscriber.tenant_id, set())
+            conns.discard(subscriber)
+            if not conns:
+                self.active.pop(subscriber.tenant_id, None)
+                if subscriber.tenant_id in self.replay:
+                    self.lingering[subscriber.tenant_id] = time.monotonic() + self.replay_linger
+        subscriber.closed = True
+        subscriber.writer.cancel()
+
+    def has_subscribers(self, tenant_id) -> bool:
+        """
+        Whether the logs of a tenant are wanted: it has subscribers, or its replay buffer must stay complete
+        :return: bool
+        """
+        tenant = str(tenant_id)
+        if tenant in self.active:
+            return True
+        with self._lock:
+            deadline = self.lingering.get(tenant)
+            if deadline is None:
+                return False
+            if deadline > time.monotonic():
+                return True
+            self.lingering.pop(tenant, None)
+            self.replay.pop(tenant, None)
+            return False
+
+    def reset_replay(self):
+        """
+        Forget the buffered events, once notifications may have been missed they are no longer complete
+        :return: None
+        """
+        with self._lock:
+            self.replay = {tenant: deque(maxlen=self.replay_size) for tenant in self.active} if self.replay_size else {}
+            self.lingering.clear()
+
+    def publish(self, tenant_id, events: Iterable[dict]) -> int:
+        """
+        Hand events to the matching subscribers of a tenant, each event is serialised
+        at most once whatever the number of subscribers
+        :return: number of queued messages
+        """
+        with self._lock:
+            subscribers = list(self.active.get(str(tenant_id), ()))
+        queued = 0
+        for event in events:
+            self._count("published")
+            data = event.get("data") or {}
+            severity, action_type = data.get("severity"), data.get("action_type")
+            serialized = None
+            for subscriber in subscribers:
+                if not subscriber.wants(severity, action_type):
+                    continue
+                if serialized is None:
+                    serialized = StreamEvent(None, severity, action_type, dumps(event).decode())
+                    self._count("serialized")
+                subscriber.deliver(serialized)
+                queued += 1
+        return queued
+
+    def publish_logs(self, tenant_id, rows: List[dict]) -> int:
+        """
+        Publish log rows as cursor-carrying events and keep them in the tenant's replay buffer
+        :return: number of queued messages
+        """
+        events = [log_event(row) for row in rows]
+        tenant = str(tenant_id)
+        with self._lock:
+            self.counters["published"] += len(events)
+            self.counters["serialized"] += len(events)
+            if tenant in self.replay:
+                self.replay[tenant].extend(events)
+            subscribers = list(self.active.get(tenant, ()))
+        queued = 0
+        for event in events:
+            for subscriber in subscribers:
+                if subscriber.wants(event.severity, event.action_type):
+                    subscriber.deliver(event)
+                    queued += 1
+        return queued
+
+    async def broadcast(self, tenant_id: UUID, message: dict):
+        """
+        Send a message to every subscriber of a tenant (this process only)
+        :return: None
+        """
+        self.publish(tenant_id, [{"event": "message", "data": message}])
+
+    async def handle_notification(self, payload: str):
+        """
+        Read the logs of one notification and publish them, skipped when
+        this process has no subscriber for the tenant
+        :return: None
+        """
+        message = json.loads(payload)
+        tenant_id = message["t"]
+        if not self.has_subscribers(tenant_id):
+            return
+        async with async_db_cursor() as curr:
+            if "at" in message:
+                await curr.execute(FETCH_LOGS_AT_SQL, (UUID(tenant_id), datetime.fromisoformat(message["at"]), message["ids"]))
+            else:
+                await curr.execute(FETCH_LOGS_SQL, (UUID(tenant_id), message["ids"]))
+            rows = await curr.fetchall()
+        self.publish_logs(tenant_id, rows)
+
+    def stats(self) -> dict:
+        with self._lock:
+            subscribers = [subscriber for conns in self.active.values() for subscriber in conns]
+            counters = dict(self.counters)
+        return {
+            **counters,
+            "tenants": len(self.active),
+            "subscribers": len(subscribers),
+            "queued": sum(subscriber.queue.qsize() for subscriber in subscribers),
+            "slow_policy": self.slow_policy,
+            "replay_tenants": len(self.replay),
+            "replay_events": sum(len(events) for events in list(self.replay.values())),
+        }
+
+class NotificationListener:
+    """
+    LISTENs on the stream channel with a dedicated connection and feeds the manager
+    """
+    def __init__(self, manager: ConnectionManager, channel: str = STREAM_CHANNEL):
+        self.manager = manager
+        self.channel = channel
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if STREAM_NOTIFY and not self._task:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                async with await psycopg.AsyncConnection.connect(CONNINFO, autocommit=True) as conn:
+                    await conn.execute(f"LISTEN {self.channel};")
+                    # Anything committed before this LISTEN was missed, resumes read it from audit_logs
+                    self.manager.reset_replay()
+                    async for notify in conn.notifies():
+                        try:
+                            await self.manager.handle_notification(notify.payload)
+                        except Exception as e:
+                            print("Stream notification error:", e)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Logs committed while reconnecting are not streamed
+                print("Stream listener error:", e)
+                await asyncio.sleep(1)
+
+manager = ConnectionManager()
+listener = NotificationListener(manager)
@@ -1,9 +1,23 @@
 import pytest
+from cache import response_cache
 from db import conn
+from ratelimit import limiter
 
 @pytest.fixture(scope="function", autouse=True)
 def db_transaction():
     # Start a transaction
-    with conn.transaction():
+    with conn.transaction(force_rollback=True):
         yield
-        # When context exits, rollback transaction if conn.commit() is not called
+        # When context exits, the transaction is always rolled back so tests never leave rows behind
+
+@pytest.fixture(autouse=True)
+def clear_response_cache():
+    # Cached responses would outlive the rolled back rows of the previous test
+    response_cache.clear()
+    yield
+
+@pytest.fixture(autouse=True)
+def reset_rate_limits():
+    # Every test starts with full buckets
+    limiter.store.clear()
+    yield
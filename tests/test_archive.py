@@ -0,0 +1,120 @@
+import csv
+import io
+import json
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+from fastapi.testclient import TestClient
+
+from archive import Archiver
+from auth import generate_mock_jwt
+from db import conn
+from main import app
+from retention import RetentionWorker
+from tests.test_audit_logs import JWT_LOG, test_tenant_id
+
+client = TestClient(app)
+
+token = generate_mock_jwt()
+headers = {"Authorization": f"Bearer {token}"}
+
+OLD_DAY = (datetime.now(timezone.utc) - timedelta(days=60)).replace(hour=10, minute=0, second=0, microsecond=0)
+
+INSERT_SQL = """
+INSERT INTO audit_logs (tenant_id, user_id, session_id, ip_address, user_agent, action_type, resource_type,
+                        resource_id, severity, before_state, after_state, metadata, created_at)
+VALUES (%(tenant_id)s, %(user_id)s, %(session_id)s, %(ip_address)s, %(user_agent)s, %(action_type)s,
+        %(resource_type)s, %(resource_id)s, %(severity)s, %(before_state)s, %(after_state)s, %(metadata)s,
+        %(created_at)s);
+"""
+
+@pytest.fixture
+def archiver(tmp_path):
+    # Rows of the tenant: five on an old day (three row groups), two recent ones
+    with conn.cursor() as curr:
+        curr.execute("DELETE FROM audit_logs WHERE tenant_id = %s;", (test_tenant_id,))
+        for i, action_type in enumerate(["CREATE", "UPDATE", "CREATE", "DELETE", "CREATE"]):
+            curr.execute(INSERT_SQL, {**JWT_LOG, **{key: json.dumps(JWT_LOG[key]) for key in
+                                                    ("before_state", "after_state", "metadata")},
+                                      "action_type": action_type, "resource_id": f"old-{i}",
+                                      "created_at": OLD_DAY + timedelta(seconds=i, microseconds=123)})
+    for _ in range(2):
+        assert client.post("/api/v1/logs/", json=JWT_LOG, headers=headers).status_code == 201
+
+    local = Archiver(uri=str(tmp_path), after_days=30, row_group_size=2)
+    with patch("routers.audit_logs.archiver", local), patch("retention.archiver", local):
+        yield local
+
+def read_all_pages(**params) -> list:
+    logs, cursor = [], None
+    while True:
+        resp = client.get("/api/v1/logs/", params={**params, "limit": 3, **({"cursor": cursor} if cursor else {})},
+                          headers=headers)
+        assert resp.status_code == 200, resp.text
+        logs.extend(resp.json()["data"])
+        cursor = resp.json()["next_cursor"]
+        if not cursor:
+            return logs
+
+def test_archiver_moves_old_days_into_segments(archiver, tmp_path):
+    total = client.get("/api/v1/logs/stats", headers=headers).json()["total_logs"]
+    assert archiver.run_once(conn) == 1
+    assert archiver.run_once(conn) == 0
+
+    with conn.cursor() as curr:
+        curr.execute("SELECT COUNT(*) AS count FROM audit_logs WHERE tenant_id = %s;", (test_tenant_id,))
+        assert curr.fetchone()["count"] == 2
+        curr.execute("SELECT path, rows, action_types FROM archive_segments WHERE tenant_id = %s;", (test_tenant_id,))
+        segment = curr.fetchone()
+    assert segment["rows"] == 5 and segment["action_types"] == {"CREATE": 3, "UPDATE": 1, "DELETE": 1}
+
+    parquet = pq.ParquetFile(tmp_path / segment["path"])
+    index = json.loads(parquet.metadata.metadata[b"audit_logs.index"])
+    assert parquet.num_row_groups == 3 and len(index["row_groups"]) == 3
+    assert index["row_groups"][1]["action_types"] == ["CREATE", "DELETE"]
+    assert parquet.metadata.row_group(0).column(0).compression == "ZSTD"
+    # Archived logs are still counted
+    assert client.get("/api/v1/logs/stats", headers=headers).json()["total_logs"] == total
+
+@pytest.mark.parametrize("params", [{}, {"action_type": "CREATE"}, {"from": OLD_DAY.isoformat()},
+                                    {"to": (OLD_DAY + timedelta(seconds=3)).isoformat()}])
+def test_search_merges_archived_logs(archiver, params):
+    before = read_all_pages(**params)
+    archiver.run_once(conn)
+    after = read_all_pages(**params)
+    assert after == before and len(after) > 1
+    assert archiver.stats()["segments_read"] > 0
+
+@pytest.mark.parametrize("fmt", ["csv", "ndjson", "parquet"])
+def test_export_includes_archived_logs(archiver, fmt):
+    def export() -> list:
+        resp = client.get("/api/v1/logs/export", params={"format": fmt}, headers=headers)
+        assert resp.status_code == 200
+        if fmt == "csv":
+            return [row["id"] for row in csv.DictReader(io.StringIO(resp.text))]
+        if fmt == "ndjson":
+            return [json.loads(line) for line in resp.text.splitlines()]
+        return pq.read_table(pa.BufferReader(resp.content)).to_pylist()
+
+    before = export()
+    archiver.run_once(conn)
+    after = export()
+    # Newest first, the archived logs last. The two recent logs share created_at (one
+    # test transaction), their order is not defined.
+    assert len(after) == 7 and after[2:] == before[2:]
+    assert sorted(map(str, after[:2])) == sorted(map(str, before[:2]))
+
+def test_retention_deletes_archived_segments(archiver, tmp_path):
+    archiver.run_once(conn)
+    assert list(tmp_path.rglob("*.parquet"))
+
+    assert client.delete("/api/v1/logs/cleanup", headers=headers).status_code == 202
+    job = RetentionWorker(pause=0).run_once(conn)
+    # The recent logs were created in this test's transaction, at the job's created_at
+    assert job["deleted"] == 5
+    assert not list(tmp_path.rglob("*.parquet"))
+    assert client.get("/api/v1/logs/stats", headers=headers).json()["total_logs"] == 2
+    assert len(read_all_pages()) == 2
@@ -1,11 +1,16 @@
+import csv
+import gzip
+import io
+import json
 import uuid
+from datetime import datetime, timedelta, timezone
 from uuid import uuid4
 
 import pytest
 from fastapi.testclient import TestClient
-from unittest.mock import patch
 
 from auth import generate_mock_jwt
+from db import conn
 from main import app
 
 client = TestClient(app)
@@ -56,33 +61,83 @@ def test_search_log_empty():
     assert "data" in body
     assert isinstance(body["data"], list)
 
-@patch("routers.audit_logs.index_log_to_opensearch")
-@patch("routers.audit_logs.send_log_to_sqs")
-def test_search_log_after_create(mock_send_log_to_sqs, mock_index_log_to_opensearch):
+def test_search_log_after_create():
     # Create a new record
     resp = client.post("/api/v1/logs/", json=JWT_LOG, headers=headers)
     assert resp.status_code == 201, resp.text
     created = resp.json()
     log_id = created["id"]
-    # Assert send_log_to_sqs were called
-    mock_send_log_to_sqs.assert_called_once()
-    mock_index_log_to_opensearch.assert_called_once()
 
     # Search for newly created log
     resp2 = client.get("/api/v1/logs/", headers=headers)
     data = resp2.json()["data"]
     assert (item["id"] == log_id for item in data)
 
-@patch("routers.audit_logs.index_log_to_opensearch")
-@patch("routers.audit_logs.send_log_to_sqs")
-def test_get_log_stats(mock_send_log_to_sqs, mock_index_log_to_opensearch):
+def test_search_log_keyset_pagination():
+    session_id = f"sess-page-{uuid4()}"
+    payload = [{**JWT_LOG, "session_id": session_id, "resource_id": f"page-{i}"} for i in range(5)]
+    resp = client.post("/api/v1/logs/bulk", json=payload, headers=headers)
+    assert resp.status_code == 201, resp.text
+
+    # Walk the pages until there is no next cursor
+    seen, cursor, pages = [], None, 0
+    while True:
+        params = {"session_id": session_id, "limit": 2}
+        if cursor:
+            params["cursor"] = cursor
+        body = client.get("/api/v1/logs/", params=params, headers=headers).json()
+        seen.extend(item["resource_id"] for item in body["data"])
+        cursor = body["next_cursor"]
+        pages += 1
+        if not cursor:
+            break
+
+    assert pages == 3
+    assert sorted(seen) == [f"page-{i}" for i in range(5)]
+
+def test_search_log_field_projection():
+    session_id = f"sess-fields-{uuid4()}"
+    resp = client.post("/api/v1/logs/", json={**JWT_LOG, "session_id": session_id}, headers=headers)
+    assert resp.status_code == 201, resp.text
+
+    resp2 = client.get("/api/v1/logs/", params={"session_id": session_id, "fields": "action_type,severity"},
+                       headers=headers)
+    assert resp2.status_code == 200
+    assert resp2.json()["data"] == [{"action_type": "CREATE", "severity": "INFO"}]
+
+def test_search_log_full_text_ranked():
+    term = f"refund{uuid4().hex[:8]}"
+    payload = [
+        {**JWT_LOG, "resource_id": "once", "metadata": {"note": f"{term} requested"}},
+        {**JWT_LOG, "resource_id": "thrice", "metadata": {"note": f"{term} {term}", "reason": term}},
+        {**JWT_LOG, "resource_id": "never", "metadata": {"note": "routine update"}},
+    ]
+    resp = client.post("/api/v1/logs/bulk", json=payload, headers=headers)
+    assert resp.status_code == 201, resp.text
+
+    # Best match first, one per page
+    first = client.get("/api/v1/logs/", params={"q": term, "limit": 1}, headers=headers).json()
+    assert [item["resource_id"] for item in first["data"]] == ["thrice"]
+    assert "rank" not in first["data"][0]
+    second = client.get("/api/v1/logs/", params={"q": term, "limit": 1, "cursor": first["next_cursor"]},
+                        headers=headers).json()
+    assert [item["resource_id"] for item in second["data"]] == ["once"]
+    assert second["next_cursor"] is None
+
+    # A ranked cursor cannot continue an unranked search
+    resp2 = client.get("/api/v1/logs/", params={"cursor": first["next_cursor"]}, headers=headers)
+    assert resp2.status_code == 400
+
+@pytest.mark.parametrize("params", [{"fields": "password"}, {"cursor": "not-a-cursor"}])
+def test_search_log_bad_request(params):
+    resp = client.get("/api/v1/logs/", params=params, headers=headers)
+    assert resp.status_code == 400
+
+def test_get_log_stats():
     # Create a new log
     resp1 = client.post("/api/v1/logs/", json=JWT_LOG, headers=headers)
     assert resp1.status_code == 201, resp1.text
     created = resp1.json()
-    # Assert utility functions were called
-    mock_send_log_to_sqs.assert_called_once()
-    mock_index_log_to_opensearch.assert_called_once()
 
     # Retrieve the log stats after the created log
     resp2 = client.get("/api/v1/logs/stats", headers=headers)
@@ -93,9 +148,7 @@ def test_tenant_id_mismatch_when_creating_log():
     resp = client.post("/api/v1/logs/", json=SAMPLE_LOG, headers=headers)
     assert resp.status_code == 403, resp.text # http status 403 for unauthorized access
 
-@patch("routers.audit_logs.index_log_to_opensearch")
-@patch("routers.audit_logs.send_log_to_sqs")
-def test_create_new_log(mock_send_log_to_sqs, mock_index_log_to_opensearch):
+def test_create_new_log():
     test_log = SAMPLE_LOG.copy()
     test_log["tenant_id"] = test_tenant_id
 
@@ -104,17 +157,16 @@ def test_create_new_log(mock_send_log_to_sqs, mock_index_log_to_opensearch):
     assert resp.status_code == 201, resp.text
     created = resp.json()
 
-    # Assert AWS SQS and OpenSearch function are called
-    mock_send_log_to_sqs.assert_called_once()
-    mock_index_log_to_opensearch.assert_called_once()
-
     # Assert that the new log has a auto-generated id and created_at date
     assert "id" in created
     assert "created_at" in created
 
-@patch("routers.audit_logs.index_log_to_opensearch")
-@patch("routers.audit_logs.send_log_to_sqs")
-def test_search_log_by_id_success(mock_send_log_to_sqs, mock_index_log_to_opensearch):
+    # Assert the outbox row for AWS SQS and OpenSearch was written with the log
+    with conn.cursor() as curr:
+        curr.execute("SELECT payload FROM log_outbox WHERE payload->>'id' = %s;", (created["id"],))
+        assert curr.fetchone()["payload"]["resource_id"] == JWT_LOG["resource_id"]
+
+def test_search_log_by_id_success():
     test_log = SAMPLE_LOG.copy()
     test_log["tenant_id"] = test_tenant_id
 
@@ -133,9 +185,8 @@ def test_get_log_by_id_not_found():
     resp = client.get(f"/api/v1/logs/{random_id}", headers=headers)
     assert resp.status_code == 404
 
-@patch("routers.audit_logs.send_log_to_sqs")
 @pytest.mark.parametrize("size", [0, 2])
-def test_create_bulk(mock_send_log_to_sqs, size):
+def test_create_bulk(size):
     """
     :param size: 0, 2
     :return: none
@@ -154,11 +205,72 @@ def test_create_bulk(mock_send_log_to_sqs, size):
         body = resp.json()
         assert "Data inserted" in body
         assert body["Data inserted"] == size
-        assert mock_send_log_to_sqs.call_count == len(payload)
 
-@patch("routers.audit_logs.index_log_to_opensearch")
-@patch("routers.audit_logs.send_log_to_sqs")
-def test_export_logs_to_csv(mock_send_log_to_sqs, mock_index_log_to_opensearch):
+def test_create_bulk_rejects_another_tenant_in_the_batch():
+    payload = [JWT_LOG, {**JWT_LOG, "resource_id": "bulk-other"}, {**SAMPLE_LOG, "resource_id": "bulk-other"}]
+    resp = client.post("/api/v1/logs/bulk", json=payload, headers=headers)
+    assert resp.status_code == 403, resp.text
+
+    # Nothing of the batch was inserted
+    with conn.cursor() as curr:
+        curr.execute("SELECT COUNT(*) AS count FROM audit_logs WHERE resource_id = 'bulk-other';")
+        assert curr.fetchone()["count"] == 0
+
+@pytest.mark.parametrize("gzipped", [False, True])
+def test_ingest_ndjson(gzipped):
+    lines = [json.dumps({**JWT_LOG, "resource_id": f"ndjson-{i}"}) for i in range(3)]
+    lines.insert(1, "{not json")                   # line 2: invalid JSON
+    lines.append(json.dumps(SAMPLE_LOG))           # line 5: another tenant
+    lines.append("")
+    body = "\n".join(lines).encode()
+
+    ingest_headers = {**headers, "Content-Type": "application/x-ndjson"}
+    if gzipped:
+        body = gzip.compress(body)
+        ingest_headers["Content-Encoding"] = "gzip"
+
+    resp = client.post("/api/v1/logs/ingest", content=body, headers=ingest_headers)
+    assert resp.status_code == 201, resp.text
+    result = resp.json()
+    assert result["Data inserted"] == 3
+    assert result["lines"] == 5
+    assert result["rejected"] == 2
+    assert [error["line"] for error in result["errors"]] == [2, 5]
+    assert result["errors"][1]["error"] == "Tenant ID mismatch"
+
+def test_ingest_ndjson_rejects_values_the_columns_cannot_hold():
+    lines = [json.dumps({**JWT_LOG, "resource_id": f"ndjson-{i}"}) for i in range(3)]
+    lines.insert(1, json.dumps({**JWT_LOG, "ip_address": "not-an-ip"}))                    # line 2
+    lines.insert(3, json.dumps({**JWT_LOG, "user_agent": "curl\x00"}))                     # line 4
+    lines.append(json.dumps({**JWT_LOG, "metadata": {"nested": ["a\x00b"]}}))              # line 6
+    lines.append(json.dumps({**JWT_LOG, "action_type": "LOGIN"}))                          # line 7
+    lines.append(json.dumps({**JWT_LOG, "severity": "DEBUG"}))                             # line 8
+    body = "\n".join(lines).encode()
+
+    ingest_headers = {**headers, "Content-Type": "application/x-ndjson"}
+    resp = client.post("/api/v1/logs/ingest", content=body, headers=ingest_headers)
+    # The bad lines are reported, the good ones around them are inserted
+    assert resp.status_code == 201, resp.text
+    result = resp.json()
+    assert result["Data inserted"] == 3
+    assert result["rejected"] == 5
+    assert [error["line"] for error in result["errors"]] == [2, 4, 6, 7, 8]
+    assert result["errors"][0]["error"].startswith("ip_address:")
+    assert result["errors"][1]["error"] == "user_agent: NUL characters are not allowed"
+    assert result["errors"][2]["error"] == "metadata: NUL characters are not allowed"
+    # CHECK constraints of audit_logs
+    assert result["errors"][3]["error"].startswith("action_type:")
+    assert result["errors"][4]["error"].startswith("severity:")
+
+def test_create_log_with_unknown_action_type():
+    resp = client.post("/api/v1/logs/", json={**JWT_LOG, "action_type": "LOGIN"}, headers=headers)
+    assert resp.status_code == 422, resp.text
+
+def test_ingest_ndjson_wrong_content_type():
+    resp = client.post("/api/v1/logs/ingest", json=[JWT_LOG], headers=headers)
+    assert resp.status_code == 415
+
+def test_export_logs_to_csv():
     # Create new log
     test_log = SAMPLE_LOG.copy()
     test_log["tenant_id"] = test_tenant_id
@@ -167,9 +279,6 @@ def test_export_logs_to_csv(mock_send_log_to_sqs, mock_index_log_to_opensearch):
     resp = client.post("/api/v1/logs/", json=JWT_LOG, headers=headers)
     assert resp.status_code == 201, resp.text
 
-    # Assert AWS SQS and OpenSearch function are called
-    mock_send_log_to_sqs.assert_called_once()
-    mock_index_log_to_opensearch.assert_called_once()
 
     # Test export new log
     resp2 = client.get("/api/v1/logs/export", headers=headers)
@@ -177,32 +286,84 @@ def test_export_logs_to_csv(mock_send_log_to_sqs, mock_index_log_to_opensearch):
     assert resp2.headers["content-type"] == "text/csv; charset=utf-8" # charset is auto append by FastAPI
     assert "resource_id" in resp2.text
 
-@patch("routers.audit_logs.index_log_to_opensearch")
-@patch("routers.audit_logs.send_log_to_sqs")
-def test_delete_log_after_create(mock_send_log_to_sqs, mock_index_log_to_opensearch):
+def test_export_logs_time_range():
+    resp = client.post("/api/v1/logs/", json=JWT_LOG, headers=headers)
+    assert resp.status_code == 201, resp.text
+    log_id = resp.json()["id"]
+    tomorrow = (datetime.now(timezone.utc) + timedelta(days=1)).isoformat()
+
+    # Only the header row when the range starts in the future
+    resp2 = client.get("/api/v1/logs/export", params={"from": tomorrow}, headers=headers)
+    assert resp2.status_code == 200
+    rows = list(csv.reader(io.StringIO(resp2.text)))
+    assert rows[0][0] == "id"
+    assert len(rows) == 1
+
+    resp3 = client.get("/api/v1/logs/export", params={"to": tomorrow}, headers=headers)
+    assert log_id in [row[0] for row in csv.reader(io.StringIO(resp3.text))]
+
+def test_export_logs_gzip():
+    resp = client.post("/api/v1/logs/", json=JWT_LOG, headers=headers)
+    assert resp.status_code == 201, resp.text
+
+    resp2 = client.get("/api/v1/logs/export", headers={**headers, "Accept-Encoding": "gzip"})
+    assert resp2.status_code == 200
+    assert resp2.headers["content-encoding"] == "gzip"
+    # The client decompresses transparently
+    assert "resource_id" in resp2.text
+
+def test_export_logs_ndjson():
+    resp = client.post("/api/v1/logs/", json=JWT_LOG, headers=headers)
+    assert resp.status_code == 201, resp.text
+    log_id = resp.json()["id"]
+
+    resp2 = client.get("/api/v1/logs/export", params={"format": "ndjson"}, headers=headers)
+    assert resp2.status_code == 200
+    assert resp2.headers["content-type"] == "application/x-ndjson"
+    logs = [json.loads(line) for line in resp2.text.splitlines()]
+    created = next(log for log in logs if log["id"] == log_id)
+    assert created["after_state"] == JWT_LOG["after_state"]
+
+@pytest.mark.parametrize("fmt", ["parquet", "arrow"])
+def test_export_logs_columnar(fmt):
+    pa = pytest.importorskip("pyarrow")
+    import pyarrow.parquet as pq
+
+    resp = client.post("/api/v1/logs/", json=JWT_LOG, headers=headers)
+    assert resp.status_code == 201, resp.text
+    log_id = resp.json()["id"]
+
+    resp2 = client.get("/api/v1/logs/export", params={"format": fmt}, headers=headers)
+    assert resp2.status_code == 200
+    if fmt == "parquet":
+        table = pq.read_table(pa.BufferReader(resp2.content))
+    else:
+        table = pa.ipc.open_stream(resp2.content).read_all()
+    rows = table.to_pylist()
+    created = next(row for row in rows if row["id"] == log_id)
+    assert json.loads(created["metadata"]) == JWT_LOG["metadata"]
+    assert created["ip_address"] == JWT_LOG["ip_address"]
+    # Tenant scoping applies to every format
+    assert {row["tenant_id"] for row in rows} == {test_tenant_id}
+
+def test_delete_log_after_create():
     # Create a new record
     resp = client.post("/api/v1/logs/", json=JWT_LOG, headers=headers)
     assert resp.status_code == 201, resp.text
     created = resp.json()
     log_id = created["id"]
-    # Assert send_log_to_sqs were called
-    mock_send_log_to_sqs.assert_called_once()
-    mock_index_log_to_opensearch.assert_called_once()
 
     # Delete logs
     resp2 = client.delete("/api/v1/logs/cleanup", headers=headers)
-    assert resp2.status_code == 204
+    assert resp2.status_code == 202
+    # Queued for the retention worker, the deleted rows are never returned
+    assert resp2.json()["status"] == "queued"
 
-@patch("routers.audit_logs.send_log_to_sqs")
-@patch("routers.audit_logs.index_log_to_opensearch")
-def test_delete_log_by_id(mock_send_log_to_sqs, mock_index_log_to_opensearch):
+def test_delete_log_by_id():
     # Create log
     resp = client.post("/api/v1/logs/", json=JWT_LOG, headers=headers)
     log_id = resp.json()["id"]
 
-    # Assert send_log_to_sqs were called
-    mock_send_log_to_sqs.assert_called_once()
-    mock_index_log_to_opensearch.assert_called_once()
 
     # Delete by id
     resp2 = client.delete(f"/api/v1/logs/cleanup/{log_id}", headers=headers)
@@ -215,7 +376,7 @@ def test_delete_log_by_id_not_found():
 
 def test_websocket_log_stream():
     try:
-        with client.websocket_connect(f"/api/v1/logs/stream?tenant_id={test_tenant_id}", timeout=5) as ws:
+        with client.websocket_connect(f"/api/v1/logs/stream?token={token}", timeout=5) as ws:
             # Simulate ping to keep connection alive
             ws.send_text("ping")
     except Exception as e:
@@ -0,0 +1,91 @@
+import time
+from datetime import datetime, timedelta, timezone
+from uuid import UUID
+
+import jwt
+import pytest
+from fastapi.testclient import TestClient
+
+from auth import Claims, TokenVerifier, generate_mock_jwt, verifier
+from main import app
+from tests.test_audit_logs import test_tenant_id
+
+client = TestClient(app)
+
+def make_token(key="secret-1", kid=None, algorithm="HS256", expires_in=3600, **claims) -> str:
+    payload = {"sub": "user123", "tenant_id": test_tenant_id, "role": "admin",
+               "exp": datetime.now(timezone.utc) + timedelta(seconds=expires_in), **claims}
+    return jwt.encode(payload, key, algorithm, headers={"kid": kid} if kid else None)
+
+def test_verified_claims_are_typed_and_cached():
+    local = TokenVerifier(cache_size=10)
+    local.add_key(None, "HS256", "secret-1")
+    token = make_token()
+
+    claims = local.verify(token)
+    assert isinstance(claims, Claims)
+    assert claims.tenant_id == UUID(test_tenant_id) and claims.role == "admin"
+    with pytest.raises(TypeError):
+        claims.payload["role"] = "user"
+
+    assert local.verify(token) is claims
+    assert local.stats()["hits"] == 1 and local.stats()["misses"] == 1
+
+def test_cache_entries_end_with_the_token():
+    local = TokenVerifier(cache_size=10, cache_ttl=300)
+    local.add_key(None, "HS256", "secret-1")
+    token = make_token(expires_in=1)
+    expires_at = local.verify(token).expires_at
+
+    time.sleep(max(0.0, expires_at - time.time()) + 0.05)
+    with pytest.raises(jwt.ExpiredSignatureError):
+        local.verify(token)
+
+def test_invalid_tokens_are_rejected_and_not_cached():
+    local = TokenVerifier(cache_size=10)
+    local.add_key(None, "HS256", "secret-1")
+    for token in (make_token(key="other-secret"), make_token(tenant_id="not-a-uuid"), make_token(expires_in=-10), "not-a.jwt"):
+        with pytest.raises(jwt.PyJWTError):
+            local.verify(token)
+    assert local.stats()["failures"] == 4 and local.stats()["entries"] == 0
+
+def test_key_rotation_by_kid():
+    local = TokenVerifier(cache_size=10)
+    local.add_key("2024", "HS256", "old-secret")
+    local.add_key("2025", "HS256", "new-secret")
+    old, new = make_token(key="old-secret", kid="2024"), make_token(key="new-secret", kid="2025")
+    assert local.verify(old).tenant_id == local.verify(new).tenant_id
+
+    # Retiring a key also drops the tokens it verified from the cache
+    local.remove_key("2024")
+    with pytest.raises(jwt.InvalidKeyError):
+        local.verify(old)
+    assert local.verify(new)
+    with pytest.raises(jwt.InvalidKeyError):
+        local.verify(make_token(key="new-secret", kid="unknown"))
+
+@pytest.mark.parametrize("algorithm", ["RS256", "ES256"])
+def test_asymmetric_keys(algorithm):
+    pytest.importorskip("cryptography")
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import ec, rsa
+
+    private_key = (rsa.generate_private_key(public_exponent=65537, key_size=2048) if algorithm == "RS256"
+                   else ec.generate_private_key(ec.SECP256R1()))
+    public_pem = private_key.public_key().public_bytes(serialization.Encoding.PEM,
+                                                       serialization.PublicFormat.SubjectPublicKeyInfo)
+    local = TokenVerifier(cache_size=10)
+    local.add_key("signer", algorithm, public_pem)
+    assert local.verify(make_token(key=private_key, kid="signer", algorithm=algorithm)).role == "admin"
+
+def test_endpoints_require_a_valid_token():
+    resp = client.get("/api/v1/logs/", headers={"Authorization": f"Bearer {make_token(key='wrong')}"})
+    assert resp.status_code == 401
+
+    before = verifier.stats()["hits"]
+    headers = {"Authorization": f"Bearer {generate_mock_jwt()}"}
+    for _ in range(3):
+        assert client.get("/api/v1/logs/", headers=headers).status_code == 200
+    stats = client.get("/metrics/auth", headers=headers).json()
+    assert stats["hits"] >= before + 2
+    assert 0 < stats["hit_rate"] <= 1
@@ -0,0 +1,97 @@
+import time
+
+from fastapi.testclient import TestClient
+from starlette.requests import Request
+
+from auth import generate_mock_jwt
+from cache import LRUCache, ResponseCache, response_cache
+from main import app
+from tests.test_audit_logs import JWT_LOG, test_tenant_id
+
+client = TestClient(app)
+
+token = generate_mock_jwt()
+headers = {"Authorization": f"Bearer {token}"}
+
+class LocalSharedBackend:
+    """
+    Local stand-in for the shared (Redis) backend, one dict for every cache using it
+    """
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ttl):
+        self.data[key] = value
+
+    def incr(self, key):
+        self.data[key] = int(self.data.get(key) or 0) + 1
+        return self.data[key]
+
+def make_request(query: str) -> Request:
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": [], "query_string": query.encode()})
+
+def test_lru_evicts_oldest_and_expired_entries():
+    evicted = []
+    lru = LRUCache(maxsize=2, ttl=60, on_evict=lambda: evicted.append(1))
+    lru.set("a", 1)
+    lru.set("b", 2)
+    assert lru.get("a") == 1   # "b" is now the least recently used
+    lru.set("c", 3)
+    assert lru.get("b") is None and lru.get("a") == 1 and lru.get("c") == 3
+
+    lru.ttl = 0.01
+    lru.set("d", 4)   # evicts "a"
+    time.sleep(0.02)
+    assert lru.get("d") is None
+    assert len(evicted) == 3
+
+def test_key_normalizes_query_parameters():
+    cache = ResponseCache(ttl=60)
+    assert cache.key("search", "t1", make_request("a=1&b=2")) == cache.key("search", "t1", make_request("b=2&a=1"))
+    assert cache.key("search", "t1", make_request("a=1")) != cache.key("search", "t2", make_request("a=1"))
+
+def test_search_served_from_cache_with_etag():
+    before = response_cache.stats()
+    resp1 = client.get("/api/v1/logs/", params={"limit": 5}, headers=headers)
+    resp2 = client.get("/api/v1/logs/", params={"limit": 5}, headers=headers)
+    assert resp1.status_code == resp2.status_code == 200
+    assert resp1.content == resp2.content
+    assert resp1.headers["etag"] == resp2.headers["etag"]
+
+    after = response_cache.stats()
+    assert after["misses"] == before["misses"] + 1
+    assert after["hits"] == before["hits"] + 1
+
+    # The client already holds this version
+    resp3 = client.get("/api/v1/logs/", params={"limit": 5},
+                       headers={**headers, "If-None-Match": resp1.headers["etag"]})
+    assert resp3.status_code == 304
+    assert resp3.content == b""
+
+def test_writes_invalidate_tenant_entries():
+    stats1 = client.get("/api/v1/logs/stats", headers=headers).json()
+    resp = client.post("/api/v1/logs/", json=JWT_LOG, headers=headers)
+    assert resp.status_code == 201, resp.text
+
+    stats2 = client.get("/api/v1/logs/stats", headers=headers).json()
+    assert stats2["total_logs"] == stats1["total_logs"] + 1
+
+    resp2 = client.delete(f"/api/v1/logs/cleanup/{resp.json()['id']}", headers=headers)
+    assert resp2.status_code == 204
+    assert client.get("/api/v1/logs/stats", headers=headers).json()["total_logs"] == stats1["total_logs"]
+
+def test_shared_backend_between_processes():
+    shared = LocalSharedBackend()
+    cache_a, cache_b = ResponseCache(ttl=60, shared=shared), ResponseCache(ttl=60, shared=shared)
+
+    key = cache_a.key("stats", test_tenant_id, make_request(""))
+    entry = cache_a.set(key, {"total_logs": 1})
+    assert cache_b.get(cache_b.key("stats", test_tenant_id, make_request(""))) == entry
+    assert cache_b.stats()["shared_hits"] == 1
+
+    # A write seen by one process orphans the entries of the other one
+    cache_a.invalidate(test_tenant_id)
+    assert cache_b.get(cache_b.key("stats", test_tenant_id, make_request(""))) is None
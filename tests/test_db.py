@@ -0,0 +1,59 @@
+import asyncio
+from unittest.mock import patch
+
+import schemas
+import db
+from db import TimedAsyncCursor, async_db_cursor, async_pool, stream_copy, stream_rows
+from ingest import bulk_insert_logs
+from rows import LogRow, fetch_log_rows
+from tests.test_audit_logs import JWT_LOG, test_tenant_id
+
+def test_async_pool_path():
+    # Every other test runs the async endpoints' code on a ThreadedCursor over the pinned
+    # connection. This one goes through the AsyncConnectionPool the server uses, in a
+    # transaction that is rolled back. A pool cannot be reopened once closed, so it is
+    # opened and closed once, here.
+    logs = [schemas.Log(**{**JWT_LOG, "resource_id": f"async-{i}"}) for i in range(3)]
+    where = "tenant_id = %s AND resource_id LIKE 'async-%%'"
+
+    async def scenario():
+        await async_pool.open(wait=True, timeout=5)
+        try:
+            async with async_pool.connection() as connection:
+                async with connection.transaction(force_rollback=True):
+                    async with connection.cursor() as curr:
+                        assert isinstance(curr, TimedAsyncCursor)
+                        # Async COPY FROM
+                        assert await bulk_insert_logs(curr, logs, method="copy") == 3
+
+                        # Non-threaded compact fetch
+                        rows = await fetch_log_rows(curr, f"SELECT * FROM audit_logs WHERE {where} "
+                                                          "ORDER BY resource_id;", (test_tenant_id,))
+                        assert all(isinstance(row, LogRow) for row in rows)
+                        assert [row["resource_id"] for row in rows] == ["async-0", "async-1", "async-2"]
+                        assert rows[0]["metadata"] == JWT_LOG["metadata"]
+
+                        # Async named cursor, in chunks
+                        chunks = [chunk async for chunk in stream_rows(
+                            curr, f"SELECT resource_id FROM audit_logs WHERE {where}", (test_tenant_id,),
+                            fetch_size=2)]
+                        assert [len(chunk) for chunk in chunks] == [2, 1]
+
+                        # Async COPY TO
+                        copied = b"".join([block async for block in stream_copy(
+                            curr, f"COPY (SELECT resource_id FROM audit_logs WHERE {where} "
+                                  f"ORDER BY resource_id) TO STDOUT", (test_tenant_id,))])
+                        assert copied == b"async-0\nasync-1\nasync-2\n"
+
+            # The request dependency outside TESTING mode: a pooled async connection
+            with patch("db.IS_TEST", False), patch("db.ASYNC_DB", True):
+                async with async_db_cursor() as curr:
+                    assert isinstance(curr, TimedAsyncCursor)
+                    await curr.execute("SELECT COUNT(*) AS count FROM audit_logs WHERE " + where, (test_tenant_id,))
+                    # The rows above were rolled back
+                    assert (await curr.fetchone())["count"] == 0
+        finally:
+            await async_pool.close()
+
+    asyncio.run(scenario())
+    assert db.async_pool.closed
@@ -0,0 +1,46 @@
+from dispatcher import LogDispatcher
+
+class FakeSink:
+    """
+    Local stand-in for SQS / OpenSearch, fails the first `failures` calls
+    """
+    def __init__(self, failures: int = 0):
+        self.failures = failures
+        self.batches = []
+
+    def __call__(self, batch):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("sink unavailable")
+        self.batches.append(list(batch))
+        return []
+
+def test_dispatcher_delivers_to_every_sink():
+    sqs, opensearch = FakeSink(), FakeSink()
+    dispatcher = LogDispatcher(sinks=[("sqs", sqs), ("opensearch", opensearch)])
+
+    batch = [{"n": i} for i in range(25)]
+    assert dispatcher.deliver(batch) == []
+    assert sqs.batches == [batch]
+    assert opensearch.batches == [batch]
+    assert dispatcher.stats()["delivered"] == {"sqs": 25, "opensearch": 25}
+
+def test_dispatcher_retries_failed_batches():
+    sink = FakeSink(failures=2)
+    dispatcher = LogDispatcher(sinks=[("fake", sink)], backoff=0.001)
+
+    assert dispatcher.deliver([{"n": 1}]) == []
+
+    stats = dispatcher.stats()
+    assert sink.batches == [[{"n": 1}]]
+    assert stats["retries"] == 2
+
+def test_dispatcher_returns_what_a_sink_rejected():
+    log = {"n": 1}
+    dispatcher = LogDispatcher(sinks=[("ok", FakeSink()), ("down", lambda batch: batch)], backoff=0)
+
+    # Given up after max_retries, the caller keeps the failed logs
+    assert dispatcher.deliver([log], max_retries=1) == [log]
+    stats = dispatcher.stats()
+    assert stats["retries"] == 1
+    assert stats["delivered"] == {"ok": 1, "down": 0}
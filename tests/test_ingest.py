@@ -0,0 +1,35 @@
+import asyncio
+
+import pytest
+
+import schemas
+from db import conn, ThreadedCursor
+from ingest import bulk_insert_logs
+from tests.test_audit_logs import JWT_LOG, test_tenant_id
+
+@pytest.mark.parametrize("method", ["copy", "unnest", "executemany"])
+def test_bulk_insert_logs(method):
+    logs = []
+    for i in range(5):
+        entry = JWT_LOG.copy()
+        entry["resource_id"] = f"ingest-{method}-{i}"
+        logs.append(schemas.Log(**entry))
+
+    # Chunks of 2 rows: two full chunks and a remainder
+    with conn.cursor() as curr:
+        inserted = asyncio.run(bulk_insert_logs(ThreadedCursor(curr), logs, chunk_size=2, method=method))
+        assert inserted == 5
+
+        curr.execute("""
+            SELECT resource_id, before_state, metadata FROM audit_logs
+            WHERE tenant_id = %s AND resource_id LIKE %s ORDER BY resource_id;
+        """, (test_tenant_id, f"ingest-{method}-%"))
+        rows = curr.fetchall()
+        assert [row["resource_id"] for row in rows] == [f"ingest-{method}-{i}" for i in range(5)]
+        assert rows[0]["before_state"] == JWT_LOG["before_state"]
+        assert rows[0]["metadata"] == JWT_LOG["metadata"]
+
+        # Every inserted log has its outbox row
+        curr.execute("SELECT COUNT(*) AS count FROM log_outbox WHERE payload->>'resource_id' LIKE %s;",
+                     (f"ingest-{method}-%",))
+        assert curr.fetchone()["count"] == 5
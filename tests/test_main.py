@@ -1,9 +1,78 @@
+import asyncio
+from unittest.mock import AsyncMock, patch
+
+import pytest
 from fastapi.testclient import TestClient
+from psycopg_pool import PoolClosed, PoolTimeout
+
+from auth import generate_mock_jwt, generate_mock_user_jwt
+from db import open_pools
 from main import app
 
 client = TestClient(app)
 
+headers = {"Authorization": f"Bearer {generate_mock_jwt()}"}
+
 def test_read_main():
     response = client.get("/")
     assert response.status_code == 200
-    assert response.json() == {"Hello": "World"}
\ No newline at end of file
+    assert response.json() == {"Hello": "World"}
+
+def test_pool_metrics():
+    response = client.get("/metrics/pool", headers=headers)
+    assert response.status_code == 200
+    body = response.json()
+    assert body["engine"] in ("async", "sync")
+    assert body["sync"]["max_size"] >= body["sync"]["min_size"]
+    assert 0 <= body["sync"]["saturation"] <= 1
+
+@pytest.mark.parametrize("path", ["/metrics", "/metrics/pool", "/metrics/slow"])
+def test_metrics_require_credentials(path):
+    assert client.get(path).status_code in (401, 403)
+    assert client.get(path, headers={"Authorization": "Bearer not-a-jwt"}).status_code == 401
+
+    # Not for every tenant user, their traffic and SQL would leak across tenants
+    user_headers = {"Authorization": f"Bearer {generate_mock_user_jwt()}"}
+    assert client.get(path, headers=user_headers).status_code == 403
+    assert client.get(path, headers=headers).status_code == 200
+
+    # With an operator token set, tenant JWTs are no longer accepted
+    with patch("auth.METRICS_TOKEN", "operator-secret"):
+        assert client.get(path, headers=headers).status_code == 401
+        assert client.get(path, headers={"Authorization": "Bearer operator-secret"}).status_code == 200
+
+def test_liveness_and_readiness():
+    live = client.get("/health/live")
+    assert live.status_code == 200 and live.json() == {"status": "ok"}
+
+    ready = client.get("/health/ready")
+    assert ready.status_code == 200, ready.text
+    assert ready.json() == {"status": "ready", "database": "ok"}
+
+def test_not_ready_while_database_unreachable(capsys):
+    with patch("db._checkout", side_effect=PoolTimeout("couldn't get a connection after 1.00 sec")):
+        ready = client.get("/health/ready")
+    assert ready.status_code == 503
+    # The reason is printed, not sent to the caller
+    assert ready.json() == {"status": "unavailable", "database": "unavailable"}
+    assert "PoolTimeout: couldn't get a connection" in capsys.readouterr().out
+    # Liveness does not depend on the database
+    assert client.get("/health/live").status_code == 200
+
+def test_not_ready_while_async_pool_unavailable():
+    # Outside TESTING mode requests use the async pool, it is checked too
+    with patch("db.IS_TEST", False), patch("db.ASYNC_DB", True), \
+            patch("db.async_pool.connection", side_effect=PoolClosed("the pool is closed")):
+        assert client.get("/health/ready").status_code == 503
+        with patch("db.ASYNC_DB", False):
+            assert client.get("/health/ready").status_code == 200
+
+def test_startup_gives_up_after_bounded_attempts():
+    with patch("db.IS_TEST", False), patch("db.ASYNC_DB", False), patch("db.pool") as pool, \
+            patch("db.async_pool", new_callable=AsyncMock), \
+            patch("db._checkout", side_effect=PoolTimeout("timeout")) as checkout:
+        with pytest.raises(PoolTimeout):
+            asyncio.run(open_pools(attempts=3, timeout=0.01))
+        # Closed again, nothing keeps connecting in the background
+        pool.close.assert_called_once()
+    assert checkout.call_count == 3
@@ -0,0 +1,89 @@
+import asyncio
+from unittest.mock import patch
+
+from botocore.exceptions import ClientError
+from fastapi.testclient import TestClient
+
+from auth import generate_mock_jwt
+from main import app
+from metrics import (DB_DURATION, EXTERNAL_BYTES, EXTERNAL_DURATION, HTTP_DURATION, HTTP_REQUESTS,
+                     Histogram, query_operation)
+from middleware import MetricsMiddleware
+from tests.test_audit_logs import JWT_LOG, test_tenant_id
+from utils import bulk_index_logs_to_opensearch, send_log_to_sqs
+
+client = TestClient(app)
+
+headers = {"Authorization": f"Bearer {generate_mock_jwt()}"}
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram("test_seconds", "Test", ("route",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(("/a",), value)
+
+    assert histogram.render()[2:] == [
+        'test_seconds_bucket{route="/a",le="0.1"} 2',
+        'test_seconds_bucket{route="/a",le="1.0"} 3',
+        'test_seconds_bucket{route="/a",le="+Inf"} 4',
+        'test_seconds_sum{route="/a"} 3.65',
+        'test_seconds_count{route="/a"} 4',
+    ]
+
+def test_metrics_endpoint_labels_route_template_and_tenant():
+    resp = client.post("/api/v1/logs/", json=JWT_LOG, headers=headers)
+    assert resp.status_code == 201, resp.text
+    assert client.get(f"/api/v1/logs/{resp.json()['id']}", headers=headers).status_code == 200
+
+    resp = client.get("/metrics", headers=headers)
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("text/plain")
+    body = resp.text
+    # The template, never the raw path with the id in it
+    assert (f'http_request_duration_seconds_count{{method="GET",route="/api/v1/logs/{{id}}",'
+            f'status="200",tenant="{test_tenant_id}"}}') in body
+    assert 'route="/api/v1/logs/"' in body
+    assert "# TYPE db_query_duration_seconds histogram" in body
+    # Component stats come along as gauges
+    assert "ratelimit_allowed " in body and "auth_hit_rate " in body
+
+def test_unsampled_requests_are_only_counted():
+    async def ok_app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"{}"})
+
+    labels = ("PATCH", "unmatched", "200", "")
+    requests, observed = HTTP_REQUESTS.value(("PATCH",)), HTTP_DURATION.count(labels)
+    scope = {"type": "http", "method": "PATCH", "path": "/nowhere", "headers": []}
+    for sample_rate in (0.0, 1.0):
+        asyncio.run(MetricsMiddleware(ok_app, sample_rate)(dict(scope), None, lambda message: asyncio.sleep(0)))
+
+    assert HTTP_REQUESTS.value(("PATCH",)) == requests + 2
+    assert HTTP_DURATION.count(labels) == observed + 1
+
+def test_db_queries_are_timed_by_operation():
+    assert query_operation("  with recent AS (SELECT 1) SELECT * FROM recent") == "WITH"
+    assert query_operation(b"INSERT INTO audit_logs VALUES (1)") == "INSERT"
+    assert query_operation("VACUUM audit_logs") == "OTHER"
+
+    selects = DB_DURATION.count(("SELECT",))
+    assert client.get("/api/v1/logs/", headers=headers).status_code == 200
+    assert DB_DURATION.count(("SELECT",)) > selects
+
+@patch("utils.opensearch_client")
+@patch("utils.sqs")
+def test_external_calls_are_timed_with_payload_size(mock_sqs, mock_opensearch):
+    mock_opensearch.transport.serializer.dumps.side_effect = lambda data: '{"x": 1}'
+    mock_opensearch.bulk.return_value = {"errors": False}
+    mock_sqs.send_message.side_effect = ClientError({"Error": {"Code": "Throttled"}}, "SendMessage")
+    sizes = EXTERNAL_BYTES.count(("opensearch", "bulk"))
+    bulks = EXTERNAL_DURATION.count(("opensearch", "bulk", "ok"))
+    failures = EXTERNAL_DURATION.count(("sqs", "send_message", "error"))
+
+    assert bulk_index_logs_to_opensearch([{"id": "1"}, {"id": "2"}], "audit-logs") == []
+    # One NDJSON body: action and document line per log
+    assert mock_opensearch.bulk.call_args.kwargs["body"] == '{"x": 1}\n' * 4
+    send_log_to_sqs({"id": "1"})
+
+    assert EXTERNAL_BYTES.count(("opensearch", "bulk")) == sizes + 1
+    assert EXTERNAL_DURATION.count(("opensearch", "bulk", "ok")) == bulks + 1
+    assert EXTERNAL_DURATION.count(("sqs", "send_message", "error")) == failures + 1
@@ -0,0 +1,37 @@
+from uuid import uuid4
+
+import psycopg
+import pytest
+
+from db import CONNINFO
+from migrations import drop_invalid_index
+
+@pytest.fixture
+def scratch_table():
+    # CREATE INDEX CONCURRENTLY needs its own autocommit connection and a regular table
+    name = f"migration_test_{uuid4().hex[:8]}"
+    with psycopg.connect(CONNINFO, autocommit=True) as conn:
+        conn.execute(f"CREATE TABLE public.{name} (n integer)")
+        conn.execute(f"INSERT INTO public.{name} VALUES (1), (1)")
+        try:
+            yield conn, name
+        finally:
+            conn.execute(f"DROP TABLE public.{name}")
+
+def test_invalid_concurrent_index_is_rebuilt(scratch_table):
+    conn, table = scratch_table
+    statement = f"CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS {table}_n ON public.{table} (n)"
+    valid = f"SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass('public.{table}_n')"
+
+    # The duplicates make the build fail half way, leaving an INVALID index
+    with pytest.raises(psycopg.errors.UniqueViolation):
+        conn.execute(statement)
+    assert conn.execute(valid).fetchone() == (False,)
+    # IF NOT EXISTS alone would now succeed without building anything
+    conn.execute(f"DELETE FROM public.{table} WHERE ctid = (SELECT MIN(ctid) FROM public.{table})")
+
+    assert drop_invalid_index(conn, statement)
+    conn.execute(statement)
+    assert conn.execute(valid).fetchone() == (True,)
+    # A valid index is left alone
+    assert not drop_invalid_index(conn, statement)
@@ -0,0 +1,106 @@
+from fastapi.testclient import TestClient
+
+from auth import generate_mock_jwt
+from db import conn
+from dispatcher import LogDispatcher
+from main import app
+from outbox import OutboxRelay
+from tests.test_audit_logs import JWT_LOG
+
+client = TestClient(app)
+
+token = generate_mock_jwt()
+headers = {"Authorization": f"Bearer {token}"}
+
+class LocalSink:
+    """
+    Local stand-in for SQS / OpenSearch, records every delivered log
+    """
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.logs = []
+
+    def __call__(self, batch):
+        if self.fail:
+            return batch
+        self.logs.extend(batch)
+        return []
+
+def make_relay(sqs: LocalSink, opensearch: LocalSink) -> OutboxRelay:
+    publisher = LogDispatcher(sinks=[("sqs", sqs), ("opensearch", opensearch)], backoff=0)
+    return OutboxRelay(publisher=publisher, batch_size=1000)
+
+def pending_outbox_rows(log_id: str) -> list:
+    with conn.cursor() as curr:
+        curr.execute("SELECT attempts FROM log_outbox WHERE payload->>'id' = %s;", (log_id,))
+        return curr.fetchall()
+
+def test_relay_publishes_and_removes_outbox_rows():
+    resp = client.post("/api/v1/logs/", json=JWT_LOG, headers=headers)
+    assert resp.status_code == 201, resp.text
+    log_id = resp.json()["id"]
+    assert len(pending_outbox_rows(log_id)) == 1
+
+    sqs, opensearch = LocalSink(), LocalSink()
+    relay = make_relay(sqs, opensearch)
+    assert relay.run_once(conn) >= 1
+
+    # Both sinks received the log and the outbox row is gone
+    assert log_id in [log["id"] for log in sqs.logs]
+    assert log_id in [log["id"] for log in opensearch.logs]
+    assert pending_outbox_rows(log_id) == []
+    assert relay.stats()["published"] >= 1
+
+def test_relay_keeps_rows_when_a_sink_fails():
+    resp = client.post("/api/v1/logs/bulk", json=[JWT_LOG, JWT_LOG], headers=headers)
+    assert resp.status_code == 201, resp.text
+
+    with conn.cursor() as curr:
+        curr.execute("SELECT payload->>'id' AS id FROM log_outbox ORDER BY id DESC LIMIT 2;")
+        log_ids = [row["id"] for row in curr.fetchall()]
+
+    relay = make_relay(LocalSink(), LocalSink(fail=True))
+    relay.run_once(conn)
+
+    # Rows stay in the outbox and are rescheduled for a later attempt
+    for log_id in log_ids:
+        assert pending_outbox_rows(log_id) == [{"attempts": 1}]
+    assert relay.stats()["failed"] >= 2
+
+def test_claimed_rows_are_leased_while_publishing():
+    resp = client.post("/api/v1/logs/", json=JWT_LOG, headers=headers)
+    assert resp.status_code == 201, resp.text
+    log_id = resp.json()["id"]
+
+    other = LocalSink()
+    seen_by_other = []
+
+    def publish(batch):
+        # A second relay running while the first one publishes skips the claimed rows
+        make_relay(other, LocalSink()).run_once(conn)
+        seen_by_other.extend(log["id"] for log in other.logs)
+        with conn.cursor() as curr:
+            curr.execute("SELECT claimed_at FROM log_outbox WHERE payload->>'id' = %s;", (log_id,))
+            assert curr.fetchone()["claimed_at"] is not None
+        return []
+
+    relay = make_relay(LocalSink(), publish)
+    relay.run_once(conn)
+
+    assert log_id not in seen_by_other
+    assert pending_outbox_rows(log_id) == []
+
+def test_expired_lease_is_claimed_again():
+    resp = client.post("/api/v1/logs/", json=JWT_LOG, headers=headers)
+    assert resp.status_code == 201, resp.text
+    log_id = resp.json()["id"]
+
+    # A relay that died after claiming the row
+    with conn.cursor() as curr:
+        curr.execute("UPDATE log_outbox SET claimed_at = now() - interval '2 minutes' "
+                     "WHERE payload->>'id' = %s;", (log_id,))
+
+    sqs = LocalSink()
+    make_relay(sqs, LocalSink()).run_once(conn)
+    assert log_id in [log["id"] for log in sqs.logs]
+    assert pending_outbox_rows(log_id) == []
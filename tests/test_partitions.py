@@ -0,0 +1,53 @@
+from datetime import datetime, timezone
+
+from fastapi.testclient import TestClient
+
+from auth import generate_mock_jwt
+from db import conn
+from main import app
+from partitions import PartitionMaintainer
+
+client = TestClient(app)
+
+headers = {"Authorization": f"Bearer {generate_mock_jwt()}"}
+
+INSERT_SQL = """
+INSERT INTO audit_logs (tenant_id, action_type, resource_type, resource_id, severity, created_at)
+VALUES (gen_random_uuid(), 'CREATE', 'user', 'partition-test', 'INFO', %s)
+RETURNING id, tableoid::regclass::text AS partition;
+"""
+
+def test_new_partition_takes_its_rows_from_the_default_partition():
+    far = datetime(2099, 5, 17, tzinfo=timezone.utc)
+    with conn.cursor() as curr:
+        curr.execute(INSERT_SQL, (far,))
+        log = curr.fetchone()
+        assert log["partition"] == "audit_logs_default"
+        curr.execute("SELECT COUNT(*) AS count FROM audit_log_rollup_deltas;")
+        deltas = curr.fetchone()["count"]
+
+        curr.execute("SELECT create_audit_log_partitions(%s, %s) AS created;", (far, far))
+        assert curr.fetchone()["created"] == 1
+        curr.execute("SELECT tableoid::regclass::text AS partition FROM audit_logs WHERE id = %s;", (log["id"],))
+        assert curr.fetchone()["partition"] == "audit_logs_p209905"
+        # A move, not a delete and an insert: the rollups are left as they are
+        curr.execute("SELECT COUNT(*) AS count FROM audit_log_rollup_deltas;")
+        assert curr.fetchone()["count"] == deltas
+
+        # Month bounds are UTC
+        curr.execute(INSERT_SQL, (datetime(2099, 5, 31, 23, 59, tzinfo=timezone.utc),))
+        assert curr.fetchone()["partition"] == "audit_logs_p209905"
+        curr.execute(INSERT_SQL, (datetime(2099, 6, 1, tzinfo=timezone.utc),))
+        assert curr.fetchone()["partition"] == "audit_logs_default"
+
+def test_maintainer_creates_partitions_ahead():
+    local = PartitionMaintainer(premake_months=24)
+    assert local.run_once(conn) > 0
+    assert local.run_once(conn) == 0
+    assert local.stats()["runs"] == 2
+
+    resp = client.get("/metrics/partitions", headers=headers)
+    assert resp.status_code == 200
+    names = [partition["name"] for partition in resp.json()["partitions"]]
+    assert f"audit_logs_p{datetime.now(timezone.utc):%Y%m}" in names
+    assert len(names) > 24 and names[-1] == "audit_logs_default"
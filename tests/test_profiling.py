@@ -0,0 +1,133 @@
+import threading
+from unittest.mock import patch
+
+from fastapi.testclient import TestClient
+
+from auth import generate_mock_jwt, generate_mock_user_jwt
+from db import conn
+from main import app
+from middleware import ProfilingMiddleware
+from ingest import INSERT_LOG_SQL
+from profiling import Profile, SlowLog, explain_wanted, slow_log, span
+from streaming import NOTIFY_SQL
+from tests.test_audit_logs import JWT_LOG
+
+client = TestClient(app)
+
+headers = {"Authorization": f"Bearer {generate_mock_jwt()}"}
+
+def find(tree: dict, name: str) -> list:
+    found = [tree] if tree["name"] == name else []
+    for child in tree.get("children", []):
+        found.extend(find(child, name))
+    return found
+
+def test_profiled_request_records_span_tree():
+    assert client.post("/api/v1/logs/", json=JWT_LOG, headers=headers).status_code == 201
+    resp = client.get("/api/v1/logs/?severity=INFO&limit=5", headers={**headers, "X-Profile": "1"})
+    assert resp.status_code == 200
+    timing = resp.headers["server-timing"]
+    assert "auth;dur=" in timing and "sql;dur=" in timing and "total;dur=" in timing
+
+    entries = client.get("/metrics/slow", headers=headers, params={"profile_id": resp.headers["x-profile-id"]}).json()["entries"]
+    assert len(entries) == 1
+    tree = entries[0]["spans"]
+    assert tree["attrs"]["route"] == "/api/v1/logs/"
+    handler = find(tree, "handler")[0]
+    assert [child["name"] for child in handler["children"]] == ["auth", "validation", "endpoint", "serialize"]
+
+    # The search statement: parameter types and row count, never the values
+    statement = find(tree, "sql")[0]["attrs"]
+    assert statement["sql"].startswith("SELECT") and statement["rows"] == 1
+    assert statement["params"] == ["UUID", "str", "int"]
+    assert "INFO" not in str(entries[0])
+
+def test_profile_header_needs_the_operator_credential():
+    # A tenant user cannot make the server profile their requests
+    user_headers = {"Authorization": f"Bearer {generate_mock_user_jwt()}", "X-Profile": "1"}
+    resp = client.get("/api/v1/logs/", headers=user_headers)
+    assert resp.status_code == 200
+    assert "x-profile-id" not in resp.headers
+
+    with patch("auth.METRICS_TOKEN", "operator-secret"):
+        # Nor an admin JWT once the operator token is set
+        resp = client.get("/api/v1/logs/", headers={**headers, "X-Profile": "1"})
+        assert "x-profile-id" not in resp.headers
+        resp = client.get("/api/v1/tenants/", headers={"Authorization": "Bearer operator-secret", "X-Profile": "1"})
+        assert "x-profile-id" in resp.headers
+
+    # X-Profile: 0 opts out of sampling
+    resp = TestClient(ProfilingMiddleware(app, sample_rate=1)).get("/api/v1/logs/", headers={**headers, "X-Profile": "0"})
+    assert "x-profile-id" not in resp.headers
+
+def test_unprofiled_fast_request_is_not_logged():
+    before = slow_log.stats()
+    resp = client.get("/api/v1/logs/", headers=headers)
+    assert resp.status_code == 200
+    assert "server-timing" not in resp.headers
+    assert slow_log.stats() == before
+
+def test_slow_request_is_logged_without_profile():
+    # Every request is slow for this one
+    resp = TestClient(ProfilingMiddleware(app, slow_ms=0)).get("/api/v1/tenants/", headers=headers)
+    assert resp.status_code == 200
+    entry = slow_log.recent("request", limit=1)[0]
+    assert entry["route"] == "/api/v1/tenants/" and entry["status"] == 200 and "spans" not in entry
+
+def test_slow_query_captures_explain_plan():
+    with patch("profiling.SLOW_QUERY_MS", 0), patch("profiling.PROFILE_EXPLAIN", True):
+        with conn.cursor() as curr:
+            curr.execute("SELECT count(*) AS n FROM audit_logs WHERE severity = %(severity)s", {"severity": "INFO"})
+            assert curr.fetchone() == {"n": 0}
+            # Not re-run: ANALYZE would execute the DELETE again
+            curr.execute("DELETE FROM audit_logs WHERE severity = %s", ["NONE"])
+
+    delete, select = slow_log.recent("query", limit=2)
+    assert select["params"] == {"severity": "str"} and select["rows"] == 1
+    assert select["plan"][0]["Plan"]["Node Type"] == "Aggregate"
+    assert delete["sql"].startswith("DELETE") and "plan" not in delete
+
+def test_span_is_a_no_op_outside_a_profile():
+    with span("sql") as outside:
+        assert outside is None
+
+    profile = Profile("test", max_spans=2)
+    token = profile.activate()
+    try:
+        for _ in range(3):
+            with span("sink"):
+                pass
+    finally:
+        profile.finish(token)
+    assert len(profile.root.children) == 2 and profile.to_dict()["dropped_spans"] == 1
+
+def test_explain_skips_statements_with_side_effects():
+    with patch("profiling.PROFILE_EXPLAIN", True):
+        assert explain_wanted("SELECT * FROM audit_logs WHERE action_type = 'UPDATE'", None)
+        assert explain_wanted("WITH recent AS (SELECT id FROM audit_logs) SELECT count(*) FROM recent", None)
+        # A data-modifying CTE would insert the log (and its outbox row) a second time
+        assert not explain_wanted(INSERT_LOG_SQL, None)
+        assert not explain_wanted(NOTIFY_SQL, None)
+        assert not explain_wanted("SELECT id FROM audit_logs FOR UPDATE SKIP LOCKED", None)
+
+def test_executemany_is_recorded():
+    with patch("profiling.SLOW_QUERY_MS", 0):
+        with conn.cursor() as curr:
+            curr.executemany("DELETE FROM audit_logs WHERE severity = %s", [("NONE",), ("OTHER",)])
+    entry = slow_log.recent("query", limit=1)[0]
+    assert entry["sql"].startswith("DELETE") and entry["params"] == ["str"] and entry["rows"] == 0
+
+def test_slow_log_is_written_by_a_background_thread(tmp_path):
+    local = SlowLog(path=str(tmp_path / "slow.log"))
+    threads = []
+    with patch.object(local.listener.handlers[0], "emit",
+                      side_effect=lambda record: threads.append(threading.current_thread())):
+        local.write("query", {"sql": "SELECT 1"})
+        local.close()
+    assert threads and threads[0] is not threading.current_thread()
+    assert local.recent("query")[0]["sql"] == "SELECT 1"
+
+    local = SlowLog(path=str(tmp_path / "slow.log"))
+    local.write("request", {"route": "/"})
+    local.close()
+    assert '"route": "/"' in (tmp_path / "slow.log").read_text()
@@ -0,0 +1,153 @@
+# Query plan regression suite: every audit_logs query issued by the endpoints
+# must be served by an index, never by a sequential scan of a partition, and
+# time-bounded queries must only read the partitions they cover.
+from datetime import datetime, timedelta, timezone
+from uuid import uuid4
+
+import pytest
+
+from db import conn
+from retention import FIRST_POSITION, batch_sql
+from rollups import STATS_SERIES_SQL, STATS_TOTALS_SQL
+from routers.audit_logs import LOG_FIELDS, build_export_filter, build_search_query
+from streaming import BACKFILL_SQL
+
+TENANTS = 200
+ROWS = 40000
+POPULATED = set()   # partitions holding seeded rows, scanning an empty one sequentially is free
+
+# Spread rows over tenants, users, sessions and the last 90 days
+SEED_SQL = """
+INSERT INTO audit_logs
+(tenant_id, user_id, session_id, ip_address, user_agent, action_type, resource_type, resource_id,
+ severity, metadata, created_at)
+SELECT (%(tenants)s)[1 + i %% %(tenant_count)s],
+       (%(users)s)[1 + i %% 200],
+       'session-' || (i %% 1000),
+       '10.0.0.1',
+       'pytest',
+       (ARRAY['CREATE', 'UPDATE', 'DELETE', 'VIEW'])[1 + i %% 4],
+       (ARRAY['user', 'order', 'invoice'])[1 + i %% 3],
+       'resource-' || i,
+       (ARRAY['INFO', 'WARNING', 'ERROR', 'CRITICAL'])[1 + i %% 4],
+       jsonb_build_object('request', i),
+       now() - make_interval(mins => i %% (90 * 24 * 60))
+FROM generate_series(1, %(rows)s) AS i;
+"""
+
+@pytest.fixture(scope="module")
+def seeded():
+    # Outer transaction for the whole module, each test runs in a savepoint inside it
+    tenants = [uuid4() for _ in range(TENANTS)]
+    users = [uuid4() for _ in range(200)]
+    with conn.transaction(force_rollback=True):
+        with conn.cursor() as curr:
+            # Monthly partitions for the seeded range, not the default partition
+            curr.execute("SELECT create_audit_log_partitions(now() - interval '90 days', now());")
+            curr.execute(SEED_SQL, {"tenants": tenants, "tenant_count": TENANTS, "users": users, "rows": ROWS})
+            curr.execute("ANALYZE audit_logs;")
+            curr.execute("SELECT id, tenant_id, user_id, created_at FROM audit_logs LIMIT 1;")
+            sample = curr.fetchone()
+            curr.execute("SELECT DISTINCT tableoid::regclass::text AS name FROM audit_logs;")
+            POPULATED.update(row["name"] for row in curr.fetchall())
+        yield sample
+
+def is_audit_logs(relation: str) -> bool:
+    return relation == "audit_logs" or relation.startswith("audit_logs_p") or relation == "audit_logs_default"
+
+def scans(plan: dict) -> list:
+    """
+    Walk an EXPLAIN (FORMAT JSON) plan tree
+    :return: every node reading audit_logs or one of its partitions
+    """
+    found = []
+    if is_audit_logs(plan.get("Relation Name", "")):
+        found.append(plan)
+    for child in plan.get("Plans", []):
+        found.extend(scans(child))
+    return found
+
+def explain(sql: str, params) -> dict:
+    with conn.cursor() as curr:
+        curr.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+        return curr.fetchone()["QUERY PLAN"][0]["Plan"]
+
+def assert_no_seq_scan(sql: str, params):
+    seq_scans = [node for node in scans(explain(sql, params))
+                 if node["Node Type"] == "Seq Scan" and node["Relation Name"] in POPULATED]
+    assert not seq_scans, f"Sequential scan on audit_logs for:\n{sql}"
+
+def search_cases(sample):
+    now = datetime.now(timezone.utc)
+    return {
+        "no_filter": {},
+        "user_id": {"user_id": sample["user_id"]},
+        "session_id": {"session_id": "session-1"},
+        "action_type": {"action_type": "CREATE"},
+        "severity": {"severity": "ERROR"},
+        "resource_type": {"resource_type": "order"},
+        "q": {"q": "resource-1"},
+        "time_range": {"from_": now - timedelta(days=7), "to": now},
+        "cursor": {"after": (sample["created_at"], sample["id"])},
+        "q_cursor": {"q": "resource-1", "after": (sample["created_at"], sample["id"], 0.05)},
+        "combined": {"action_type": "UPDATE", "severity": "INFO", "from_": now - timedelta(days=30)},
+    }
+
+@pytest.mark.parametrize("case", ["no_filter", "user_id", "session_id", "action_type", "severity",
+                                  "resource_type", "q", "time_range", "cursor", "q_cursor", "combined"])
+def test_search_query_uses_index(seeded, case):
+    sql, params = build_search_query(seeded["tenant_id"], LOG_FIELDS, 100, **search_cases(seeded)[case])
+    assert_no_seq_scan(sql, params)
+
+@pytest.mark.parametrize("sql", [STATS_TOTALS_SQL, STATS_SERIES_SQL])
+def test_stats_queries_skip_audit_logs(seeded, sql):
+    # Stats are served from the rollups alone
+    window = {"tenant_id": seeded["tenant_id"], "from": datetime.now(timezone.utc) - timedelta(days=7),
+              "to": "infinity", "bucket": "day"}
+    assert not scans(explain(sql, window))
+
+@pytest.mark.parametrize("days", [None, 7])
+def test_export_query_uses_index(seeded, days):
+    from_ = datetime.now(timezone.utc) - timedelta(days=days) if days else None
+    where_sql, params = build_export_filter(seeded["tenant_id"], from_=from_)
+    assert_no_seq_scan(f"SELECT * FROM audit_logs WHERE {where_sql} ORDER BY created_at DESC", params)
+
+@pytest.mark.parametrize("severities", [None, ["ERROR", "CRITICAL"]])
+def test_stream_backfill_uses_index(seeded, severities):
+    params = {"tenant_id": seeded["tenant_id"], "created_at": seeded["created_at"], "id": seeded["id"],
+              "severities": severities, "action_types": None, "limit": 500}
+    assert_no_seq_scan(BACKFILL_SQL, params)
+
+@pytest.mark.parametrize("sql", [
+    "SELECT * FROM audit_logs where id = %s AND tenant_id = %s;",
+    "DELETE FROM audit_logs WHERE id = %s AND tenant_id = %s;",
+])
+def test_lookup_by_id_uses_index(seeded, sql):
+    assert_no_seq_scan(sql, (seeded["id"], seeded["tenant_id"]))
+
+@pytest.mark.parametrize("severity, excluded", [(None, []), ("INFO", ["INFO"]), (None, ["INFO"])])
+def test_retention_batch_uses_index(seeded, severity, excluded):
+    after_at, after_id = FIRST_POSITION
+    params = {"tenant_id": seeded["tenant_id"], "severity": severity, "excluded": excluded,
+              "cutoff": datetime.now(timezone.utc) - timedelta(days=30), "limit": 5000,
+              "after_at": after_at, "after_id": after_id}
+    assert_no_seq_scan(batch_sql(severity, excluded), params)
+
+def month_partition(moment: datetime) -> str:
+    return f"audit_logs_p{moment.astimezone(timezone.utc):%Y%m}"
+
+@pytest.mark.parametrize("case", ["time_range", "cursor"])
+def test_time_bounds_prune_partitions(seeded, case):
+    sql, params = build_search_query(seeded["tenant_id"], LOG_FIELDS, 100, **search_cases(seeded)[case])
+    read = {node["Relation Name"] for node in scans(explain(sql, params))}
+    lower = datetime.now(timezone.utc) - timedelta(days=7) if case == "time_range" else seeded["created_at"]
+    # Only the months from the lower bound on. The default partition holds whatever is
+    # past the last partition, so only a bounded range can skip it.
+    assert read and all(name >= month_partition(lower) for name in read - {"audit_logs_default"}), read
+    assert ("audit_logs_default" in read) == (case == "cursor")
+
+def test_export_range_prunes_partitions(seeded):
+    now = datetime.now(timezone.utc)
+    where_sql, params = build_export_filter(seeded["tenant_id"], from_=now - timedelta(days=1), to=now)
+    read = {node["Relation Name"] for node in scans(explain(f"SELECT * FROM audit_logs WHERE {where_sql}", params))}
+    assert read <= {month_partition(now - timedelta(days=1)), month_partition(now)}, read
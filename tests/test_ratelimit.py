@@ -0,0 +1,75 @@
+import json
+import time
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+from uuid import uuid4
+
+import jwt
+from fastapi.testclient import TestClient
+
+from auth import ALGORITHM, SECRET_KEY, generate_mock_jwt
+from main import app
+from ratelimit import Limit, LocalBucketStore, RateLimiter, limiter, route_class
+from tests.test_audit_logs import JWT_LOG, test_tenant_id
+
+client = TestClient(app)
+
+headers = {"Authorization": f"Bearer {generate_mock_jwt()}"}
+
+def other_tenant_headers() -> dict:
+    payload = {"sub": "user456", "tenant_id": str(uuid4()), "role": "admin",
+               "exp": datetime.now(timezone.utc) + timedelta(hours=1)}
+    return {"Authorization": f"Bearer {jwt.encode(payload, SECRET_KEY, ALGORITHM)}"}
+
+def test_token_bucket():
+    store = LocalBucketStore()
+    assert [store.take("t:read", 10, 3, 1) for _ in range(3)] == [0, 0, 0]
+    wait = store.take("t:read", 10, 3, 1)
+    assert 0 < wait <= 0.1
+
+    time.sleep(wait)
+    assert store.take("t:read", 10, 3, 1) == 0
+
+    # A cost above the burst passes on a full bucket, then is paid off
+    assert store.take("t:rows", 10, 5, 8) == 0
+    assert store.take("t:rows", 10, 5, 1) > 0.3
+
+def test_route_classes():
+    assert route_class("POST", "/api/v1/logs/") == "ingest"
+    assert route_class("POST", "/api/v1/logs/bulk") == "ingest"
+    assert route_class("GET", "/api/v1/logs/export") == "export"
+    assert route_class("GET", "/api/v1/logs/stats") == "read"
+    assert route_class("DELETE", "/api/v1/logs/cleanup") == "write"
+    assert route_class("GET", "/metrics/pool") is None
+
+def test_tenant_overrides():
+    local = RateLimiter({"default": {"export": Limit(1, 1)}, test_tenant_id: {"export": None}}, enabled=True)
+    assert [local.check(test_tenant_id, "export") for _ in range(5)] == [0] * 5
+    other = str(uuid4())
+    assert local.check(other, "export") == 0 and local.check(other, "export") > 0
+
+def test_requests_over_the_limit_get_429():
+    with patch.dict(limiter.defaults, {"read": Limit(1, 2)}), patch.object(limiter, "enabled", True):
+        codes = [client.get("/api/v1/logs/stats", headers=headers).status_code for _ in range(3)]
+        assert codes == [200, 200, 429]
+        resp = client.get("/api/v1/logs/stats", headers=headers)
+        assert resp.status_code == 429 and resp.headers["retry-after"] == "1"
+
+        # Limits are per tenant, other routes are not limited
+        assert client.get("/api/v1/logs/stats", headers=other_tenant_headers()).status_code == 200
+        assert client.get("/metrics/pool", headers=headers).status_code == 200
+    assert limiter.stats()["limited_by"]["read"] >= 2
+
+def test_row_quota_counts_ingested_rows():
+    with patch.dict(limiter.defaults, {"rows": Limit(1, 10)}), patch.object(limiter, "enabled", True):
+        resp = client.post("/api/v1/logs/bulk", json=[JWT_LOG] * 6, headers=headers)
+        assert resp.status_code == 201, resp.text
+        # 4 rows left in the bucket
+        resp = client.post("/api/v1/logs/bulk", json=[JWT_LOG] * 5, headers=headers)
+        assert resp.status_code == 429 and int(resp.headers["retry-after"]) >= 1
+
+        body = "\n".join(json.dumps(JWT_LOG) for _ in range(5)).encode()
+        resp = client.post("/api/v1/logs/ingest", content=body,
+                           headers={**headers, "Content-Type": "application/x-ndjson"})
+        assert resp.status_code == 429
+        assert client.post("/api/v1/logs/", json=JWT_LOG, headers=headers).status_code == 201
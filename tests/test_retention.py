@@ -0,0 +1,100 @@
+from datetime import datetime, timedelta, timezone
+
+from fastapi.testclient import TestClient
+
+from auth import generate_mock_jwt, generate_mock_user_jwt
+from db import conn
+from main import app
+from retention import RetentionWorker
+from tests.test_audit_logs import test_tenant_id
+
+client = TestClient(app)
+
+token = generate_mock_jwt()
+headers = {"Authorization": f"Bearer {token}"}
+
+INSERT_SQL = """
+INSERT INTO audit_logs (tenant_id, action_type, resource_type, resource_id, severity, created_at)
+SELECT %s, 'CREATE', 'user', 'retention-test', %s, %s FROM generate_series(1, %s);
+"""
+
+def seed(severity: str, days_ago: float, count: int = 1):
+    with conn.cursor() as curr:
+        curr.execute(INSERT_SQL, (test_tenant_id, severity, datetime.now(timezone.utc) - timedelta(days=days_ago), count))
+
+def tenant_counts() -> dict:
+    with conn.cursor() as curr:
+        curr.execute("SELECT severity, COUNT(*) AS count FROM audit_logs WHERE tenant_id = %s GROUP BY 1;",
+                     (test_tenant_id,))
+        return {row["severity"]: row["count"] for row in curr.fetchall()}
+
+def test_cleanup_queues_a_batched_job():
+    seed("INFO", 1, 5)
+    resp = client.delete("/api/v1/logs/cleanup", headers=headers)
+    assert resp.status_code == 202, resp.text
+    job = resp.json()
+    assert job["status"] == "queued" and job["rules"] == [{"severity": None, "keep_days": 0}]
+    assert resp.headers["location"].endswith(f"/cleanup/jobs/{job['id']}")
+
+    # One job per tenant at a time
+    assert client.delete("/api/v1/logs/cleanup", headers=headers).status_code == 409
+
+    worker = RetentionWorker(batch_size=2, pause=0)
+    done = worker.run_once(conn)
+    assert str(done["id"]) == job["id"] and done["status"] == "done"
+    assert done["deleted"] >= 5 and done["batches"] >= 3
+    assert tenant_counts() == {}
+
+    resp = client.get(f"/api/v1/logs/cleanup/jobs/{job['id']}", headers=headers)
+    assert resp.json()["status"] == "done"
+    assert [j["id"] for j in client.get("/api/v1/logs/cleanup/jobs", headers=headers).json()["data"]] == [job["id"]]
+    assert worker.run_once(conn) is None
+
+def test_policy_keeps_logs_per_severity():
+    with conn.cursor() as curr:
+        curr.execute("DELETE FROM audit_logs WHERE tenant_id = %s;", (test_tenant_id,))
+    seed("INFO", 40, 3)
+    seed("INFO", 10)
+    seed("ERROR", 40)
+    seed("ERROR", 400)
+
+    policy = {"rules": [{"severity": "INFO", "keep_days": 30}, {"keep_days": 365}]}
+    resp = client.put("/api/v1/logs/retention", json=policy, headers=headers)
+    assert resp.status_code == 200, resp.text
+    assert client.get("/api/v1/logs/retention", headers=headers).json()["rules"] == [
+        {"severity": "INFO", "keep_days": 30}, {"severity": None, "keep_days": 365}]
+    assert client.get("/api/v1/logs/stats", headers=headers).json()["total_logs"] == 6
+
+    # The worker queues the policy job itself
+    worker = RetentionWorker(batch_size=2, pause=0)
+    job = worker.run_once(conn)
+    assert job["source"] == "policy" and job["deleted"] == 4
+    assert tenant_counts() == {"INFO": 1, "ERROR": 1}
+    # The delete triggers keep the rollups exact
+    assert client.get("/api/v1/logs/stats", headers=headers).json()["total_logs"] == 2
+
+def test_retention_policy_validation():
+    resp = client.put("/api/v1/logs/retention", json={"rules": [{"keep_days": 30}, {"keep_days": 60}]}, headers=headers)
+    assert resp.status_code == 400
+    resp = client.put("/api/v1/logs/retention", json={"rules": [{"keep_days": 0}]}, headers=headers)
+    assert resp.status_code == 422
+    user_headers = {"Authorization": f"Bearer {generate_mock_user_jwt()}"}
+    resp = client.put("/api/v1/logs/retention", json={"rules": [{"keep_days": 30}]}, headers=user_headers)
+    assert resp.status_code == 403
+
+def test_expired_partitions_are_dropped_with_their_rollups():
+    month = datetime(2001, 1, 1, tzinfo=timezone.utc)
+    with conn.cursor() as curr:
+        curr.execute("SELECT create_audit_log_partitions(%s, %s);", (month, month))
+        curr.execute(INSERT_SQL, (test_tenant_id, "INFO", month + timedelta(days=3), 2))
+    window = {"from": "2001-01-01T00:00:00Z", "to": "2001-02-01T00:00:00Z"}
+    assert client.get("/api/v1/logs/stats", params=window, headers=headers).json()["total_logs"] == 2
+
+    worker = RetentionWorker(max_days=365 * 20)
+    worker.check(conn)
+    assert worker.stats()["partitions_dropped"] >= 1
+    with conn.cursor() as curr:
+        curr.execute("SELECT to_regclass('public.audit_logs_p200101') AS partition;")
+        assert curr.fetchone()["partition"] is None
+    assert client.get("/api/v1/logs/stats", params=window, headers=headers).json()["total_logs"] == 0
+    assert client.get("/metrics/retention", headers=headers).json()["queued"] == 0
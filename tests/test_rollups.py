@@ -0,0 +1,88 @@
+from datetime import datetime, timedelta, timezone
+
+from fastapi.testclient import TestClient
+
+from auth import generate_mock_jwt
+from db import conn
+from main import app
+from rollups import RollupCompactor
+from tests.test_audit_logs import JWT_LOG, test_tenant_id
+
+client = TestClient(app)
+
+token = generate_mock_jwt()
+headers = {"Authorization": f"Bearer {token}"}
+
+def clear_tenant_logs():
+    # Start from an empty tenant, the deletes are rolled back with the test
+    with conn.cursor() as curr:
+        curr.execute("DELETE FROM audit_logs WHERE tenant_id = %s;", (test_tenant_id,))
+
+def get_stats(**params) -> dict:
+    resp = client.get("/api/v1/logs/stats", params=params, headers=headers)
+    assert resp.status_code == 200, resp.text
+    return resp.json()
+
+def counts(rows: list, key: str) -> dict:
+    return {row[key]: row["count"] for row in rows}
+
+def test_stats_counts_new_logs():
+    clear_tenant_logs()
+    payload = [JWT_LOG, JWT_LOG, {**JWT_LOG, "action_type": "DELETE", "severity": "ERROR"}]
+    resp = client.post("/api/v1/logs/bulk", json=payload, headers=headers)
+    assert resp.status_code == 201, resp.text
+
+    stats = get_stats()
+    assert stats["total_logs"] == 3
+    assert counts(stats["by_action"], "action_type") == {"CREATE": 2, "DELETE": 1}
+    assert counts(stats["by_severity"], "severity") == {"INFO": 2, "ERROR": 1}
+    assert stats["bucket"] == "day"
+    assert sum(point["count"] for point in stats["series"]) == 3
+
+def test_stats_unchanged_by_compaction():
+    clear_tenant_logs()
+    resp = client.post("/api/v1/logs/bulk", json=[JWT_LOG] * 4, headers=headers)
+    assert resp.status_code == 201, resp.text
+    before = get_stats(bucket="hour")
+
+    compactor = RollupCompactor()
+    assert compactor.run_once(conn) >= 1
+    with conn.cursor() as curr:
+        assert compactor.backlog(curr) == {"pending_deltas": 0}
+
+    assert get_stats(bucket="hour") == before
+    assert before["total_logs"] == 4
+
+def test_stats_follow_deletes():
+    clear_tenant_logs()
+    resp = client.post("/api/v1/logs/", json=JWT_LOG, headers=headers)
+    assert resp.status_code == 201, resp.text
+    assert get_stats()["total_logs"] == 1
+
+    resp2 = client.delete(f"/api/v1/logs/cleanup/{resp.json()['id']}", headers=headers)
+    assert resp2.status_code == 204
+    stats = get_stats()
+    assert stats["total_logs"] == 0
+    assert stats["by_action"] == [] and stats["series"] == []
+
+def test_stats_time_window():
+    clear_tenant_logs()
+    resp = client.post("/api/v1/logs/", json=JWT_LOG, headers=headers)
+    assert resp.status_code == 201, resp.text
+
+    now = datetime.now(timezone.utc)
+    assert get_stats(**{"from": (now - timedelta(days=1)).isoformat()})["total_logs"] == 1
+    assert get_stats(**{"from": (now - timedelta(days=3)).isoformat(),
+                        "to": (now - timedelta(days=2)).isoformat()})["total_logs"] == 0
+
+def test_stats_bad_window():
+    now = datetime.now(timezone.utc)
+    resp = client.get("/api/v1/logs/stats", headers=headers,
+                      params={"from": now.isoformat(), "to": (now - timedelta(days=1)).isoformat()})
+    assert resp.status_code == 400
+    # A year of hourly buckets is over the limit
+    resp2 = client.get("/api/v1/logs/stats", headers=headers,
+                       params={"from": (now - timedelta(days=365)).isoformat(), "bucket": "hour"})
+    assert resp2.status_code == 400
+    resp3 = client.get("/api/v1/logs/stats", headers=headers, params={"bucket": "minute"})
+    assert resp3.status_code == 422
@@ -0,0 +1,53 @@
+import asyncio
+
+from fastapi.testclient import TestClient
+
+from auth import generate_mock_jwt
+from db import ThreadedCursor, conn
+from main import app
+from rows import LogRow, fetch_log_rows
+from serialization import dumps
+from tests.test_audit_logs import JWT_LOG, test_tenant_id
+
+client = TestClient(app)
+
+token = generate_mock_jwt()
+headers = {"Authorization": f"Bearer {token}"}
+
+def test_log_rows_match_dict_rows():
+    log = {**JWT_LOG, "metadata": {"note": "compact", "tags": ["a", "b"]}, "after_state": None}
+    created = client.post("/api/v1/logs/", json=log, headers=headers)
+    assert created.status_code == 201, created.text
+    sql = "SELECT * FROM audit_logs WHERE tenant_id = %s AND id = %s;"
+    params = (test_tenant_id, created.json()["id"])
+
+    with conn.cursor() as curr:
+        curr.execute(sql, params)
+        expected = curr.fetchone()
+        rows = asyncio.run(fetch_log_rows(ThreadedCursor(curr), sql, params))
+
+    row = rows[0]
+    assert isinstance(row, LogRow)
+    # JSONB is held as the text Postgres sent until a field is read
+    assert isinstance(row._values[row._layout.positions["metadata"]], bytes)
+    assert row["metadata"] == log["metadata"] and row["after_state"] is None
+    assert row == expected and dict(row) == expected and list(row) == list(expected)
+    assert row.get("missing") is None and "severity" in row
+    assert dumps(row) == dumps(expected)
+
+def test_rows_of_a_result_share_their_layout():
+    for i in range(3):
+        assert client.post("/api/v1/logs/", json={**JWT_LOG, "resource_id": f"compact-{i}"},
+                           headers=headers).status_code == 201
+
+    with conn.cursor() as curr:
+        rows = asyncio.run(fetch_log_rows(ThreadedCursor(curr), "SELECT * FROM audit_logs WHERE tenant_id = %s;",
+                                          (test_tenant_id,)))
+    assert len(rows) >= 3
+    assert all(row._layout is rows[0]._layout for row in rows)
+    assert not hasattr(rows[0], "__dict__")
+
+    # Search pages are encoded from them, projected or not
+    resp = client.get("/api/v1/logs/", params={"limit": 2, "fields": "id,metadata"}, headers=headers)
+    assert resp.status_code == 200, resp.text
+    assert [set(log) for log in resp.json()["data"]] == [{"id", "metadata"}] * 2
@@ -0,0 +1,62 @@
+from datetime import datetime, timezone
+from decimal import Decimal
+from ipaddress import IPv4Address, IPv6Address
+from unittest.mock import patch
+from uuid import uuid4
+
+import pytest
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from fastapi.testclient import TestClient
+
+import serialization
+from auth import generate_mock_jwt
+from main import app
+from serialization import dumps
+from tests.test_audit_logs import JWT_LOG
+
+client = TestClient(app)
+
+token = generate_mock_jwt()
+headers = {"Authorization": f"Bearer {token}"}
+
+def log_row() -> dict:
+    # A row as psycopg's dict_row returns it
+    return {
+        "id": uuid4(), "tenant_id": uuid4(), "user_id": None, "session_id": "sess-1",
+        "ip_address": IPv4Address("10.0.0.1"), "user_agent": "agent/1.0 ü", "action_type": "UPDATE",
+        "resource_type": "order", "resource_id": "order-1", "severity": "INFO",
+        "before_state": {"status": "pending", "items": [1, 2.5, None]},
+        "after_state": {"status": "paid", "nested": {"ok": True}},
+        "metadata": None,
+        "created_at": datetime(2026, 1, 2, 3, 4, 5, 678901, tzinfo=timezone.utc),
+    }
+
+@pytest.mark.parametrize("fast", [True, False])
+def test_dumps_matches_jsonable_encoder(fast):
+    """
+    :param fast: orjson, or the json fallback
+    :return: none
+    """
+    payload = {"data": [log_row(), {**log_row(), "ip_address": IPv6Address("::1"), "created_at":
+                                    datetime(2026, 1, 2, tzinfo=timezone.utc)}],
+               "next_cursor": None, "total": Decimal("12"), "ratio": Decimal("0.5")}
+    expected = JSONResponse(jsonable_encoder(payload)).body
+    with patch.object(serialization, "orjson", serialization.orjson if fast else None):
+        assert dumps(payload) == expected
+
+def test_row_endpoints_skip_jsonable_encoder():
+    with patch("fastapi.routing.jsonable_encoder", side_effect=AssertionError("jsonable_encoder called")):
+        created = client.post("/api/v1/logs/", json=JWT_LOG, headers=headers)
+        assert created.status_code == 201, created.text
+        assert created.headers["content-type"] == "application/json"
+
+        fetched = client.get(f"/api/v1/logs/{created.json()['id']}", headers=headers)
+        assert fetched.status_code == 200, fetched.text
+
+        searched = client.get("/api/v1/logs/", params={"limit": 5}, headers=headers)
+        assert searched.status_code == 200, searched.text
+
+    assert fetched.json() == created.json()
+    assert created.json()["ip_address"] == JWT_LOG["ip_address"]
+    assert created.json()["id"] in [log["id"] for log in searched.json()["data"]]
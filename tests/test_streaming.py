@@ -0,0 +1,286 @@
+import asyncio
+import json
+from datetime import datetime, timedelta
+from unittest.mock import patch
+from uuid import UUID
+
+import pytest
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+from auth import generate_mock_jwt
+from cursors import encode_cursor
+from db import conn
+from main import app
+from streaming import STREAM_NOTIFY_IDS, ConnectionManager, StreamEvent, Subscriber, manager, notify_new_logs
+from tests.test_audit_logs import JWT_LOG, test_tenant_id
+
+client = TestClient(app)
+
+token = generate_mock_jwt()
+headers = {"Authorization": f"Bearer {token}"}
+
+STREAM_URL = f"/api/v1/logs/stream?token={token}"
+
+class SlowSocket:
+    """
+    WebSocket stand-in whose client never reads: the first send blocks forever
+    """
+    def __init__(self):
+        self.sent = []
+        self.closed_with = None
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text):
+        self.sent.append(text)
+        await asyncio.Event().wait()
+
+    async def close(self, code=1000, reason=""):
+        self.closed_with = code
+
+class RecordingCursor:
+    def __init__(self):
+        self.calls = []
+
+    async def execute(self, sql, params=None):
+        self.calls.append(params)
+
+def test_stream_receives_notified_logs():
+    resp = client.post("/api/v1/logs/", json=JWT_LOG, headers=headers)
+    assert resp.status_code == 201, resp.text
+    log_id = resp.json()["id"]
+
+    with client.websocket_connect(STREAM_URL) as ws:
+        # What the listener does once the insert commits and Postgres delivers the NOTIFY
+        asyncio.run(manager.handle_notification(json.dumps({"t": test_tenant_id, "ids": [log_id]})))
+        event = ws.receive_json()
+        assert event["event"] == "log"
+        assert event["data"]["id"] == log_id
+        assert event["data"]["resource_id"] == JWT_LOG["resource_id"]
+
+def test_stream_filters():
+    with client.websocket_connect(f"{STREAM_URL}&severity=error,critical&action_type=DELETE") as ws:
+        manager.publish(test_tenant_id, [
+            {"event": "log", "data": {"severity": "INFO", "action_type": "DELETE"}},
+            {"event": "log", "data": {"severity": "ERROR", "action_type": "CREATE"}},
+            {"event": "log", "data": {"severity": "ERROR", "action_type": "DELETE", "resource_id": "match"}},
+        ])
+        assert ws.receive_json()["data"]["resource_id"] == "match"
+
+def test_mock_broadcast_reaches_subscribers():
+    with client.websocket_connect(STREAM_URL) as ws:
+        resp = client.post("/api/v1/logs/mock-broadcast", params={"msg": "hello"}, headers=headers)
+        assert resp.status_code == 200
+        assert ws.receive_json() == {"event": "message", "data": {"message": "hello"}}
+
+def test_events_are_serialized_once():
+    async def scenario():
+        local = ConnectionManager(queue_size=10)
+        sockets = [SlowSocket() for _ in range(3)]
+        for ws in sockets:
+            await local.connect(test_tenant_id, ws)
+        local.publish(test_tenant_id, [{"event": "log", "data": {"id": 1}}])
+        await asyncio.sleep(0)
+        return local, sockets
+
+    local, sockets = asyncio.run(scenario())
+    assert local.counters["serialized"] == 1
+    assert [ws.sent for ws in sockets] == [['{"event":"log","data":{"id":1}}']] * 3
+
+def test_slow_consumer_policies():
+    async def scenario(policy):
+        local = ConnectionManager(queue_size=2, slow_policy=policy)
+        ws = SlowSocket()
+        subscriber = await local.connect(test_tenant_id, ws)
+        local.publish(test_tenant_id, [{"event": "log", "data": {"id": 0}}])
+        await asyncio.sleep(0)   # the writer takes the first message and blocks on it
+        local.publish(test_tenant_id, [{"event": "log", "data": {"id": i}} for i in range(1, 5)])
+        await asyncio.sleep(0)
+        return local, subscriber, ws
+
+    local, subscriber, ws = asyncio.run(scenario("drop"))
+    assert local.counters["dropped"] == 2
+    assert subscriber.queue.qsize() == 2 and not subscriber.closed
+
+    local, subscriber, ws = asyncio.run(scenario("disconnect"))
+    assert local.counters["slow_disconnects"] == 1
+    assert subscriber.closed and ws.closed_with == 1013
+
+class GatedSocket:
+    """
+    WebSocket stand-in whose sends wait until the gate opens
+    """
+    def __init__(self):
+        self.sent = []
+        self.gate = asyncio.Event()
+
+    async def send_text(self, text):
+        await self.gate.wait()
+        self.sent.append(text)
+
+    async def close(self, code=1000, reason=""):
+        pass
+
+def test_catching_up_subscriber_is_not_a_slow_consumer():
+    def event(text):
+        return StreamEvent(text, "INFO", "CREATE", text)
+
+    async def scenario():
+        local = ConnectionManager(queue_size=2)   # "disconnect" policy
+        ws = GatedSocket()
+        subscriber = Subscriber(local, ws, test_tenant_id, replay=[event("replayed")])
+        await asyncio.sleep(0)   # the writer is sending the replay
+        for i in range(5):
+            subscriber.offer(event(str(i)))
+        assert not subscriber.closed
+
+        # Once caught up, what queued meanwhile is sent before the limit applies again
+        ws.gate.set()
+        await asyncio.sleep(0.01)
+        return local, subscriber, ws
+
+    local, subscriber, ws = asyncio.run(scenario())
+    assert ws.sent == ["replayed", "0", "1", "2", "3", "4"]
+    assert not subscriber.closed and local.counters["slow_disconnects"] == 0
+    assert subscriber.backlog == 0
+
+def test_notifications_are_chunked_per_tenant():
+    other_tenant = "00000000-0000-0000-0000-000000000001"
+    logs = [(test_tenant_id, f"id-{i}") for i in range(STREAM_NOTIFY_IDS + 1)] + [(other_tenant, "id-x")]
+    curr = RecordingCursor()
+    asyncio.run(notify_new_logs(curr, logs))
+
+    channel, payloads = curr.calls[0]
+    messages = [json.loads(payload) for payload in payloads]
+    assert [(message["t"], len(message["ids"])) for message in messages] == [
+        (test_tenant_id, STREAM_NOTIFY_IDS), (test_tenant_id, 1), (other_tenant, 1)]
+    assert max(len(payload) for payload in payloads) < 8000
+
+def create_logs(count: int) -> list:
+    logs = []
+    for _ in range(count):
+        resp = client.post("/api/v1/logs/", json=JWT_LOG, headers=headers)
+        assert resp.status_code == 201, resp.text
+        logs.append(resp.json())
+    return logs
+
+def notify(logs: list):
+    asyncio.run(manager.handle_notification(json.dumps({"t": test_tenant_id, "ids": [log["id"] for log in logs]})))
+
+def test_stream_resumes_from_replay_buffer():
+    first, *missed = create_logs(3)
+    with client.websocket_connect(STREAM_URL) as ws:
+        notify([first])
+        cursor = ws.receive_json()["cursor"]
+
+    # Published while the client is away, the tenant's buffer keeps them
+    notify(missed)
+    replayed = manager.counters["replayed"]
+    with client.websocket_connect(f"{STREAM_URL}&since={cursor}") as ws:
+        # One notification is published in (created_at, id) order, the logs share created_at
+        assert [ws.receive_json()["data"]["id"] for _ in missed] == sorted(log["id"] for log in missed)
+    assert manager.counters["replayed"] == replayed + 2
+
+def test_stream_backfills_from_audit_logs_without_duplicates():
+    logs = create_logs(3)
+    manager.reset_replay()   # e.g. another worker or a restart: the cursor is not buffered here
+    # Logs of one transaction share created_at, start before all of them
+    since = encode_cursor(datetime.fromisoformat(logs[0]["created_at"]), UUID(int=0))
+
+    with client.websocket_connect(f"{STREAM_URL}&since={since}") as ws:
+        # The live notification of a backfilled log arrives late, then a new message
+        notify(logs[:1])
+        client.post("/api/v1/logs/mock-broadcast", params={"msg": "live"}, headers=headers)
+        received = []
+        while True:
+            event = ws.receive_json()
+            if event["event"] == "message":
+                break
+            received.append(event["data"]["id"])
+
+    assert sorted(received) == sorted(log["id"] for log in logs)
+    assert received == sorted(received)   # (created_at, id) order
+
+def test_stream_backfill_rescans_behind_the_cursor():
+    late, last = [log["id"] for log in create_logs(2)]
+    manager.reset_replay()
+    # Committed after the client's last event by a transaction that started 5 seconds earlier
+    with conn.cursor() as curr:
+        curr.execute("UPDATE audit_logs SET created_at = created_at - interval '5 seconds' WHERE id = %s "
+                     "RETURNING created_at;", (late,))
+        last_created_at = curr.fetchone()["created_at"] + timedelta(seconds=5)
+    since = encode_cursor(last_created_at, UUID(last))
+
+    with patch("streaming.STREAM_BACKFILL_WINDOW", 30):
+        with client.websocket_connect(f"{STREAM_URL}&since={since}") as ws:
+            client.post("/api/v1/logs/mock-broadcast", params={"msg": "live"}, headers=headers)
+            received = []
+            while True:
+                event = ws.receive_json()
+                if event["event"] == "message":
+                    break
+                received.append(event["data"]["id"])
+
+    assert late in received
+    # The client's own last event is not sent again
+    assert last not in received
+
+    # Off by default
+    with client.websocket_connect(f"{STREAM_URL}&since={since}") as ws:
+        client.post("/api/v1/logs/mock-broadcast", params={"msg": "live"}, headers=headers)
+        assert ws.receive_json()["event"] == "message"
+
+def test_stream_backfill_limit_closes_for_resume():
+    logs = create_logs(3)
+    manager.reset_replay()
+    since = encode_cursor(datetime.fromisoformat(logs[0]["created_at"]), UUID(int=0))
+
+    with patch("streaming.STREAM_BACKFILL_PAGE", 1), patch("streaming.STREAM_BACKFILL_MAX", 2):
+        with client.websocket_connect(f"{STREAM_URL}&since={since}") as ws:
+            events = [ws.receive_json(), ws.receive_json()]
+            with pytest.raises(WebSocketDisconnect) as closed:
+                ws.receive_json()
+    assert closed.value.code == 1013
+    assert events[0]["cursor"] != events[1]["cursor"]
+
+@pytest.mark.parametrize("query", ["", "?token=not-a-jwt", f"?tenant_id={test_tenant_id}"])
+def test_stream_requires_a_valid_token(query):
+    with pytest.raises(WebSocketDisconnect) as closed:
+        with client.websocket_connect(f"/api/v1/logs/stream{query}") as ws:
+            ws.receive_json()
+    assert closed.value.code == 1008
+
+def test_stream_tenant_comes_from_the_token():
+    # In the Authorization header, as non-browser clients send it
+    with client.websocket_connect(f"/api/v1/logs/stream?tenant_id={test_tenant_id}", headers=headers) as ws:
+        client.post("/api/v1/logs/mock-broadcast", params={"msg": "header"}, headers=headers)
+        assert ws.receive_json()["data"] == {"message": "header"}
+
+    other_tenant = "00000000-0000-0000-0000-000000000001"
+    with pytest.raises(WebSocketDisconnect) as closed:
+        with client.websocket_connect(f"{STREAM_URL}&tenant_id={other_tenant}") as ws:
+            ws.receive_json()
+    assert closed.value.code == 1008
+
+def test_mock_broadcast_requires_a_token():
+    assert client.post("/api/v1/logs/mock-broadcast", params={"msg": "x"}).status_code in (401, 403)
+
+def test_stream_rejects_invalid_cursor():
+    with pytest.raises(WebSocketDisconnect) as closed:
+        with client.websocket_connect(f"{STREAM_URL}&since=not-a-cursor") as ws:
+            ws.receive_json()
+    assert closed.value.code == 1008
+
+def test_notification_timestamp_narrows_the_fetch():
+    log, = create_logs(1)
+    with client.websocket_connect(STREAM_URL) as ws:
+        # "at" is the inserting transaction's now(), added by NOTIFY_SQL: the logs' created_at
+        other = {"t": test_tenant_id, "ids": [log["id"]], "at": "2001-01-01T00:00:00+00:00"}
+        asyncio.run(manager.handle_notification(json.dumps(other)))
+        asyncio.run(manager.handle_notification(json.dumps({**other, "at": log["created_at"]})))
+        client.post("/api/v1/logs/mock-broadcast", params={"msg": "end"}, headers=headers)
+        # Nothing matched the wrong timestamp
+        assert ws.receive_json()["data"]["id"] == log["id"]
+        assert ws.receive_json()["event"] == "message"
@@ -32,7 +32,7 @@ def test_search_tenant_fail_unauthorized():
     resp = client.get("/api/v1/tenants/", headers=headers_user)
     assert resp.status_code == 403, resp.text
 
-@patch("routers.audit_logs.index_log_to_opensearch")
+@patch("routers.tenants.index_log_to_opensearch")
 @patch("routers.tenants.send_log_to_sqs")
 def test_search_tenant_after_create(mock_send_log_to_sqs, mock_index_log_to_opensearch):
     # Create a new record
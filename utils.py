@@ -1,31 +1,119 @@
-import boto3, json
+import os
+import threading
+from contextlib import contextmanager
+from typing import List
 from botocore.exceptions import ClientError
-from opensearchpy import OpenSearch
 
-# Setup Amazon SQS
-sqs = boto3.client("sqs", region_name="ap-northeast-1")
-QUEUE_URL = "https://sqs.ap-northeast-1.amazon.aws.com/YOUR-ACCOUNT-ID/audit-log-queue" # Update account id and url
+from metrics import external_call
+from profiling import span
+from serialization import dumps
 
-# OpenSearch client
-opensearch_client = OpenSearch(
-    hosts=[{"host": "localhost", "port": 9200}],
-    http_compress=True,
-    use_ssl=False
-)
+# Amazon SQS and OpenSearch, configured from the environment. The clients (and boto3 /
+# opensearch-py themselves) are created on first use, not when this module is imported
+AWS_REGION = os.getenv("AWS_REGION", "ap-northeast-1")
+QUEUE_URL = os.getenv("SQS_QUEUE_URL", "https://sqs.ap-northeast-1.amazon.aws.com/YOUR-ACCOUNT-ID/audit-log-queue")
+OPENSEARCH_HOST = os.getenv("OPENSEARCH_HOST", "localhost")
+OPENSEARCH_PORT = int(os.getenv("OPENSEARCH_PORT", "9200"))
+OPENSEARCH_USE_SSL = os.getenv("OPENSEARCH_USE_SSL", "0") == "1"
+
+sqs = None
+opensearch_client = None
+_clients_lock = threading.Lock()
+
+def get_sqs():
+    global sqs
+    if sqs is None:
+        with _clients_lock:
+            if sqs is None:
+                import boto3
+                sqs = boto3.client("sqs", region_name=AWS_REGION)
+    return sqs
+
+def get_opensearch():
+    global opensearch_client
+    if opensearch_client is None:
+        with _clients_lock:
+            if opensearch_client is None:
+                from opensearchpy import OpenSearch
+                opensearch_client = OpenSearch(
+                    hosts=[{"host": OPENSEARCH_HOST, "port": OPENSEARCH_PORT}],
+                    http_compress=True,
+                    use_ssl=OPENSEARCH_USE_SSL
+                )
+    return opensearch_client
+
+@contextmanager
+def sink_call(service: str, operation: str, payload_size: int):
+    # Timed in the external call metrics, and as a span of a profiled request
+    with external_call(service, operation, payload_size), span(service, operation=operation, bytes=payload_size):
+        yield
 
 def send_log_to_sqs(log_data: dict):
+    body = dumps(log_data).decode()
     try:
-        sqs.send_message(
-            QueueUrl=QUEUE_URL,
-            MessageBody=json.dumps(log_data)
-        )
+        with sink_call("sqs", "send_message", len(body)):
+            get_sqs().send_message(
+                QueueUrl=QUEUE_URL,
+                MessageBody=body
+            )
     except ClientError as e:
         print("SQS error:", e)
 
 def index_log_to_opensearch(log: dict, index: str):
-    response = opensearch_client.index(
-        index=index,
-        body=log
-    )
+    # Serialised here once, to know the payload size
+    client = get_opensearch()
+    body = client.transport.serializer.dumps(log)
+    with sink_call("opensearch", "index", len(body)):
+        response = client.index(
+            index=index,
+            body=body
+        )
+
+    return response
+
+# SQS accepts at most 10 messages per send_message_batch call
+SQS_BATCH_LIMIT = 10
+
+def send_logs_to_sqs_batch(logs: List[dict]) -> List[dict]:
+    """
+    Send logs to SQS, 10 messages per call
+    :return: logs that were not accepted (to be retried)
+    """
+    failed = []
+    for start in range(0, len(logs), SQS_BATCH_LIMIT):
+        chunk = logs[start:start + SQS_BATCH_LIMIT]
+        entries = [{"Id": str(i), "MessageBody": dumps(log).decode()} for i, log in enumerate(chunk)]
+        try:
+            with sink_call("sqs", "send_message_batch", sum(len(entry["MessageBody"]) for entry in entries)):
+                response = get_sqs().send_message_batch(QueueUrl=QUEUE_URL, Entries=entries)
+        except ClientError as e:
+            print("SQS error:", e)
+            failed.extend(chunk)
+            continue
+        failed.extend(chunk[int(entry["Id"])] for entry in response.get("Failed", []))
+
+    return failed
+
+def bulk_index_logs_to_opensearch(logs: List[dict], index: str) -> List[dict]:
+    """
+    Index logs with a single _bulk request, documents with an id are indexed idempotently
+    :return: logs that were rejected (to be retried)
+    """
+    client = get_opensearch()
+    serializer = client.transport.serializer
+    lines = []
+    for log in logs:
+        action = {"_index": index}
+        if log.get("id"):
+            action["_id"] = log["id"]
+        lines.append(serializer.dumps({"index": action}))
+        lines.append(serializer.dumps(log))
+    # The NDJSON body the client would build from a list, built here to know its size
+    body = "\n".join(lines) + "\n"
+
+    with sink_call("opensearch", "bulk", len(body)):
+        response = client.bulk(body=body)
+    if not response.get("errors"):
+        return []
 
-    return response
\ No newline at end of file
+    return [log for log, item in zip(logs, response["items"]) if item["index"].get("error")]